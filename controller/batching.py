@@ -0,0 +1,91 @@
+"""Tick-based batching of samples into columnar WebSocket frames"""
+import asyncio
+
+import settings
+from encoding import SampleFrame
+
+VALUE_CHANNEL = 'value'  # Column name for unnamed samples (numeric lists and scalars)
+
+
+class SampleBatcher:
+    """Collects the samples of one tick into a single columnar frame.
+
+    A frame looks like ``{"t": [...], "heart_rate": [...], ...}`` where ``t``
+    is the index of each sample in the run. The first sample of a tick arms
+    a timer, so nothing wakes up while a run is idle. A sample with a
+    different set of channels flushes the frame collected so far, keeping
+    the columns aligned. With ``rate`` 0 every message is sent right away.
+    """
+
+    def __init__(self, publish, rate=None):
+        self.rate = settings.EMIT_RATE_HZ if rate is None else rate
+        self.sample_index = 0
+        self._publish = publish
+        self._t = []
+        self._columns = None  # Channel name -> values of the current frame
+        self._timer = None
+
+    def add(self, sample):
+        """Add one sample given as a {channel: value} dict"""
+        if self._columns is not None and self._columns.keys() != sample.keys():
+            self.flush()
+        if self._columns is None:
+            self._columns = {name: [] for name in sample}
+        self._t.append(self.sample_index)
+        self.sample_index += 1
+        for name, value in sample.items():
+            self._columns[name].append(value)
+        self._schedule()
+
+    def extend(self, name, values):
+        """Add consecutive samples of a single channel"""
+        if self._columns is not None and list(self._columns) != [name]:
+            self.flush()
+        if self._columns is None:
+            self._columns = {name: []}
+        start = self.sample_index
+        self.sample_index += len(values)
+        self._t.extend(range(start, self.sample_index))
+        self._columns[name].extend(values)
+        self._schedule()
+
+    def _schedule(self):
+        if self.rate <= 0:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(1.0 / self.rate, self.flush)
+
+    def flush(self):
+        """Publish the frame collected so far, if any"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._t:
+            return
+        frame = SampleFrame(t=self._t)
+        frame.update(self._columns)
+        self._t = []
+        self._columns = None
+        self._publish(frame)
+
+    def reset(self):
+        """Drop pending samples and restart the sample index for a new run"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._t = []
+        self._columns = None
+        self.sample_index = 0
+
+
+def add_message(batcher, data):
+    """Add one decoded MATLAB data message: a named value, a struct of channels, a vector or a scalar"""
+    if isinstance(data, dict) and 'name' in data and 'value' in data:
+        batcher.add({data['name']: data['value']})
+    elif isinstance(data, dict):
+        batcher.add(data)
+    elif isinstance(data, list):
+        if data:  # Scripts returning nothing send their empty result as []
+            batcher.extend(VALUE_CHANNEL, data)
+    elif isinstance(data, (int, float)):
+        batcher.add({VALUE_CHANNEL: data})
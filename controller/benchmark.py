@@ -0,0 +1,314 @@
+"""End-to-end load and latency benchmark of the controller.
+
+Drives N concurrent WebSocket clients, each running its own session, and
+reports sample throughput, sample latency (MATLAB send to client receive,
+from the ``sent_at`` stamp of matlab_standin.py), update and stop
+acknowledgment latency and the controller's CPU and memory use.
+
+    python benchmark.py --spawn --clients 8 --duration 30
+
+starts matlab_standin.py and the controller on local ports, so no MATLAB
+license or Docker is needed. Without ``--spawn`` it runs against an
+already running controller (``--url``, and ``--pid`` for CPU/RSS).
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+import numpy as np  # type: ignore
+
+from encoding import decode_binary
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class ClientStats:
+    """Measurements of one benchmark client"""
+
+    def __init__(self):
+        self.samples = 0
+        self.frames = 0
+        self.latencies = []
+        self.update_acks = []
+        self.stop_acks = []
+        self.start_ack = None
+        self.errors = []
+
+
+class ProcessSampler:
+    """CPU time and resident memory of a process, read from /proc (Linux only)"""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.rss = []
+        self._cpu_start = None
+        self._wall_start = None
+        self.cpu_percent = None
+
+    def _cpu_seconds(self):
+        with open(f'/proc/{self.pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')  # utime + stime
+
+    def _rss_mb(self):
+        with open(f'/proc/{self.pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+        return None
+
+    def start(self):
+        self._cpu_start = self._cpu_seconds()
+        self._wall_start = time.monotonic()
+
+    def sample(self):
+        self.rss.append(self._rss_mb())
+
+    def finish(self):
+        self.cpu_percent = 100 * (self._cpu_seconds() - self._cpu_start) / (time.monotonic() - self._wall_start)
+
+    async def run(self, interval=0.5):
+        try:
+            while True:
+                self.sample()
+                await asyncio.sleep(interval)
+        except OSError:
+            pass  # Process went away
+
+
+def _handle_frame(frame, stats, measuring):
+    count = len(frame.get('t', ()))
+    if not measuring:
+        return
+    stats.frames += 1
+    stats.samples += count
+    if 'sent_at' in frame:
+        now = time.time()
+        stats.latencies.extend(now - sent for sent in frame['sent_at'] if sent is not None)
+
+
+async def run_client(http, args, stats, measure_from, deadline):
+    """One client: start a session, update it periodically, then stop it"""
+    url = f"{args.url}?encoding={args.encoding}&dtype=float64"
+    async with http.ws_connect(url, max_msg_size=0) as ws:
+        loop = asyncio.get_running_loop()
+        pending = {}  # Awaited status -> time the command was sent
+        started = loop.create_future()
+        stopped = loop.create_future()
+
+        async def receive():
+            async for msg in ws:
+                measuring = loop.time() >= measure_from
+                if msg.type == aiohttp.WSMsgType.BINARY:
+                    _handle_frame(decode_binary(msg.data), stats, measuring)
+                    continue
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    continue
+                message = json.loads(msg.data)
+                # Status and error messages first; only what remains is a sample frame
+                if 'error' in message:
+                    stats.errors.append(message['error'])
+                elif 'status' in message:
+                    if message['status'] not in pending:
+                        continue
+                    latency = loop.time() - pending.pop(message['status'])
+                    if message['status'] == 'started':
+                        stats.start_ack = latency
+                        started.set_result(True)
+                    elif message['status'] == 'updated':
+                        stats.update_acks.append(latency)
+                    elif message['status'] == 'stopped':
+                        stats.stop_acks.append(latency)
+                        stopped.set_result(True)
+                elif isinstance(message.get('t'), list):
+                    _handle_frame(message, stats, measuring)
+
+        receiver = asyncio.create_task(receive())
+        try:
+            pending['started'] = loop.time()
+            await ws.send_json({'type': 'start', 'script': args.script, 'params': args.params})
+            await asyncio.wait_for(started, args.timeout)
+            while loop.time() + args.update_interval < deadline:
+                await asyncio.sleep(args.update_interval)
+                if 'updated' not in pending:
+                    pending['updated'] = loop.time()
+                    await ws.send_json({'type': 'update', 'params': args.params})
+            await asyncio.sleep(max(0.0, deadline - loop.time()))
+            pending['stopped'] = loop.time()
+            await ws.send_json({'type': 'stop'})
+            await asyncio.wait_for(stopped, args.timeout)
+        except asyncio.TimeoutError:
+            stats.errors.append(f"Timeout waiting for {', '.join(pending)}")
+        finally:
+            receiver.cancel()
+            await asyncio.gather(receiver, return_exceptions=True)
+
+
+def _percentiles(values):
+    if not values:
+        return {'p50': None, 'p99': None, 'max': None}
+    values = np.asarray(values) * 1000  # Milliseconds
+    return {'p50': float(np.percentile(values, 50)), 'p99': float(np.percentile(values, 99)),
+            'max': float(values.max())}
+
+
+async def run_benchmark(args, pid=None):
+    all_stats = [ClientStats() for _ in range(args.clients)]
+    sampler = ProcessSampler(pid) if pid and os.path.exists(f'/proc/{pid}') else None
+    loop = asyncio.get_running_loop()
+    began = loop.time()
+    measure_from = began + args.warmup
+    deadline = measure_from + args.duration
+    sampler_task = None
+    async with aiohttp.ClientSession() as http:
+        if sampler:
+            sampler.start()
+            sampler_task = asyncio.create_task(sampler.run())
+        results = await asyncio.gather(*(run_client(http, args, stats, measure_from, deadline)
+                                         for stats in all_stats), return_exceptions=True)
+        if sampler:
+            sampler.finish()
+            sampler_task.cancel()
+    for stats, result in zip(all_stats, results):
+        if isinstance(result, Exception):
+            stats.errors.append(repr(result))
+
+    samples = sum(s.samples for s in all_stats)
+    report = {
+        'clients': args.clients,
+        'duration': args.duration,
+        'encoding': args.encoding,
+        'samples': samples,
+        'frames': sum(s.frames for s in all_stats),
+        'samples_per_second': samples / args.duration,
+        'sample_latency_ms': _percentiles([x for s in all_stats for x in s.latencies]),
+        'start_ack_ms': _percentiles([s.start_ack for s in all_stats if s.start_ack is not None]),
+        'update_ack_ms': _percentiles([x for s in all_stats for x in s.update_acks]),
+        'stop_ack_ms': _percentiles([x for s in all_stats for x in s.stop_acks]),
+        'controller_cpu_percent': sampler.cpu_percent if sampler else None,
+        'controller_rss_mb': max((r for r in sampler.rss if r is not None), default=None) if sampler else None,
+        'errors': [e for s in all_stats for e in s.errors],
+    }
+    return report
+
+
+def print_report(report):
+    def ms(values):
+        if values['p50'] is None:
+            return 'n/a'
+        return f"p50 {values['p50']:.1f} ms, p99 {values['p99']:.1f} ms, max {values['max']:.1f} ms"
+
+    print(f"Clients:          {report['clients']} ({report['encoding']})")
+    print(f"Samples:          {report['samples']} in {report['frames']} frames over {report['duration']:.0f} s")
+    print(f"Throughput:       {report['samples_per_second']:.0f} samples/s")
+    print(f"Sample latency:   {ms(report['sample_latency_ms'])}")
+    print(f"Start ack:        {ms(report['start_ack_ms'])}")
+    print(f"Update ack:       {ms(report['update_ack_ms'])}")
+    print(f"Stop ack:         {ms(report['stop_ack_ms'])}")
+    if report['controller_cpu_percent'] is not None:
+        print(f"Controller CPU:   {report['controller_cpu_percent']:.1f} %")
+        print(f"Controller RSS:   {report['controller_rss_mb']:.1f} MB (peak)")
+    if report['errors']:
+        print(f"Errors:           {len(report['errors'])}, first: {report['errors'][0]}")
+
+
+async def _wait_for_controller(url, process, timeout=30.0):
+    """Poll /sessions until the spawned controller answers"""
+    http_url = url.replace('ws://', 'http://', 1).rsplit('/', 1)[0] + '/sessions'
+    loop = asyncio.get_running_loop()
+    end = loop.time() + timeout
+    async with aiohttp.ClientSession() as http:
+        while loop.time() < end:
+            if process.poll() is not None:
+                raise RuntimeError('Controller exited during startup')
+            try:
+                async with http.get(http_url) as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError('Controller did not start')
+
+
+def spawn(args, workdir):
+    """Start matlab_standin.py and the controller; returns both processes"""
+    workers = args.workers or args.clients
+    log = open(os.path.join(workdir, 'processes.log'), 'w')
+    standin = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, 'matlab_standin.py'), '--host', '127.0.0.1',
+         '--port', str(args.standin_port), '--workers', str(workers), '--shape', 'vitals', '--stamp',
+         '--rate', str(args.rate)],
+        stdout=log, stderr=subprocess.STDOUT)
+    os.makedirs(os.path.join(workdir, 'output'), exist_ok=True)
+    env = dict(os.environ)
+    env.update({
+        'PYTHONUNBUFFERED': '1',
+        'CONTROLLER_PORT': str(args.port),
+        'MATLAB_WORKERS': ','.join(f'127.0.0.1:{p}' for p in range(args.standin_port, args.standin_port + workers)),
+        'PLOT_OUTPUT_DIR': os.path.join(workdir, 'output'),
+        'RECORDINGS_DIR': os.path.join(workdir, 'recordings'),
+    })
+    controller = subprocess.Popen([sys.executable, os.path.join(HERE, 'main.py')], cwd=HERE, env=env,
+                                  stdout=log, stderr=subprocess.STDOUT)
+    print(f"Benchmark: Spawned stand-in ({workers} workers) and controller, logs in {log.name}")
+    return standin, controller
+
+
+async def main(args):
+    processes = []
+    pid = args.pid
+    try:
+        if args.spawn:
+            workdir = tempfile.mkdtemp(prefix='controller-benchmark-')
+            processes = spawn(args, workdir)
+            args.url = f'ws://127.0.0.1:{args.port}/ws'
+            await _wait_for_controller(args.url, processes[1])
+            pid = processes[1].pid
+        report = await run_benchmark(args, pid)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='ws://localhost:8765/ws', help='controller WebSocket endpoint')
+    parser.add_argument('--pid', type=int, help='controller process id, for CPU/RSS measurements')
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10.0, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=1.0, help='seconds after start that are not measured')
+    parser.add_argument('--encoding', choices=('json', 'binary'), default='json')
+    parser.add_argument('--script', default='benchmark.m', help='script name sent with start; '
+                        'must not be one of the LOCAL_SCRIPTS to exercise the MATLAB path')
+    parser.add_argument('--params', type=json.loads, default=[1, 1, 0, 0.01, 10], help='JSON params array')
+    parser.add_argument('--update-interval', type=float, default=2.0, help='seconds between update commands')
+    parser.add_argument('--timeout', type=float, default=10.0, help='seconds to wait for an acknowledgment')
+    parser.add_argument('--json', help='also write the report to this file')
+    spawned = parser.add_argument_group('spawned processes (--spawn)')
+    spawned.add_argument('--spawn', action='store_true', help='start matlab_standin.py and the controller locally')
+    spawned.add_argument('--port', type=int, default=8799, help='controller port')
+    spawned.add_argument('--standin-port', type=int, default=12400, help='first stand-in worker port')
+    spawned.add_argument('--workers', type=int, help='stand-in workers (default: one per client)')
+    spawned.add_argument('--rate', type=float, default=100.0, help='stand-in messages per second per session')
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
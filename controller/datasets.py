@@ -0,0 +1,342 @@
+"""Reference datasets converted once to memory-mapped columnar files.
+
+The traces the models are compared against live in scripts/production:
+``MatlabTestExport.json`` (an object of arrays of flat records such as
+``{"timeSpan": .., "uPressure": ..}``) and MAT-files (hr.mat, toco.mat,
+R1.mat ...). Parsing them on every request would materialize millions of
+Python objects, so each source is converted the first time it is used into
+a directory under DATASETS_DIR holding ``meta.json`` and one file per
+channel of ``DATASET_DTYPE`` records, sorted by ``t``. Afterwards the
+channels are opened with ``numpy.memmap`` and a time range is two binary
+searches. A dataset is converted again when its source file changes.
+
+Channels of a dataset:
+
+- JSON: every numeric field of the records of each array, with the
+  record's ``timeSpan`` (or ``time``/``t``) as ``t``, else its position
+- MAT vectors: the variable, with the sample index as ``t``
+- MAT matrices: each column after the first as ``<var>_<column>`` (just
+  ``<var>`` with two columns), with the first column as ``t`` if it is
+  non-decreasing; otherwise every column with the row index as ``t``
+
+``python datasets.py`` converts every source up front.
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from array import array
+
+import numpy as np  # type: ignore
+
+import matfile
+import settings
+
+log = logging.getLogger(__name__)
+
+DATASET_DTYPE = np.dtype([('t', '<f8'), ('value', '<f8')])
+SOURCE_EXTENSIONS = ('.json', '.mat')
+TIME_FIELDS = ('timeSpan', 'time', 't')
+_SAFE_NAME = re.compile(r'^[A-Za-z0-9_.-]+$')
+_ARRAY_START = re.compile(r'"((?:[^"\\]|\\.)*)"\s*:\s*\[')
+_FLUSH_RECORDS = 65536  # Records buffered per channel before they are written
+
+
+def _json_records(f, default_name, chunk_size=1 << 20):
+    """Yield (array name, record) of a JSON file of arrays of records, one record in memory at a time"""
+    decoder = json.JSONDecoder()
+    buffer, position, eof = '', 0, False
+
+    def read_more(keep):
+        """Drop the buffer before ``keep`` and append the next chunk"""
+        nonlocal buffer, position, eof
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[keep:] + chunk
+        position -= keep
+
+    read_more(0)
+    name = None
+    if buffer.lstrip().startswith('['):
+        name = default_name  # A bare array of records
+        position = buffer.index('[') + 1
+    while True:
+        if name is None:
+            match = _ARRAY_START.search(buffer, position)
+            if match is None:
+                if eof:
+                    return
+                read_more(max(position, len(buffer) - 1024))  # Keep a key split between chunks
+                continue
+            name = json.loads(f'"{match.group(1)}"')
+            position = match.end()
+            continue
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if position == len(buffer):
+            if eof:
+                raise ValueError(f"Unterminated array {name}")
+            read_more(position)
+            continue
+        if buffer[position] == ']':
+            name = None
+            position += 1
+            continue
+        try:
+            record, end = decoder.raw_decode(buffer, position)
+        except ValueError:
+            if eof:
+                raise ValueError(f"Malformed record in array {name}")
+            read_more(position)  # The record continues in the next chunk
+            continue
+        position = end
+        yield name, record
+
+
+class _ChannelWriter:
+    """Appends (t, value) pairs to a channel file in blocks"""
+
+    def __init__(self, path):
+        self.path = path
+        self.samples = 0
+        self.ordered = True
+        self._last_t = -np.inf
+        self._t = array('d')
+        self._values = array('d')
+        self._file = open(path, 'wb')
+
+    def add(self, t, value):
+        self._t.append(t)
+        self._values.append(value)
+        if len(self._t) >= _FLUSH_RECORDS:
+            self.flush()
+
+    def add_arrays(self, t, values):
+        self.flush()
+        self._write(np.asarray(t, dtype=np.float64), np.asarray(values, dtype=np.float64))
+
+    def flush(self):
+        if self._t:
+            self._write(np.frombuffer(self._t, dtype=np.float64), np.frombuffer(self._values, dtype=np.float64))
+            self._t = array('d')
+            self._values = array('d')
+
+    def _write(self, t, values):
+        if len(t) == 0:
+            return
+        records = np.empty(len(t), dtype=DATASET_DTYPE)
+        records['t'] = t
+        records['value'] = values
+        self.ordered = self.ordered and t[0] >= self._last_t and bool(np.all(np.diff(t) >= 0))
+        self._last_t = t[-1]
+        self._file.write(records.tobytes())
+        self.samples += len(records)
+
+    def close(self):
+        """Finish the file, sorting it by t if the source was out of order; returns its metadata"""
+        self.flush()
+        self._file.close()
+        if not self.ordered:
+            records = np.fromfile(self.path, dtype=DATASET_DTYPE)
+            records[np.argsort(records['t'], kind='stable')].tofile(self.path)
+        if not self.samples:
+            return {'samples': 0, 'start': None, 'end': None}
+        records = np.memmap(self.path, dtype=DATASET_DTYPE, mode='r', shape=(self.samples,))
+        return {'samples': self.samples, 'start': float(records['t'][0]), 'end': float(records['t'][-1])}
+
+
+def _channel_name(name, taken):
+    name = re.sub(r'[^A-Za-z0-9_.-]', '_', name)
+    while name in taken:
+        name += '_'
+    return name
+
+
+def _convert_json(source, path, name):
+    """Stream the records of a JSON export into channel files; returns {channel: metadata}"""
+    writers, axes, arrays = {}, {}, {}
+    keys = {}  # (array, field) -> channel
+    positions = {}  # Array -> index of its latest record
+    with open(source, encoding='utf-8') as f:
+        for array_name, record in _json_records(f, name):
+            if not isinstance(record, dict):
+                continue
+            index = positions[array_name] = positions.get(array_name, -1) + 1
+            time_field = next((k for k in TIME_FIELDS if isinstance(record.get(k), (int, float))), None)
+            t = float(record[time_field]) if time_field else float(index)
+            for field, value in record.items():
+                if field == time_field or isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                channel = keys.get((array_name, field))
+                if channel is None:
+                    channel = keys[(array_name, field)] = _channel_name(field, writers)
+                    writers[channel] = _ChannelWriter(os.path.join(path, f'{channel}.bin'))
+                    axes[channel] = time_field or 'index'
+                    arrays[channel] = array_name
+                writers[channel].add(t, float(value))
+    return {channel: dict(writer.close(), time=axes[channel], array=arrays[channel])
+            for channel, writer in writers.items()}
+
+
+def _convert_mat(source, path):
+    """Write the numeric variables of a MAT-file as channel files; returns {channel: metadata}"""
+    channels = {}
+
+    def write(channel, t, values, axis):
+        channel = _channel_name(channel, channels)
+        writer = _ChannelWriter(os.path.join(path, f'{channel}.bin'))
+        writer.add_arrays(t, values)
+        channels[channel] = dict(writer.close(), time=axis)
+
+    for name, values in matfile.load(source).items():
+        if values.size < 2 or values.ndim != 2:
+            continue
+        if 1 in values.shape:
+            values = values.ravel()
+            write(name, np.arange(len(values)), values, 'index')
+        elif np.all(np.diff(values[:, 0]) >= 0):
+            for column in range(1, values.shape[1]):
+                write(name if values.shape[1] == 2 else f'{name}_{column + 1}', values[:, 0], values[:, column], 'column 1')
+        else:
+            for column in range(values.shape[1]):
+                write(f'{name}_{column + 1}', np.arange(len(values)), values[:, column], 'index')
+    return channels
+
+
+class DatasetStore:
+    """Converts reference sources on first use and serves their channels memory-mapped"""
+
+    def __init__(self, source_dir=None, data_dir=None):
+        self.source_dir = source_dir or settings.DATASETS_SOURCE_DIR
+        self.data_dir = data_dir or settings.DATASETS_DIR
+        self._open = {}  # Dataset -> (meta, {channel: memmap})
+        self._lock = threading.Lock()  # Conversions run in executor threads
+
+    def sources(self):
+        """{dataset: source path} of every convertible file in the source directory"""
+        if not os.path.isdir(self.source_dir):
+            return {}
+        found = {}
+        for file_name in sorted(os.listdir(self.source_dir)):
+            name, extension = os.path.splitext(file_name)
+            if extension.lower() in SOURCE_EXTENSIONS and _SAFE_NAME.match(name):
+                found.setdefault(name, os.path.join(self.source_dir, file_name))
+        return found
+
+    def _source(self, name):
+        source = self.sources().get(name)
+        if source is None:
+            raise KeyError(name)
+        return source
+
+    def _load_meta(self, name):
+        try:
+            with open(os.path.join(self.data_dir, name, 'meta.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _current(meta, source):
+        stat = os.stat(source)
+        return meta is not None and meta.get('size') == stat.st_size and meta.get('mtime_ns') == stat.st_mtime_ns
+
+    def describe(self):
+        """Every dataset with its channels if it was converted"""
+        result = []
+        for name, source in self.sources().items():
+            meta = self._load_meta(name)
+            if meta and self._current(meta, source):
+                result.append(meta)
+            else:
+                result.append({'dataset': name, 'source': os.path.basename(source), 'converted': None})
+        return result
+
+    def convert(self, name, force=False):
+        """Convert a dataset unless it is up to date; returns its metadata"""
+        source = self._source(name)
+        with self._lock:
+            meta = self._load_meta(name)
+            if not force and self._current(meta, source):
+                return meta
+            stat = os.stat(source)
+            started = time.time()
+            os.makedirs(self.data_dir, exist_ok=True)
+            path = tempfile.mkdtemp(prefix=f'.{name}-', dir=self.data_dir)
+            try:
+                if source.lower().endswith('.json'):
+                    channels = _convert_json(source, path, name)
+                else:
+                    channels = _convert_mat(source, path)
+                meta = {
+                    'dataset': name,
+                    'source': os.path.basename(source),
+                    'size': stat.st_size,
+                    'mtime_ns': stat.st_mtime_ns,
+                    'converted': time.time(),
+                    'channels': channels,
+                }
+                with open(os.path.join(path, 'meta.json'), 'w') as f:
+                    json.dump(meta, f)
+                final = os.path.join(self.data_dir, name)
+                self._open.pop(name, None)
+                shutil.rmtree(final, ignore_errors=True)
+                os.replace(path, final)
+            except BaseException:
+                shutil.rmtree(path, ignore_errors=True)
+                raise
+            log.info("Converted %s to %d channels in %.2f s", os.path.basename(source), len(channels),
+                     time.time() - started)
+            return meta
+
+    def open(self, name):
+        """(meta, {channel: DATASET_DTYPE memmap}) of a dataset, converting it first if needed"""
+        source = self._source(name)
+        opened = self._open.get(name)
+        if opened and self._current(opened[0], source):
+            return opened
+        meta = self.convert(name)
+        path = os.path.join(self.data_dir, name)
+        channels = {}
+        for channel, info in meta['channels'].items():
+            if info['samples']:
+                channels[channel] = np.memmap(os.path.join(path, f'{channel}.bin'), dtype=DATASET_DTYPE,
+                                              mode='r', shape=(info['samples'],))
+            else:
+                channels[channel] = np.empty(0, dtype=DATASET_DTYPE)
+        self._open[name] = (meta, channels)
+        return meta, channels
+
+    def slice(self, name, channel, start=None, end=None):
+        """(t, values) of a channel for start <= t <= end; either bound may be None"""
+        _, channels = self.open(name)
+        records = channels[channel]
+        t = records['t']
+        lo = 0 if start is None else int(np.searchsorted(t, start, side='left'))
+        hi = len(t) if end is None else int(np.searchsorted(t, end, side='right'))
+        return t[lo:hi], records['value'][lo:hi]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Convert reference datasets to memory-mapped columnar files")
+    parser.add_argument('names', nargs='*', help="datasets to convert (default: every source)")
+    parser.add_argument('--source-dir', default=settings.DATASETS_SOURCE_DIR,
+                        help="directory of the .json and .mat sources (default: %(default)s)")
+    parser.add_argument('--data-dir', default=settings.DATASETS_DIR,
+                        help="directory of the converted datasets (default: %(default)s)")
+    parser.add_argument('--force', action='store_true', help="convert again even if up to date")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    args = parse_args()
+    store = DatasetStore(args.source_dir, args.data_dir)
+    for dataset in args.names or list(store.sources()):
+        result = store.convert(dataset, force=args.force)
+        print(f"{dataset}: " + ', '.join(f"{c} ({i['samples']})" for c, i in result['channels'].items()))
@@ -0,0 +1,511 @@
+"""Derived channels computed incrementally from a run's samples, before they are published.
+
+A DerivedStage sits between batching and fan-out: every columnar frame
+passes through its features in order, and each feature whose input
+channels are in the frame adds its output columns, aligned with the
+frame's ``t``. Features keep their own state across frames, so a sample is
+processed exactly once (O(1) per sample, vectorized over the frame) and
+clients never recompute views over the full history. A later feature can
+use the output of an earlier one, e.g. deceleration detection reads the
+heart-rate baseline.
+
+A feature is any object with ``inputs`` (channel names it needs) and
+``process(columns, t, context)`` returning ``{name: array}``, where
+``columns`` maps channel names to float64 arrays and ``context`` is a dict
+shared by the features of one run. The default set, built from settings:
+
+- ``<hr>_baseline``, ``<hr>_stv``, ``<hr>_rmssd``, ``<hr>_decel`` and
+  ``<hr>_decel_lag`` for heart-rate channels (DERIVED_HR_CHANNELS)
+- ``<toco>_baseline`` and ``<toco>_contraction`` for uterine activity
+  channels (DERIVED_TOCO_CHANNELS)
+- ``<name>_mean`` and ``<name>_trend`` (change per minute) for trended
+  channels such as SpO2 (DERIVED_TREND_CHANNELS)
+
+``python derived.py --validate`` checks the incremental results against
+direct offline computations over the reference traces in
+scripts/production (hr.mat, hr1.mat, ... and toco.mat, toco1.mat, ...), fed
+in random batch sizes. hrv.mat holds heart-rate variability, not a trace,
+and is left out.
+"""
+import argparse
+import os
+import re
+import sys
+
+import numpy as np  # type: ignore
+
+import matfile
+import settings
+
+
+class RollingSum:
+    """Sum of the last ``size`` values, updated a batch at a time in O(batch).
+
+    The sum is corrected from the window's values once per ``size``
+    samples, so float rounding cannot accumulate.
+    """
+
+    def __init__(self, size):
+        self.size = max(1, int(size))
+        self.count = 0  # Values pushed so far
+        self.total = 0.0
+        self._window = np.zeros(self.size)  # Ring buffer of the last size values; zeros before they exist
+        self._head = 0
+
+    def push(self, values):
+        """Append values; returns the window sum and window length after each of them"""
+        k = len(values)
+        if k == 0:
+            return np.empty(0), np.empty(0)
+        # Value leaving the window as each new one enters: from the ring buffer, then from the batch itself
+        from_window = min(k, self.size)
+        leaving = np.concatenate((self._window[(self._head + np.arange(from_window)) % self.size],
+                                  values[:k - from_window]))
+        sums = self.total + np.cumsum(values - leaving)
+        counts = np.minimum(self.count + np.arange(1, k + 1), self.size)
+
+        tail = values[-self.size:]
+        positions = (self._head + np.arange(len(tail)) + (k - len(tail))) % self.size
+        self._window[positions] = tail
+        self._head = (self._head + k) % self.size
+        previous, self.count = self.count, self.count + k
+        if previous // self.size != self.count // self.size:
+            self.total = float(self._window.sum())
+        else:
+            self.total = float(sums[-1])
+        return sums, counts
+
+
+class RollingMoments:
+    """Rolling mean and standard deviation over the last ``size`` samples"""
+
+    def __init__(self, size):
+        self._sum = RollingSum(size)
+        self._squares = RollingSum(size)
+        self._shift = None  # First value seen; sums of shifted values avoid cancellation
+
+    def push(self, values):
+        if self._shift is None and len(values):
+            self._shift = float(values[0])
+        shifted = values - (self._shift or 0.0)
+        sums, counts = self._sum.push(shifted)
+        squares, _ = self._squares.push(shifted * shifted)
+        mean = sums / counts
+        variance = np.maximum(squares / counts - mean * mean, 0.0)
+        return mean + (self._shift or 0.0), np.sqrt(variance)
+
+
+class RollingMean:
+    """``<source>_<suffix>``: mean over the last ``window`` samples, e.g. a baseline"""
+
+    def __init__(self, source, window, suffix='mean'):
+        self.inputs = (source,)
+        self.name = f'{source}_{suffix}'
+        self._moments = RollingMoments(window)
+
+    def process(self, columns, t, context):
+        mean, _ = self._moments.push(columns[self.inputs[0]])
+        return {self.name: mean}
+
+
+class RollingTrend:
+    """``<source>_trend``: least-squares slope over the last ``window`` samples, per minute"""
+
+    def __init__(self, source, window, rate):
+        self.inputs = (source,)
+        self.name = f'{source}_trend'
+        self.rate = rate
+        self._sum = RollingSum(window)
+        self._weighted = RollingSum(window)  # Sum of index * value
+        self._index = 0
+        self._shift = None
+
+    def process(self, columns, t, context):
+        values = columns[self.inputs[0]]
+        if self._shift is None and len(values):
+            self._shift = float(values[0])
+        values = values - (self._shift or 0.0)
+        index = self._index + np.arange(len(values), dtype=np.float64)
+        self._index += len(values)
+        sums, n = self._sum.push(values)
+        weighted, _ = self._weighted.push(index * values)
+        # Window covers indices index - n + 1 .. index
+        mean_index = index - (n - 1) / 2
+        covariance = weighted - mean_index * sums
+        spread = n * (n * n - 1) / 12  # Sum of squared index deviations
+        slope = np.divide(covariance, spread, out=np.zeros_like(covariance), where=spread > 0)
+        return {self.name: slope * self.rate * 60}
+
+
+class Rmssd:
+    """``<source>_rmssd``: root mean square of successive differences over the last ``window`` samples"""
+
+    def __init__(self, source, window):
+        self.inputs = (source,)
+        self.name = f'{source}_rmssd'
+        self._squares = RollingSum(window)
+        self._last = None
+
+    def process(self, columns, t, context):
+        values = columns[self.inputs[0]]
+        if len(values) == 0:
+            return {self.name: values}
+        previous = values[0] if self._last is None else self._last
+        differences = np.diff(values, prepend=previous)
+        self._last = values[-1]
+        sums, counts = self._squares.push(differences * differences)
+        return {self.name: np.sqrt(sums / counts)}
+
+
+class ShortTermVariability:
+    """``<source>_stv``: mean absolute difference between successive epoch means (Dawes-Redman STV).
+
+    Epochs are ``epoch`` samples (1/16 min in CTG analysis); the mean runs
+    over the last ``window`` epoch differences. The value changes when an
+    epoch completes and holds in between; it is 0 until two epochs are done.
+    """
+
+    def __init__(self, source, epoch, window):
+        self.inputs = (source,)
+        self.name = f'{source}_stv'
+        self.epoch = max(1, int(epoch))
+        self._partial = np.empty(0)  # Samples of the epoch in progress
+        self._last_epoch = None
+        self._differences = RollingSum(window)
+        self._value = 0.0
+
+    def process(self, columns, t, context):
+        values = columns[self.inputs[0]]
+        pending = np.concatenate((self._partial, values))
+        complete = len(pending) // self.epoch
+        output = np.full(len(values), self._value)
+        if complete:
+            means = pending[:complete * self.epoch].reshape(complete, self.epoch).mean(axis=1)
+            previous = [] if self._last_epoch is None else [self._last_epoch]
+            differences = np.abs(np.diff(np.concatenate((previous, means))))
+            self._last_epoch = means[-1]
+            if len(differences):
+                sums, counts = self._differences.push(differences)
+                stv = sums / counts
+                # Sample of this frame completing each epoch whose difference was just computed
+                ends = (np.arange(complete - len(differences), complete) + 1) * self.epoch - len(self._partial) - 1
+                latest = np.searchsorted(ends, np.arange(len(values)), side='right') - 1
+                output = np.where(latest >= 0, stv[np.maximum(latest, 0)], self._value)
+                self._value = float(stv[-1])
+        self._partial = pending[complete * self.epoch:]
+        return {self.name: output}
+
+
+def _segments(condition):
+    """(start, end, value) of the runs of equal values in a boolean array"""
+    edges = np.flatnonzero(condition[1:] != condition[:-1]) + 1
+    bounds = np.concatenate(([0], edges, [len(condition)]))
+    return [(int(a), int(b), bool(condition[a])) for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+class _Episodes:
+    """Episodes where a deviation stays at or beyond a threshold for a minimum number of samples.
+
+    Samples are flagged once the episode has lasted ``min_length``
+    samples; the ``t`` of its extreme (largest deviation so far) is tracked
+    while it lasts.
+    """
+
+    def __init__(self, threshold, min_length):
+        self.threshold = threshold
+        self.min_length = max(1, int(min_length))
+        self.length = 0  # Samples the current run beyond the threshold has lasted
+        self.extreme = 0.0
+        self.extreme_t = None
+
+    @property
+    def active(self):
+        return self.length >= self.min_length
+
+    def update(self, deviation, t):
+        """Flags of samples inside an episode, the ``t`` of its extreme so far at each of them
+        (NaN outside), and (position, extreme t) of each episode that ended"""
+        flags = np.zeros(len(deviation))
+        extremes = np.full(len(deviation), np.nan)
+        endings = []
+        for start, end, beyond in _segments(deviation >= self.threshold):
+            if not beyond:
+                if self.active:
+                    endings.append((start, self.extreme_t))
+                self.length = 0
+                self.extreme_t = None
+                continue
+            values = deviation[start:end]
+            before = -np.inf if self.extreme_t is None else self.extreme
+            running = np.maximum.accumulate(np.concatenate(([before], values)))
+            # Position of the running extreme: the latest sample that raised it, or the earlier one
+            raised = np.maximum.accumulate(np.where(values > running[:-1], np.arange(len(values)), -1))
+            extremes[start:end] = np.where(raised >= 0, t[start + np.maximum(raised, 0)],
+                                           np.nan if self.extreme_t is None else self.extreme_t)
+            self.extreme, self.extreme_t = float(running[-1]), float(extremes[end - 1])
+            first = max(start, start + self.min_length - self.length - 1)
+            flags[first:end] = 1.0
+            self.length += end - start
+        return flags, extremes, endings
+
+
+class Contractions:
+    """``<toco>_contraction``: 1 during a contraction, toco ``threshold`` above its baseline for ``duration`` samples.
+
+    The ``t`` of the peak of the latest contraction known at each sample
+    is shared with deceleration detection through the context.
+    """
+
+    def __init__(self, source, threshold, duration):
+        self.inputs = (source, f'{source}_baseline')
+        self.name = f'{source}_contraction'
+        self._episodes = _Episodes(threshold, duration)
+        self._peak = np.nan
+
+    def process(self, columns, t, context):
+        values, baseline = columns[self.inputs[0]], columns[self.inputs[1]]
+        flags, extremes, _ = self._episodes.update(values - baseline, t)
+        # Hold the peak of the latest contraction between contractions
+        known = np.where(flags > 0, extremes, np.nan)
+        filled = np.maximum.accumulate(np.where(np.isnan(known), -1, np.arange(len(known))))
+        peaks = np.where(filled >= 0, known[np.maximum(filled, 0)], self._peak)
+        if len(peaks):
+            self._peak = peaks[-1]
+        context['contraction_peak'] = (t, peaks)
+        return {self.name: flags}
+
+
+class Decelerations:
+    """``<hr>_decel``: 1 during a deceleration, ``<hr>_decel_lag``: its timing relative to contractions.
+
+    A deceleration is a heart rate ``depth`` below its baseline for
+    ``duration`` samples. When one ends, the lag from the peak of the latest
+    contraction to its nadir is published in seconds (late decelerations
+    lag by more than about 20 s) and held until the next one; it is 0 until
+    a deceleration followed a contraction.
+    """
+
+    def __init__(self, source, depth, duration, rate):
+        self.inputs = (source, f'{source}_baseline')
+        self.names = (f'{source}_decel', f'{source}_decel_lag')
+        self.rate = rate
+        self._episodes = _Episodes(depth, duration)
+        self._lag = 0.0
+
+    def process(self, columns, t, context):
+        values, baseline = columns[self.inputs[0]], columns[self.inputs[1]]
+        flags, _, endings = self._episodes.update(baseline - values, t)
+        lag = np.full(len(values), self._lag)
+        peak_t, peaks = context.get('contraction_peak', (None, [np.nan]))
+        for position, nadir_t in endings:
+            # Peaks of this frame if contractions were detected on it, else the last one known
+            peak = peaks[position] if peak_t is t else peaks[-1]
+            if not np.isnan(peak):
+                self._lag = (nadir_t - peak) / self.rate
+                lag[position:] = self._lag
+        return {self.names[0]: flags, self.names[1]: lag}
+
+
+class DerivedStage:
+    """Runs a list of features over every frame of a run"""
+
+    def __init__(self, features=None):
+        self.features = default_features() if features is None else features
+        self.context = {}
+
+    def reset(self, features=None):
+        """Start over for a new run, with fresh feature state"""
+        self.features = default_features() if features is None else features
+        self.context = {}
+
+    def process(self, frame):
+        """Add the derived channels of a frame to it, in place"""
+        if not self.features or not len(frame['t']):
+            return frame
+        t = np.asarray(frame['t'], dtype=np.float64)
+        columns = {}
+        for feature in self.features:
+            for name in feature.inputs:
+                if name not in columns and name in frame:
+                    try:
+                        column = np.asarray(frame[name], dtype=np.float64)
+                    except (TypeError, ValueError):
+                        continue  # Non-numeric channels have no derived values
+                    if column.shape == t.shape and np.isfinite(column).all():
+                        columns[name] = column
+            if not all(name in columns for name in feature.inputs):
+                continue
+            for name, values in feature.process(columns, t, self.context).items():
+                columns[name] = values
+                frame[name] = values.tolist()
+        return frame
+
+
+def default_features(rate=None):
+    """The features configured in settings, windows converted from seconds to samples"""
+    rate = settings.DERIVED_SAMPLE_RATE if rate is None else rate
+    baseline = int(settings.DERIVED_BASELINE_WINDOW * rate)
+    minute = int(60 * rate)
+    features = []
+    for toco in settings.DERIVED_TOCO_CHANNELS:
+        features.append(RollingMean(toco, baseline, 'baseline'))
+        features.append(Contractions(toco, settings.DERIVED_CONTRACTION_THRESHOLD,
+                                     settings.DERIVED_CONTRACTION_DURATION * rate))
+    for hr in settings.DERIVED_HR_CHANNELS:
+        features.append(RollingMean(hr, baseline, 'baseline'))
+        features.append(ShortTermVariability(hr, 3.75 * rate, 16))  # 1/16 min epochs over 1 min
+        features.append(Rmssd(hr, minute))
+        features.append(Decelerations(hr, settings.DERIVED_DECEL_DEPTH, settings.DERIVED_DECEL_DURATION * rate, rate))
+    for channel in settings.DERIVED_TREND_CHANNELS:
+        window = int(settings.DERIVED_TREND_WINDOW * rate)
+        features.append(RollingMean(channel, window))
+        features.append(RollingTrend(channel, window, rate))
+    return features
+
+
+def _window_view(values, window):
+    """Windows ending at every sample, NaN where they reach before the first one"""
+    padded = np.concatenate((np.full(window - 1, np.nan), values))
+    return np.lib.stride_tricks.sliding_window_view(padded, window)
+
+
+def _reference_episodes(deviation, threshold, min_length):
+    """Per-sample flags, extreme of the latest episode known and ending extremes, one sample at a time"""
+    flags = np.zeros(len(deviation))
+    known = np.full(len(deviation), np.nan)
+    endings = []
+    length, extreme, extreme_at, latest = 0, 0.0, None, np.nan
+    for i, d in enumerate(deviation):
+        if d >= threshold:
+            length += 1
+            if extreme_at is None or d > extreme:
+                extreme, extreme_at = d, i
+            flags[i] = length >= min_length
+            if flags[i]:
+                latest = extreme_at
+        else:
+            if length >= min_length:
+                endings.append((i, extreme_at))
+            length, extreme_at = 0, None
+        known[i] = latest
+    return flags, known, endings
+
+
+# Thresholds of the validation, low enough for the reference traces (deviations from their mean) to have episodes
+VALIDATION_THRESHOLDS = {'contraction': (3.0, 10.0), 'decel': (4.0, 5.0)}  # (threshold, seconds)
+
+
+def _features(rate, thresholds):
+    """The default features over channels fhr and toco"""
+    baseline, trend = int(settings.DERIVED_BASELINE_WINDOW * rate), int(settings.DERIVED_TREND_WINDOW * rate)
+    (contraction, contraction_duration), (depth, decel_duration) = thresholds['contraction'], thresholds['decel']
+    return [
+        RollingMean('toco', baseline, 'baseline'),
+        Contractions('toco', contraction, contraction_duration * rate),
+        RollingMean('fhr', baseline, 'baseline'),
+        ShortTermVariability('fhr', 3.75 * rate, 16),
+        Rmssd('fhr', int(60 * rate)),
+        Decelerations('fhr', depth, decel_duration * rate, rate),
+        RollingMean('fhr', trend),
+        RollingTrend('fhr', trend, rate),
+    ]
+
+
+def _reference(hr, toco, rate, thresholds):
+    """The features of _features computed directly over whole traces"""
+    baseline, minute = int(settings.DERIVED_BASELINE_WINDOW * rate), int(60 * rate)
+    trend_window, epoch = int(settings.DERIVED_TREND_WINDOW * rate), int(3.75 * rate)
+    expected = {
+        'toco_baseline': np.nanmean(_window_view(toco, baseline), axis=1),
+        'fhr_baseline': np.nanmean(_window_view(hr, baseline), axis=1),
+        'fhr_mean': np.nanmean(_window_view(hr, trend_window), axis=1),
+    }
+    differences = np.diff(hr, prepend=hr[0])
+    expected['fhr_rmssd'] = np.sqrt(np.nanmean(_window_view(differences ** 2, minute), axis=1))
+
+    windows = _window_view(hr, trend_window)
+    index = np.where(np.isnan(windows), np.nan, np.arange(trend_window, dtype=np.float64))
+    index -= np.nanmean(index, axis=1)[:, None]
+    spread = np.nansum(index ** 2, axis=1)
+    covariance = np.nansum(index * windows, axis=1)
+    expected['fhr_trend'] = np.divide(covariance, spread, out=np.zeros(len(hr)), where=spread > 0) * rate * 60
+
+    complete = len(hr) // epoch
+    means = hr[:complete * epoch].reshape(complete, epoch).mean(axis=1)
+    stv = np.nanmean(_window_view(np.abs(np.diff(means)), 16), axis=1)
+    expected['fhr_stv'] = np.zeros(len(hr))
+    for k, value in enumerate(stv):
+        expected['fhr_stv'][(k + 2) * epoch - 1:] = value
+
+    (threshold, duration), (depth, decel_duration) = thresholds['contraction'], thresholds['decel']
+    contraction, peaks, _ = _reference_episodes(toco - expected['toco_baseline'], threshold, int(duration * rate))
+    decel, _, endings = _reference_episodes(expected['fhr_baseline'] - hr, depth, int(decel_duration * rate))
+    expected['toco_contraction'] = contraction
+    expected['fhr_decel'] = decel
+    expected['fhr_decel_lag'] = np.zeros(len(hr))
+    for position, nadir in endings:
+        if not np.isnan(peaks[position]):
+            expected['fhr_decel_lag'][position:] = (nadir - peaks[position]) / rate
+    return expected
+
+
+def _traces(directory, name):
+    """Reference traces ``<name>.mat``, ``<name>1.mat``, ... of a directory (not e.g. hrv.mat)"""
+    pattern = re.compile(rf'{name}\d*\.mat')
+    return sorted(os.path.join(directory, f) for f in os.listdir(directory) if pattern.fullmatch(f))
+
+
+def validate(directory, rate, seed=0):
+    """Compare incremental against offline results on the reference traces; returns the number of mismatches"""
+    rng = np.random.default_rng(seed)
+    hr_files = _traces(directory, 'hr')
+    toco_files = _traces(directory, 'toco')
+    if not hr_files or not toco_files:
+        print(f"No hr<n>.mat and toco<n>.mat in {directory}")
+        return 1
+    failures = 0
+    for i, hr_path in enumerate(hr_files):
+        toco_path = toco_files[i % len(toco_files)]  # The traces are not paired; every one is used
+        hr = next(iter(matfile.load(hr_path).values())).astype(np.float64).ravel()
+        toco = next(iter(matfile.load(toco_path).values())).astype(np.float64).ravel()
+        n = min(len(hr), len(toco))
+        hr, toco = hr[:n], toco[:n]
+        stage = DerivedStage(_features(rate, VALIDATION_THRESHOLDS))
+        results = {}
+        position = 0
+        while position < n:
+            end = min(n, position + int(rng.integers(1, 200)))
+            frame = {'t': list(range(position, end)), 'fhr': hr[position:end].tolist(), 'toco': toco[position:end].tolist()}
+            for name, values in stage.process(frame).items():
+                results.setdefault(name, []).extend(values)
+            position = end
+        expected = _reference(hr, toco, rate, VALIDATION_THRESHOLDS)
+        events = (f"{int(np.sum(np.diff(expected['toco_contraction'], prepend=0) > 0))} contractions, "
+                  f"{int(np.sum(np.diff(expected['fhr_decel'], prepend=0) > 0))} decelerations")
+        print(f"{os.path.basename(hr_path)} + {os.path.basename(toco_path)}: {n} samples, {events}")
+        for name, values in expected.items():
+            error = float(np.max(np.abs(np.asarray(results[name]) - values)))
+            ok = error <= 1e-6 * max(1.0, float(np.max(np.abs(values))))
+            failures += not ok
+            print(f"  {name:18} max error {error:.3g} {'ok' if ok else 'MISMATCH'}")
+    return failures
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Derived channels of the controller's frames")
+    parser.add_argument('--validate', action='store_true',
+                        help="check the incremental features against offline computations on the reference traces")
+    parser.add_argument('--dir', default=os.path.join(settings.SCRIPTS_DIR, 'production'),
+                        help="directory with hr<n>.mat and toco<n>.mat (default: %(default)s)")
+    parser.add_argument('--rate', type=float, default=settings.DERIVED_SAMPLE_RATE,
+                        help="samples per second of the traces (default: %(default)s)")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the random batch sizes")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if not args.validate:
+        print("Nothing to do; use --validate")
+        sys.exit(0)
+    sys.exit(1 if validate(args.dir, args.rate, args.seed) else 0)
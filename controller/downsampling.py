@@ -0,0 +1,169 @@
+"""Downsampling of sample series to the resolution a client displays them at.
+
+A client declares a viewport: the range of ``t`` it shows (a fixed
+``start``/``end``, or the latest ``span`` following the run) and its
+width in pixels. History for the viewport is reduced to about two points
+per pixel with ``minmax`` (the extremes of every pixel column, so peaks
+survive) or to one point per pixel with ``lttb`` (largest triangle three
+buckets, the visually closest shape). Live samples then go through a
+LiveDecimator, which keeps the extremes of every pixel column of ``t`` as
+they arrive, so what a client draws is bounded by its width and not by
+the length of the run.
+"""
+import numpy as np  # type: ignore
+
+from encoding import SampleFrame
+
+METHODS = ('minmax', 'lttb')
+
+
+def _runs(keys):
+    """Start index of every run of equal keys"""
+    return np.concatenate(([0], np.flatnonzero(keys[1:] != keys[:-1]) + 1))
+
+
+def _extremes(keys, values):
+    """Sorted indices of the minimum and maximum of each run of equal keys"""
+    starts = _runs(keys)
+    run = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(keys))))
+    order = np.lexsort((values, run))  # By run, then by value
+    ends = np.append(starts[1:], len(keys)) - 1
+    return np.unique(np.concatenate((order[starts], order[ends])))
+
+
+def minmax(t, values, buckets, start=None, end=None):
+    """Keep the lowest and highest sample of each of ``buckets`` equal ranges of t, plus the very first and last"""
+    if buckets <= 0 or len(t) <= 2 * buckets:
+        return t, values
+    start = t[0] if start is None else start
+    end = t[-1] if end is None else end
+    width = (end - start) / buckets or 1.0
+    keys = np.clip(np.floor((t - start) / width), 0, buckets - 1)
+    keep = np.unique(np.concatenate((_extremes(keys, values), [0, len(t) - 1])))
+    return t[keep], values[keep]
+
+
+def lttb(t, values, threshold):
+    """Largest triangle three buckets: ``threshold`` samples that best keep the shape of the series"""
+    n = len(t)
+    if threshold >= n or threshold < 3:
+        return t, values
+    # Buckets of equal sample count between the fixed first and last sample
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    previous = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # The third vertex is the mean of the next bucket (the last sample for the last bucket)
+        next_lo, next_hi = hi, edges[i + 2] if i + 2 < len(edges) else n
+        mean_t, mean_v = t[next_lo:next_hi].mean(), values[next_lo:next_hi].mean()
+        areas = np.abs((t[previous] - mean_t) * (values[lo:hi] - values[previous])
+                       - (t[previous] - t[lo:hi]) * (mean_v - values[previous]))
+        previous = keep[i + 1] = lo + int(np.argmax(areas))
+    return t[keep], values[keep]
+
+
+def downsample(t, values, width, method='minmax', start=None, end=None):
+    """Reduce (t, values) to what ``width`` pixels can show"""
+    if method == 'lttb':
+        return lttb(t, values, width)
+    return minmax(t, values, width, start, end)
+
+
+class Viewport:
+    """The t range and pixel width a client shows a session at"""
+
+    def __init__(self, width, start=None, end=None, span=None, method='minmax'):
+        if method not in METHODS:
+            raise ValueError(f"Unknown downsampling method: {method}")
+        if width <= 0:
+            raise ValueError("Viewport width must be positive")
+        if span is None and (start is None or end is None or end <= start):
+            raise ValueError("A viewport needs a span, or a start before its end")
+        if span is not None and span <= 0:
+            raise ValueError("Viewport span must be positive")
+        self.width = int(width)
+        self.start = start
+        self.end = end
+        self.span = span
+        self.method = method
+
+    @classmethod
+    def from_message(cls, data):
+        """Viewport of a ``viewport`` command, or None to turn downsampling off"""
+        if not data.get('width'):
+            return None
+
+        def number(key):
+            return None if data.get(key) is None else float(data[key])
+
+        return cls(float(data['width']), number('start'), number('end'), number('span'),
+                   data.get('method', 'minmax'))
+
+    @property
+    def resolution(self):
+        """t covered by one pixel"""
+        return (self.span if self.span is not None else self.end - self.start) / self.width
+
+    def window(self, latest=None):
+        """(start, end) of t shown; a following viewport ends at the latest sample"""
+        if self.span is None:
+            return self.start, self.end
+        end = latest if latest is not None else self.span
+        return end - self.span, end
+
+    def describe(self, latest=None):
+        start, end = self.window(latest)
+        return {'start': start, 'end': end, 'span': self.span, 'width': self.width, 'method': self.method,
+                'resolution': self.resolution}
+
+
+class LiveDecimator:
+    """Keeps the lowest and highest live sample of every ``resolution`` of t, per channel.
+
+    The samples of a column are held until a later sample falls in
+    another column, so each column is sent once, as at most two samples.
+    Channels then have their own ``t``, so a frame comes out per channel.
+    """
+
+    def __init__(self, resolution):
+        self.resolution = resolution
+        self._pending = {}  # Channel -> (t, values) kept of the current column
+
+    def reset(self):
+        self._pending.clear()
+
+    def process(self, frame):
+        """Frames of the completed columns of a frame's channels"""
+        frames = []
+        t = np.asarray(frame['t'], dtype=np.float64)
+        for name, column in frame.items():
+            if name == 't':
+                continue
+            try:
+                values = np.asarray(column, dtype=np.float64)
+            except (TypeError, ValueError):
+                continue  # Text channels cannot be drawn
+            if values.shape != t.shape:
+                continue
+            pending_t, pending_values = self._pending.get(name, (t[:0], values[:0]))
+            all_t, all_values = np.concatenate((pending_t, t)), np.concatenate((pending_values, values))
+            if not len(all_t):
+                continue
+            keys = np.floor(all_t / self.resolution)
+            last = _runs(keys)[-1]
+            # The last column may still get samples; keep only its extremes
+            held = last + _extremes(keys[last:], all_values[last:])
+            self._pending[name] = (all_t[held], all_values[held])
+            if last:
+                keep = _extremes(keys[:last], all_values[:last])
+                frames.append(SampleFrame({'t': all_t[keep].tolist(), name: all_values[keep].tolist()}))
+        return frames
+
+    def flush(self):
+        """Frames of the samples held back, e.g. when the run ends"""
+        frames = [SampleFrame({'t': t.tolist(), name: values.tolist()})
+                  for name, (t, values) in self._pending.items() if len(t)]
+        self._pending.clear()
+        return frames
@@ -0,0 +1,88 @@
+"""Wire encodings for columnar sample frames.
+
+JSON text is the default. Clients may negotiate a binary encoding in which a
+frame is sent as one WebSocket binary message::
+
+    uint32 little-endian   length of the header in bytes
+    header                 JSON {"channels": [...], "length": N, "dtype": "float32"},
+                           space-padded so the arrays start on an 8-byte boundary
+    arrays                 one little-endian array of N values per channel, in
+                           header order ("t" first)
+
+so browsers can view each channel as a typed array without copying.
+"""
+import json
+import struct
+import sys
+from array import array
+
+ENCODINGS = ('json', 'binary')
+DTYPES = {'float32': 'f', 'float64': 'd'}
+_HEADER_LENGTH = struct.Struct('<I')
+_NAN = float('nan')
+
+
+class SampleFrame(dict):
+    """Columnar frame of samples ({"t": [...], channel: [...]}).
+
+    Behaves like the plain dict that is sent as JSON, and caches its binary
+    encoding per dtype so a frame fanned out to many clients is packed once.
+    """
+
+    __slots__ = ('_binary',)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._binary = {}
+
+    def encode_binary(self, dtype):
+        """Return the binary encoding, or None if a channel is not numeric"""
+        if dtype not in self._binary:
+            self._binary[dtype] = encode_binary(self, dtype)
+        return self._binary[dtype]
+
+
+def encode_binary(frame, dtype='float32'):
+    """Pack a columnar frame; returns None if any value is not a number"""
+    typecode = DTYPES[dtype]
+    channels = list(frame)
+    arrays = []
+    for name in channels:
+        values = frame[name]
+        try:
+            packed = array(typecode, values)
+        except TypeError:
+            # MATLAB encodes NaN as null; anything else non-numeric cannot be packed
+            if not all(v is None or isinstance(v, (int, float)) for v in values):
+                return None
+            packed = array(typecode, [_NAN if v is None else v for v in values])
+        if sys.byteorder != 'little':
+            packed.byteswap()
+        arrays.append(packed)
+
+    header = json.dumps({
+        'channels': channels,
+        'length': len(frame['t']),
+        'dtype': dtype,
+    }, separators=(',', ':')).encode()
+    padding = -(_HEADER_LENGTH.size + len(header)) % 8
+    header += b' ' * padding
+    return b''.join([_HEADER_LENGTH.pack(len(header)), header] + [a.tobytes() for a in arrays])
+
+
+def decode_binary(payload):
+    """Unpack a binary frame into a SampleFrame of Python floats"""
+    (header_length,) = _HEADER_LENGTH.unpack_from(payload)
+    offset = _HEADER_LENGTH.size + header_length
+    header = json.loads(bytes(payload[_HEADER_LENGTH.size:offset]))
+    typecode = DTYPES[header['dtype']]
+    frame = SampleFrame()
+    for name in header['channels']:
+        values = array(typecode)
+        end = offset + header['length'] * values.itemsize
+        values.frombytes(bytes(payload[offset:end]))
+        if sys.byteorder != 'little':
+            values.byteswap()
+        frame[name] = values.tolist()
+        offset = end
+    return frame
@@ -0,0 +1,269 @@
+"""Pure-Python/NumPy stand-ins for the simple MATLAB scripts.
+
+Each engine reproduces the messages its ``.m`` script sends through
+``send_message`` (same shapes, same pacing) and speaks the same interface
+as MatlabClient (connect/start/request/receive/close), so a Session can
+run it without taking a MATLAB worker. Like a script run by startup.m, an
+engine's run is followed by its result and, unless the start command said
+``"repeat": false``, run again after a pause until stopped; it waits out
+its cycles at the run's speed, only sends data messages it has
+a credit for (getting a credit back for every one received) and applies
+updated parameters in place at its next cycle, confirming them with an
+``applied`` status like apply_update.m. Scripts without an engine here,
+such as FMPmodel and everything in scripts/production, still run on MATLAB.
+"""
+import asyncio
+import logging
+import math
+
+import numpy as np  # type: ignore
+
+import settings
+
+log = logging.getLogger(__name__)
+
+_CLOSED = object()
+
+
+def _encoded(values):
+    """An array as MATLAB's jsonencode sends it: a one-element array is a plain number"""
+    return values[0].item() if len(values) == 1 else values.tolist()
+
+
+def _is_data(message):
+    """Only data messages use send credits; the engines send status and error messages without waiting"""
+    return not (isinstance(message, dict) and ('status' in message or 'error' in message))
+
+
+class LocalEngine:
+    """Runs a script in-process, behind the MatlabClient interface"""
+
+    def __init__(self, script):
+        self.script = script
+        self._messages = asyncio.Queue()
+        self._task = None
+        self._credits = None  # Semaphore of the run's send credits; None without flow control
+        self._update = None  # Parameters of an update not applied yet
+        self.params = None  # Parameters in effect, including applied updates
+        self.repeat = True
+        self.speed = 1.0
+        self.rng = np.random.default_rng()
+
+    @property
+    def connected(self):
+        return True
+
+    async def connect(self, timeout=None):
+        log.info("Running %s on the local engine", self.script)
+
+    async def start(self, script, params, speed=1.0, repeat=True):
+        """Start the run like MatlabClient.start; ``repeat`` False runs the script once"""
+        command = {'type': 'start', 'script': script, 'params': params, 'speed': speed}
+        if not repeat:
+            command['repeat'] = False
+        if settings.MATLAB_SEND_CREDITS:
+            command['credits'] = settings.MATLAB_SEND_CREDITS
+        return await self.request(command)
+
+    async def request(self, command, timeout=None):
+        """Handle a start/update/stop command and return its acknowledgment"""
+        kind = command.get('type')
+        if kind == 'start':
+            self.speed = float(command.get('speed', 1.0))
+            self.repeat = command.get('repeat') is not False
+            credits = command.get('credits')
+            self._credits = asyncio.Semaphore(credits) if credits else None
+            self._update = None
+            self._restart(command.get('params'))
+            return {'status': 'started'}
+        elif kind == 'update':
+            # Applied by the running engine at its next cycle (see take_update)
+            try:
+                self._update = self.parse_params(command.get('params'))
+            except (TypeError, ValueError) as e:
+                return {'error': str(e)}
+            return {'status': 'updated'}
+        elif kind == 'stop':
+            await self._cancel()
+            return {'status': 'stopped', 'reason': 'command'}
+        return {'error': f"Unknown command type: {kind}"}
+
+    async def receive(self, timeout=None):
+        message = await asyncio.wait_for(self._messages.get(), timeout)
+        if message is _CLOSED:
+            self._messages.put_nowait(_CLOSED)
+            raise ConnectionError("Local engine closed")
+        if self._credits is not None and _is_data(message):
+            self._credits.release()
+        return message
+
+    async def close(self):
+        await self._cancel()
+        self._messages.put_nowait(_CLOSED)
+
+    def emit(self, message):
+        self._messages.put_nowait(message)
+
+    async def send_data(self, message):
+        """Data messages are sent once a credit allows it, like await_credit.m before send_message"""
+        if self._credits is not None:
+            await self._credits.acquire()
+        self.emit(message)
+
+    def take_update(self, cycle):
+        """Parameters of an update to apply from this cycle on, confirmed like apply_update.m; None without one"""
+        params, self._update = self._update, None
+        if params is not None:
+            self.params = params
+            self.emit({'status': 'applied', 'params': params, 'cycle': cycle})
+        return params
+
+    async def pace(self, seconds):
+        """Wait out simulated time at the run's speed, like pace.m"""
+        await asyncio.sleep(seconds / self.speed if self.speed > 0 else 0)
+
+    def _restart(self, params):
+        if self._task is not None:
+            self._task.cancel()
+        self._task = asyncio.create_task(self._execute(params))
+
+    async def _cancel(self):
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _execute(self, params):
+        """Run the script the way startup.m does: result, then completed or the next run"""
+        try:
+            self.params = self.parse_params(params)
+            while True:
+                result = await self.run(*self.params)
+                if self._update is not None:
+                    # Returned with an update pending: run again at once, applying it at cycle 1
+                    continue
+                await self.send_data([] if result is None else result)
+                if not self.repeat:
+                    self.emit({'status': 'completed'})
+                    return
+                # startup.m pauses between cycles
+                await self.pace(0.5)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.error("Error in local engine %s: %s", self.script, e)
+            self.emit({'error': str(e)})
+
+    def parse_params(self, params):
+        """Convert the params array into the script's numeric arguments"""
+        if not isinstance(params, list) or len(params) != self.param_count:
+            raise ValueError(f"{self.script} expects {self.param_count} parameters")
+        return [float(p) for p in params]
+
+    async def run(self, *params):
+        """One run of the script; returns its result, None for the empty one"""
+        raise NotImplementedError
+
+
+class SinusEngine(LocalEngine):
+    """sinus.m: sine wave sent in chunks of 100 points, cycling until stopped"""
+
+    param_count = 5
+    chunk_size = 100
+
+    @staticmethod
+    def wave(a, f, ts, tsp, te):
+        num_points = math.floor((te - ts) / tsp) + 1
+        T = np.linspace(ts, te, num_points)
+        return a * np.sin(2 * np.pi * f * T)
+
+    async def run(self, *params):
+        chunk = 1  # Chunks sent since the start; updates take effect at a chunk
+        while True:
+            y = self.wave(*params)
+            position = 0
+            while position < len(y):
+                update = self.take_update(chunk)
+                if update:
+                    # Continue at the same point of the new wave
+                    params = update
+                    y = self.wave(*params)
+                    continue
+                await self.send_data(_encoded(y[position:position + self.chunk_size]))
+                position += self.chunk_size
+                chunk += 1
+                await self.pace(0.05)
+            # Delay between cycles
+            await self.pace(0.2)
+
+
+class CosinusEngine(LocalEngine):
+    """cosinus.m: returns the whole cosine wave as its result, so every run is one cycle"""
+
+    param_count = 5
+
+    async def run(self, a, f, ts, tsp, te):
+        # Each run is one cycle, so an update takes effect at its first
+        update = self.take_update(1)
+        if update:
+            a, f, ts, tsp, te = update
+        T = np.arange(ts, te + tsp / 2, tsp)
+        return _encoded(a * np.cos(2 * np.pi * f * T))
+
+
+class ParameterizedExampleEngine(LocalEngine):
+    """parameterized_example.m: one vital-signs struct per heartbeat cycle"""
+
+    param_count = 5
+
+    def draw(self, cycles, heart_rate, oxygen_level, systolic_bp, diastolic_bp):
+        """Oxygen, heart rate and blood pressures of the next cycles, all random variation drawn at once"""
+        noise = self.rng.standard_normal((max(cycles, 0), 4))
+        return np.column_stack((
+            np.clip(oxygen_level + noise[:, 0] * 2, 0, 100),
+            np.clip(heart_rate + noise[:, 1] * 5, 40, 200),
+            np.clip(systolic_bp + noise[:, 2] * 10, 90, 140),
+            np.clip(diastolic_bp + noise[:, 3] * 5, 60, 90),
+        ))
+
+    async def run(self, heart_rate, oxygen_level, num_cycles, systolic_bp, diastolic_bp):
+        cycles = int(num_cycles)
+        cycle_time = 60 / heart_rate
+        vitals = self.draw(cycles, heart_rate, oxygen_level, systolic_bp, diastolic_bp)
+        first = 0  # Cycle of vitals[0]
+        cycle = 0
+        while cycle < cycles:
+            # Cycles count from 1, as in the .m script
+            update = self.take_update(cycle + 1)
+            if update:
+                heart_rate, oxygen_level, num_cycles, systolic_bp, diastolic_bp = update
+                cycles = int(num_cycles)
+                cycle_time = 60 / heart_rate
+                vitals, first = self.draw(cycles - cycle, heart_rate, oxygen_level, systolic_bp, diastolic_bp), cycle
+                continue
+            oxygen, heart, systolic, diastolic = vitals[cycle - first].tolist()
+            await self.send_data({
+                'oxygen_level': oxygen,
+                'heart_rate': heart,
+                'systolic_bp': systolic,
+                'diastolic_bp': diastolic,
+            })
+            # Wait for next cycle (real time, or faster at the run's speed)
+            await self.pace(cycle_time)
+            cycle += 1
+
+
+LOCAL_ENGINES = {
+    'sinus.m': SinusEngine,
+    'cosinus.m': CosinusEngine,
+    'parameterized_example.m': ParameterizedExampleEngine,
+}
+
+
+def runs_locally(script):
+    return script in settings.LOCAL_SCRIPTS and script in LOCAL_ENGINES
+
+
+def create_local_engine(script):
+    """Return a local engine for the script, or None if it must run on MATLAB"""
+    return LOCAL_ENGINES[script](script) if runs_locally(script) else None
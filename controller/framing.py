@@ -0,0 +1,92 @@
+"""Newline-delimited JSON framing for the MATLAB TCP stream.
+
+Every message exchanged with MATLAB is a single JSON document terminated by
+``\\n`` (``writeline``/``readline`` on the MATLAB side). ``jsonencode`` never
+emits a raw newline, so the terminator cannot appear inside a frame.
+"""
+import json
+import logging
+import re
+
+log = logging.getLogger(__name__)
+
+FRAME_TERMINATOR = b'\n'
+MAX_FRAME_SIZE = 16 * 1024 * 1024  # Guard against a peer that never sends a terminator
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+def encode_frame(message):
+    """Serialize a message into a single newline-terminated frame"""
+    return json.dumps(message, separators=(',', ':')).encode() + FRAME_TERMINATOR
+
+
+class FrameDecoder:
+    """Incremental decoder turning arbitrary TCP reads into JSON messages.
+
+    Received bytes are appended to one bytearray. The complete frames of a
+    read are decoded to text in one pass and parsed in place, without
+    copying each frame out of the buffer, and the consumed prefix is dropped
+    once per ``feed``. A read carrying hundreds of coalesced samples thus
+    costs a single decode and compaction, and a partial frame simply waits
+    for the next read.
+    """
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        self.frames_decoded = 0
+        self.decode_errors = 0
+        self._buffer = bytearray()
+        self._scan_from = 0  # Bytes before this offset are known to hold no terminator
+        self._decoder = json.JSONDecoder()
+
+    def feed(self, data):
+        """Append received bytes and return every complete message decoded"""
+        buffer = self._buffer
+        buffer += data
+        messages = []
+        end = buffer.rfind(FRAME_TERMINATOR, self._scan_from)
+        if end >= 0:
+            with memoryview(buffer) as view, view[:end] as frames:
+                text = str(frames, 'utf-8', 'replace')
+            position = 0
+            while position <= len(text):
+                terminator = text.find('\n', position)
+                if terminator < 0:
+                    terminator = len(text)
+                self._parse(text, position, terminator, messages)
+                position = terminator + 1
+            del buffer[:end + 1]
+        self._scan_from = len(buffer)
+
+        if len(buffer) > self.max_frame_size:
+            self.decode_errors += 1
+            log.warning("Discarding %s bytes without frame terminator", len(buffer))
+            buffer.clear()
+            self._scan_from = 0
+
+        self.frames_decoded += len(messages)
+        return messages
+
+    def _parse(self, text, start, end, messages):
+        """Parse the frame text[start:end], skipping empty frames"""
+        begin = _WHITESPACE.match(text, start).end()
+        if begin >= end:
+            return
+        try:
+            message, stop = self._decoder.raw_decode(text, begin)
+            if stop != end and (stop > end or text[stop:end].strip()):
+                raise ValueError("Extra data after the JSON document")
+            messages.append(message)
+        except ValueError:
+            self.decode_errors += 1
+            log.warning("Could not parse MATLAB frame: %r", text[start:end][:200])
+
+    @property
+    def pending(self):
+        """Number of buffered bytes belonging to an incomplete frame"""
+        return len(self._buffer)
+
+    def reset(self):
+        """Drop any partially received frame"""
+        self._buffer.clear()
+        self._scan_from = 0
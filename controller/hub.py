@@ -0,0 +1,190 @@
+"""Publish/subscribe fan-out of session output to WebSocket clients"""
+import asyncio
+import logging
+import time
+from collections import deque
+
+import metrics
+import settings
+from downsampling import LiveDecimator
+from encoding import DTYPES, ENCODINGS, SampleFrame
+
+log = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ('drop-oldest', 'latest')
+
+
+def is_control_message(message):
+    """Status and error messages are never dropped or coalesced"""
+    return isinstance(message, dict) and ('status' in message or 'error' in message)
+
+
+class Subscriber:
+    """One WebSocket client watching a channel.
+
+    Messages are queued without blocking the publisher and written to the
+    WebSocket by the subscriber's own sender task, so a slow browser only
+    delays itself. At most ``max_queue`` data messages are kept; on overflow
+    ``drop-oldest`` discards the oldest one and ``latest`` discards every
+    pending data message so only the newest is sent. Sample frames go out
+    as JSON or, once the client negotiated it, in the binary encoding. A
+    client that declared a viewport gets its live samples downsampled to
+    the viewport's resolution.
+    """
+
+    def __init__(self, ws, max_queue=None, overflow=None, encoding='json', dtype='float32'):
+        self.ws = ws
+        self.max_queue = max_queue or settings.SUBSCRIBER_QUEUE_SIZE
+        self.overflow = overflow or settings.SUBSCRIBER_OVERFLOW
+        if self.overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {self.overflow}")
+        self.set_encoding(encoding, dtype)
+        self.channel = None
+        self.viewport = None
+        self.decimator = None
+        self.dropped = 0
+        self._queue = deque()  # (is_control, message, time queued) in publish order
+        self._data_count = 0
+        self._wakeup = asyncio.Event()
+        self._sent = asyncio.Event()  # Set while nothing is queued
+        self._sent.set()
+        self._task = asyncio.create_task(self._send_loop())
+
+    @property
+    def depth(self):
+        return len(self._queue)
+
+    def set_encoding(self, encoding, dtype='float32'):
+        """Choose how sample frames are sent to this client"""
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown encoding: {encoding}")
+        if dtype not in DTYPES:
+            raise ValueError(f"Unknown dtype: {dtype}")
+        self.encoding = encoding
+        self.dtype = dtype
+
+    def set_viewport(self, viewport):
+        """Downsample live frames for a downsampling.Viewport, or send them whole with None"""
+        self.viewport = viewport
+        self.decimator = LiveDecimator(viewport.resolution) if viewport else None
+
+    def offer(self, message, decimate=True):
+        """Queue a message for sending; never blocks.
+
+        With a viewport, sample frames are downsampled first (unless
+        ``decimate`` is False, for frames already fitted to it) and samples
+        held back go out before any status message.
+        """
+        if self.decimator and decimate:
+            if isinstance(message, SampleFrame):
+                for frame in self.decimator.process(message):
+                    self._enqueue(frame)
+                return
+            if is_control_message(message):
+                for frame in self.decimator.flush():
+                    self._enqueue(frame)
+        self._enqueue(message)
+
+    def _enqueue(self, message):
+        control = is_control_message(message)
+        if not control:
+            if self._data_count >= self.max_queue:
+                if self.overflow == 'latest':
+                    self._drop_data(self._data_count)
+                else:
+                    self._drop_data(1)
+            self._data_count += 1
+        metrics.QUEUE_DEPTH.observe(len(self._queue))
+        self._queue.append((control, message, time.monotonic()))
+        self._sent.clear()
+        self._wakeup.set()
+
+    def _drop_data(self, count):
+        """Drop the oldest ``count`` data messages in place; control messages ahead of them are put back"""
+        skipped = []
+        while count and self._queue:
+            entry = self._queue.popleft()
+            if entry[0]:
+                skipped.append(entry)
+            else:
+                count -= 1
+                self._data_count -= 1
+                self.dropped += 1
+                metrics.DROPPED.inc()
+        self._queue.extendleft(reversed(skipped))
+        if not self._queue:
+            self._sent.set()
+
+    def clear(self):
+        """Forget queued data messages, e.g. when switching channels"""
+        self._drop_data(self._data_count)
+
+    def move_to(self, channel):
+        """Detach from the current channel and start watching another one"""
+        if self.channel is channel:
+            return
+        if self.channel is not None:
+            self.channel.remove(self)
+        self.clear()
+        if self.decimator:
+            self.decimator.reset()
+        self.channel = channel
+        if channel is not None:
+            channel.add(self)
+
+    async def _send_loop(self):
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                while self._queue:
+                    control, message, queued = self._queue.popleft()
+                    if not control:
+                        self._data_count -= 1
+                    metrics.QUEUE_DELAY.observe(time.monotonic() - queued)
+                    if self.encoding == 'binary' and isinstance(message, SampleFrame):
+                        payload = message.encode_binary(self.dtype)
+                        if payload is not None:
+                            await self.ws.send_bytes(payload)
+                            metrics.FRAMES_OUT.labels('binary').inc()
+                            continue
+                    await self.ws.send_json(message)
+                    metrics.FRAMES_OUT.labels('json').inc()
+                self._sent.set()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning("Stopped sending to WebSocket client: %s", e)
+
+    async def drain(self):
+        """Wait until every queued message has been sent, or sending failed"""
+        if not self._queue:
+            return
+        sent = asyncio.ensure_future(self._sent.wait())
+        try:
+            await asyncio.wait([sent, self._task], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            sent.cancel()
+
+    async def close(self):
+        """Detach and stop the sender task"""
+        self.move_to(None)
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+
+class Channel:
+    """Broadcast channel of one session; publishing never waits for clients"""
+
+    def __init__(self):
+        self.subscribers = set()
+
+    def add(self, subscriber):
+        self.subscribers.add(subscriber)
+
+    def remove(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+    def publish(self, message):
+        for subscriber in self.subscribers:
+            subscriber.offer(message)
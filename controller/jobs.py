@@ -0,0 +1,429 @@
+"""Batch parameter sweeps of MATLAB models, run on the worker pool below interactive sessions.
+
+A job expands a sweep specification into runs: every combination of the
+``grid`` values, each with ``samples`` random draws from the ``random``
+ranges, applied to the base ``params`` vector. Parameters are addressed by
+position or, when the script's function signature can be read, by name
+(e.g. ``vScen`` of FMPmodel.m)::
+
+    {"script": "FMPmodel.m", "params": [1, 1, 1, 2, 1, 2, 0, 0, 0, 0, 300, 0],
+     "grid": {"vScen": [0, 1, 2, 3]}, "random": {"vNCycleMax": [100, 500]},
+     "samples": 5, "seed": 1, "priority": 0, "retries": 2, "timeout": 3600, "speed": 0}
+
+Runs of higher-priority jobs go first, failed runs are retried after
+JOB_RETRY_DELAY seconds, and every run is recorded in the columnar format
+of recording.py, so its output can be memory-mapped or replayed. A run is
+started with ``repeat: false``, which makes startup.m run the script once
+and report ``completed`` instead of running it again, and by default
+unthrottled (``speed`` 0): nobody watches a batch run, so it goes as fast
+as MATLAB computes and the controller's send credits allow.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import re
+import shutil
+import time
+
+import numpy as np  # type: ignore
+
+import recording
+import settings
+from batching import SampleBatcher, add_message
+from result_cache import find_script
+from sessions import BATCH
+
+log = logging.getLogger(__name__)
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+# Arguments startup.m appends to the parameters of every script
+CONNECTION_ARGS = ['server', 'should_stop']
+_FUNCTION = re.compile(r'function\s+(?:[^=(]*=\s*)?\w+\s*\(([^)]*)\)')
+
+_job_ids = itertools.count(1)
+
+
+def script_parameters(script):
+    """Parameter names of a script's function, or None if the script's source is not available"""
+    path = find_script(script)
+    if path is None:
+        return None
+    with open(path, errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('%'):
+                continue
+            match = _FUNCTION.match(line)
+            args = [a.strip() for a in match.group(1).split(',')] if match else []
+            if args[-len(CONNECTION_ARGS):] != CONNECTION_ARGS:
+                raise ValueError(f"{script} is not a function taking parameters, server and should_stop")
+            return args[:-len(CONNECTION_ARGS)]
+    return None
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _position(key, names, count):
+    """Index of a parameter given by name or position"""
+    if names and key in names:
+        return names.index(key)
+    try:
+        index = int(key)
+    except ValueError:
+        raise ValueError(f"Unknown parameter: {key}") from None
+    if not 0 <= index < count:
+        raise ValueError(f"Parameter index out of range: {key}")
+    return index
+
+
+def expand_sweep(spec, names=None):
+    """Parameter vectors of every run of a sweep, and the seed of its random draws"""
+    base = spec.get('params')
+    if not isinstance(base, list) or not all(_is_number(v) for v in base):
+        raise ValueError("params must be a list of numbers")
+    if names is not None and len(base) != len(names):
+        raise ValueError(f"{spec['script']} takes {len(names)} parameters: {', '.join(names)}")
+    grid = []
+    for key, values in spec.get('grid', {}).items():
+        if not isinstance(values, list) or not values or not all(_is_number(v) for v in values):
+            raise ValueError(f"Grid values of {key} must be a non-empty list of numbers")
+        grid.append((_position(key, names, len(base)), values))
+    ranges = []
+    for key, bounds in spec.get('random', {}).items():
+        if not (isinstance(bounds, list) and len(bounds) == 2 and all(_is_number(v) for v in bounds)):
+            raise ValueError(f"Random range of {key} must be [low, high]")
+        ranges.append((_position(key, names, len(base)), bounds))
+    positions = [index for index, _ in grid + ranges]
+    if len(set(positions)) != len(positions):
+        raise ValueError("A parameter is swept more than once")
+    samples = int(spec.get('samples', 1)) if ranges else 1
+    if samples < 1:
+        raise ValueError("samples must be at least 1")
+    total = samples
+    for _, values in grid:
+        total *= len(values)
+    if total > settings.JOB_MAX_RUNS:
+        raise ValueError(f"Sweep expands to {total} runs, more than JOB_MAX_RUNS ({settings.JOB_MAX_RUNS})")
+
+    seed = spec.get('seed')
+    if seed is None:
+        seed = int(np.random.SeedSequence().entropy % 2 ** 32)  # Reported, so the sweep can be reproduced
+    rng = np.random.default_rng(int(seed))
+    runs = []
+    for combination in itertools.product(*(values for _, values in grid)):
+        params = list(base)
+        for (index, _), value in zip(grid, combination):
+            params[index] = value
+        for _ in range(samples):
+            run = list(params)
+            for index, (low, high) in ranges:
+                run[index] = float(rng.uniform(low, high))
+            runs.append(run)
+    return runs, seed
+
+
+class JobRun:
+    """One parameter vector of a job"""
+
+    def __init__(self, job, index, params):
+        self.job = job
+        self.index = index
+        self.params = params
+        self.state = PENDING
+        self.attempts = 0
+        self.error = None
+        self.recording = None
+        self.samples = 0
+        self.started = None
+        self.finished = None
+        self.task = None
+        self.preempted = False  # Gave its worker to an interactive session; requeued without counting as an attempt
+
+    def __str__(self):
+        return f"Job {self.job.id} run {self.index}"
+
+    def preempt(self):
+        self.preempted = True
+        if self.task:
+            self.task.cancel()
+
+    def describe(self):
+        return {
+            'run': self.index,
+            'params': self.params,
+            'state': self.state,
+            'attempts': self.attempts,
+            'error': self.error,
+            'recording': self.recording,
+            'samples': self.samples,
+            'duration': self.finished - self.started if self.started and self.finished else None,
+        }
+
+
+class Job:
+    """A sweep of one script over many parameter vectors"""
+
+    def __init__(self, script, runs, seed, priority=0, retries=None, timeout=None, speed=None):
+        self.id = next(_job_ids)
+        self.script = script
+        self.seed = seed
+        self.priority = priority
+        self.retries = settings.JOB_MAX_RETRIES if retries is None else retries
+        self.timeout = settings.JOB_RUN_TIMEOUT if timeout is None else timeout
+        self.speed = settings.JOB_SPEED if speed is None else speed
+        if self.speed < 0:
+            raise ValueError("speed must not be negative")
+        self.runs = [JobRun(self, index, params) for index, params in enumerate(runs)]
+        self.cancelled = False
+        self.created = time.time()
+        self.started = None  # First run started
+        self.finished = None  # Last run done or failed
+
+    def counts(self):
+        counts = dict.fromkeys((PENDING, RUNNING, DONE, FAILED, CANCELLED), 0)
+        for run in self.runs:
+            counts[run.state] += 1
+        return counts
+
+    @property
+    def state(self):
+        if self.cancelled:
+            return CANCELLED
+        if self.finished:
+            return DONE
+        return RUNNING if self.started else PENDING
+
+    def describe(self, runs=False):
+        """Progress of the job; the ETA extrapolates the rate at which runs have finished so far"""
+        counts = self.counts()
+        finished = counts[DONE] + counts[FAILED]
+        remaining = counts[PENDING] + counts[RUNNING]
+        elapsed = ((self.finished or time.time()) - self.started) if self.started else 0.0
+        summary = {
+            'job': self.id,
+            'script': self.script,
+            'state': self.state,
+            'priority': self.priority,
+            'speed': self.speed,
+            'seed': self.seed,
+            'runs': len(self.runs),
+            **counts,
+            'progress': finished / len(self.runs) if self.runs else 1.0,
+            'elapsed': elapsed,
+            'eta': elapsed / finished * remaining if finished and remaining and not self.cancelled else None,
+            'created': self.created,
+        }
+        if runs:
+            summary['run_details'] = [run.describe() for run in self.runs]
+        return summary
+
+
+class JobScheduler:
+    """Queues the runs of every job and runs them on MATLAB workers interactive sessions leave free"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.jobs = {}  # Job id -> Job
+        self._pending = []  # Heap of (-priority, job id, run index, run)
+        self._available = asyncio.Event()
+        self._tasks = set()
+        self._dispatcher = None
+
+    def start(self):
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def close(self):
+        tasks = list(self._tasks) + ([self._dispatcher] if self._dispatcher else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def submit(self, spec):
+        """Validate a sweep specification and queue its runs; raises ValueError for an invalid one"""
+        if not isinstance(spec, dict):
+            raise ValueError("Job specification must be a JSON object")
+        script = spec.get('script')
+        if not isinstance(script, str) or not script.endswith('.m') or '/' in script or '\\' in script:
+            raise ValueError("script must be the file name of a .m script")
+        try:
+            names = script_parameters(script)
+            runs, seed = expand_sweep(spec, names)
+            job = Job(script, runs, seed, int(spec.get('priority', 0)), int(spec.get('retries', settings.JOB_MAX_RETRIES)),
+                      float(spec.get('timeout', settings.JOB_RUN_TIMEOUT)),
+                      float(spec.get('speed', settings.JOB_SPEED)))
+        except (TypeError, AttributeError) as e:
+            raise ValueError(f"Invalid job specification: {e}") from e
+        except OSError as e:
+            raise ValueError(f"Cannot read {script}: {e}") from e
+        self.jobs[job.id] = job
+        for run in job.runs:
+            self._push(run)
+        log.info("Job %s: %s runs of %s queued with priority %s", job.id, len(job.runs), script, job.priority)
+        return job
+
+    def cancel(self, job):
+        """Drop the job's pending runs and stop the running ones"""
+        job.cancelled = True
+        for run in job.runs:
+            if run.state == PENDING:
+                run.state = CANCELLED
+            elif run.task:
+                run.task.cancel()
+        log.info("Job %s cancelled", job.id)
+
+    def _push(self, run):
+        if run.state != PENDING or run.job.cancelled:
+            return
+        heapq.heappush(self._pending, self._key(run) + (run,))
+        self._available.set()
+
+    @staticmethod
+    def _key(run):
+        return (-run.job.priority, run.job.id, run.index)
+
+    def _next_run(self):
+        while self._pending:
+            run = heapq.heappop(self._pending)[-1]
+            if run.state == PENDING and not run.job.cancelled:
+                return run
+        self._available.clear()
+        return None
+
+    async def _dispatch(self):
+        """Hand the highest-priority pending run to the next worker the pool can spare"""
+        while True:
+            await self._available.wait()
+            run = self._next_run()
+            if run is None:
+                continue
+            try:
+                worker = await self.pool.acquire(run, BATCH)
+            except ConnectionError as e:
+                log.warning("%s waiting for a MATLAB worker: %s", run, e)
+                self._push(run)
+                await asyncio.sleep(settings.JOB_RETRY_DELAY)
+                continue
+            if run.preempted or run.state != PENDING or run.job.cancelled:
+                # Preempted or cancelled while the worker was connecting
+                run.preempted = False
+                await self.pool.release(worker)
+                self._push(run)
+                continue
+            if self._pending and self._pending[0] < self._key(run):
+                # A retry or a higher-priority job was queued while waiting for the worker
+                self._push(run)
+                run = self._next_run()
+                worker.session = run
+            run.task = asyncio.create_task(self._execute(run, worker))
+            self._tasks.add(run.task)
+            run.task.add_done_callback(self._tasks.discard)
+
+    async def _execute(self, run, worker):
+        job = run.job
+        run.state = RUNNING
+        run.attempts += 1
+        run.started = time.time()
+        run.finished = None
+        run.error = None
+        run.samples = 0
+        if job.started is None:
+            job.started = run.started
+        recorder = None
+        repeat = False  # The attempt's output is discarded and the run queued again
+        log.info("%s started on MATLAB worker %s with params %s", run, worker.name, run.params)
+        try:
+            recorder = recording.RunRecorder(f'j{job.id}-r{run.index}', job.script, run.params, job.speed,
+                                             job=job.id, run=run.index)
+            run.recording = recorder.id
+            # Every message is written as it arrives; nobody is watching a batch run live
+            batcher = SampleBatcher(lambda frame: self._store(run, recorder, frame), rate=0)
+            ack = await worker.client.start(job.script, run.params, job.speed, repeat=False)
+            if 'error' in ack:
+                raise RuntimeError(f"MATLAB error: {ack['error']}")
+            await asyncio.wait_for(self._receive(worker.client, batcher), job.timeout or None)
+            run.state = DONE
+        except asyncio.CancelledError:
+            if run.preempted:
+                log.info("%s preempted, requeued", run)
+                run.preempted = False
+                run.attempts -= 1
+                run.state = PENDING
+                repeat = True
+            else:
+                run.state = CANCELLED
+            raise
+        except asyncio.TimeoutError:
+            repeat = self._fail(run, 'Timed out')
+        except (ConnectionError, OSError, RuntimeError) as e:
+            repeat = self._fail(run, str(e))
+        finally:
+            run.finished = time.time()
+            run.task = None
+            if recorder:
+                try:
+                    recorder.close()
+                except OSError as e:
+                    log.error("Error closing recording %s: %s", recorder.id, e)
+                if repeat:
+                    run.recording = None
+                    shutil.rmtree(recorder.path, ignore_errors=True)
+            await self.pool.release(worker)
+            if repeat:
+                # A retry waits JOB_RETRY_DELAY; a preempted run queues behind the interactive session right away
+                delay = settings.JOB_RETRY_DELAY if run.error else 0
+                asyncio.get_running_loop().call_later(delay, self._push, run)
+            self._report(job, run)
+
+    async def _receive(self, client, batcher):
+        """Store the run's output until MATLAB reports it completed"""
+        while True:
+            data = await client.receive()
+            if isinstance(data, dict) and 'error' in data:
+                raise RuntimeError(f"MATLAB error: {data['error']}")
+            if isinstance(data, dict) and 'status' in data:
+                if data['status'] == 'completed':
+                    return
+                if data['status'] == 'stopped':
+                    raise RuntimeError("Run stopped by MATLAB")
+                continue
+            add_message(batcher, data)
+
+    def _store(self, run, recorder, frame):
+        recorder.append_frame(frame)
+        run.samples += len(frame['t'])
+
+    def _fail(self, run, error):
+        """Record a failed attempt; returns True if the run will be retried"""
+        run.error = error
+        if run.attempts <= run.job.retries and not run.job.cancelled:
+            log.warning("%s failed (attempt %s): %s; retrying in %s s",
+                        run, run.attempts, error, settings.JOB_RETRY_DELAY)
+            run.state = PENDING
+            return True
+        log.warning("%s failed after %s attempts: %s", run, run.attempts, error)
+        run.state = FAILED
+        return False
+
+    def _report(self, job, run):
+        if run.state not in (DONE, FAILED):
+            return
+        if all(r.state in (DONE, FAILED, CANCELLED) for r in job.runs):
+            job.finished = time.time()
+        progress = job.describe()
+        if job.finished:
+            log.info("Job %s finished: %s runs done, %s failed in %.0f s",
+                     job.id, progress[DONE], progress[FAILED], progress['elapsed'])
+        else:
+            log.info("Job %s: %s of %s runs finished, ETA %.0f s", job.id, progress[DONE] + progress[FAILED],
+                     progress['runs'], progress['eta'] or 0)
+
+    def describe(self):
+        return [job.describe() for job in self.jobs.values()]
@@ -0,0 +1,80 @@
+"""Levelled, rate-limited logging for the controller.
+
+Modules log through ``logging.getLogger(__name__)``. Per-message details are
+logged at DEBUG, so at the default INFO level the hot path does no stdout
+I/O. Repeats of the same message beyond LOG_RATE_LIMIT per second are
+suppressed and counted; the count is reported with the next one let through.
+LOG_FORMAT=json writes one JSON object per line.
+"""
+import json
+import logging
+import sys
+import time
+
+import settings
+
+
+class RateLimitFilter(logging.Filter):
+    """Let at most ``limit`` records per message template through each second"""
+
+    def __init__(self, limit):
+        super().__init__()
+        self.limit = limit
+        self._windows = {}  # (logger, template) -> [window start, passed, suppressed]
+
+    def filter(self, record):
+        if self.limit <= 0 or record.levelno >= logging.ERROR:
+            return True
+        now = time.monotonic()
+        window = self._windows.get((record.name, record.msg))
+        if window is None or now - window[0] >= 1.0:
+            suppressed = window[2] if window else 0
+            window = self._windows[(record.name, record.msg)] = [now, 0, 0]
+            if suppressed:
+                record.suppressed = suppressed
+        if window[1] >= self.limit:
+            window[2] += 1
+            return False
+        window[1] += 1
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def format(self, record):
+        text = super().format(record)
+        suppressed = getattr(record, 'suppressed', 0)
+        return f'{text} ({suppressed} similar messages suppressed)' if suppressed else text
+
+
+class JsonFormatter(logging.Formatter):
+    # Attributes of every LogRecord; anything else was passed through ``extra``
+    _standard = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+    def format(self, record):
+        entry = {
+            'time': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in self._standard:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def setup_logging(level=None, log_format=None, rate_limit=None):
+    """Configure the root logger once, at startup"""
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if (log_format or settings.LOG_FORMAT) == 'json' else TextFormatter())
+    handler.addFilter(RateLimitFilter(settings.LOG_RATE_LIMIT if rate_limit is None else rate_limit))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel((level or settings.LOG_LEVEL).upper())
+    # aiohttp logs every request at INFO
+    logging.getLogger('aiohttp.access').setLevel(logging.WARNING)
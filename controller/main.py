@@ -1,480 +1,406 @@
-import socket
-import time
 import json
-import numpy as np # type: ignore
-import matplotlib.pyplot as plt # type: ignore
+import logging
 import asyncio
-import websockets
-import threading
-import os
-import tempfile
-import atexit
 import aiohttp
 from aiohttp import web
 import pathlib
 
-# Global variables to store current parameters and running state
-current_params = None
-current_script = None
-is_running = False
-matlab_socket = None
-current_figure = None  # Keep track of the current figure
-data_file = None  # File to store accumulated data
-last_progress_update = 0  # Track last progress update time
-should_stop = False  # Flag to control MATLAB execution
-
-def cleanup():
-    """Cleanup function to ensure temporary file is removed on exit"""
-    global data_file
-    if data_file and os.path.exists(data_file.name):
-        try:
-            data_file.close()
-            os.unlink(data_file.name)
-        except Exception as e:
-            print(f"Error cleaning up temporary file: {e}")
-
-# Register cleanup function
-atexit.register(cleanup)
+import metrics
+import recording
+import settings
+from datasets import DatasetStore
+from downsampling import METHODS, Viewport, downsample
+from encoding import SampleFrame
+from hub import Subscriber
+from jobs import JobScheduler
+from logs import setup_logging
+from plotting import PlotRenderer
+from result_cache import ResultCache
+from sessions import Session, WorkerPool
+
+log = logging.getLogger('controller')
+
+def send_view(subscriber, session):
+    """Send a session's history downsampled to the subscriber's viewport, replacing what it shows"""
+    viewport = subscriber.viewport
+    latest = max((series.latest(1)[0][-1] for series in session.history.channels.values() if series.size), default=None)
+    start, end = viewport.window(latest)
+    subscriber.offer(dict(viewport.describe(latest), status='viewport', session=session.id))
+    for name, series in session.history.channels.items():
+        t, values = downsample(*series.slice(start, end), viewport.width, viewport.method, start, end)
+        subscriber.offer(SampleFrame({'t': t.tolist(), name: values.tolist()}), decimate=False)
 
 async def websocket_handler(request):
-    global current_script, current_params, is_running, matlab_socket, should_stop
-    print("Controller: New WebSocket connection established")
+    log.info("New WebSocket connection established")
     ws = web.WebSocketResponse()
     await ws.prepare(request)
-    print("Controller: WebSocket connection prepared")
+    sessions = request.app['sessions']
+    session = Session(request.app['worker_pool'], request.app['plot_renderer'], request.app['result_cache'])
+    sessions[session.id] = session
+    try:
+        queue_size = int(request.query['queue']) if 'queue' in request.query else None
+        subscriber = Subscriber(ws, queue_size, request.query.get('overflow'),
+                                request.query.get('encoding', 'json'), request.query.get('dtype', 'float32'))
+    except ValueError as e:
+        log.warning("Invalid subscription options: %s", e)
+        subscriber = Subscriber(ws)
+        subscriber.offer({'error': f'Invalid subscription options: {e}'})
+    subscriber.move_to(session.channel)
+    request.app['clients'][ws] = subscriber  # Drained on shutdown
+    log.debug("WebSocket connection prepared for session %s", session.id)
     
     try:
-        print("Controller: WebSocket connection prepared, waiting for messages")
+        log.debug("WebSocket connection prepared, waiting for messages")
         async for msg in ws:
-            print(f"Controller: WebSocket message received, type: {msg.type}")
+            log.debug("WebSocket message received, type: %s", msg.type)
             if msg.type == aiohttp.WSMsgType.TEXT:
-                print(f"Controller: Received WebSocket message: {msg.data}")
+                log.debug("Received WebSocket message: %s", msg.data)
                 try:
                     data = json.loads(msg.data)
-                    print(f"Controller: Parsed WebSocket message: {data}")
+                    log.debug("Parsed WebSocket message: %s", data)
                     
                     if data.get('type') == 'start':
-                        print("Controller: Processing start command")
-                        # Reset state for new run
-                        if matlab_socket:
-                            print("Controller: Closing existing MATLAB socket")
-                            try:
-                                stop_command = {"type": "stop"}
-                                print(f"Controller: Sending stop command to MATLAB: {stop_command}")
-                                matlab_socket.send(json.dumps(stop_command).encode())
-                                print("Controller: Stop command sent to MATLAB")
-                                
-                                # Wait for MATLAB to acknowledge the stop
-                                print("Controller: Waiting for MATLAB stop acknowledgment")
-                                response = matlab_socket.recv(4096).decode()
-                                print(f"Controller: Received MATLAB response: {response}")
-                                
-                                try:
-                                    response_data = json.loads(response)
-                                    print(f"Controller: Parsed MATLAB response: {response_data}")
-                                    if isinstance(response_data, dict) and response_data.get('status') == 'stopped':
-                                        print("Controller: MATLAB acknowledged stop command")
-                                    else:
-                                        print("Controller: Unexpected MATLAB response to stop command")
-                                except json.JSONDecodeError:
-                                    print(f"Controller: Error decoding MATLAB response: {response}")
-                            except Exception as e:
-                                print(f"Controller: Error sending stop command: {e}")
-                            finally:
-                                print("Controller: Closing MATLAB socket")
-                                matlab_socket.close()
-                                matlab_socket = None
-                                # Add a small delay to ensure socket is fully closed
-                                await asyncio.sleep(0.5)
-                        
-                        current_script = data.get('script', 'sinus.m')
-                        current_params = data.get('params')
-                        is_running = True
-                        should_stop = False
-                        print(f"Controller: Starting script {current_script} with params {current_params}")
-                        
-                        # Send started status to frontend
-                        print("Controller: Sending started status to frontend")
-                        await ws.send_json({'status': 'started'})
-                        
-                        # Start MATLAB communication in a separate task
-                        print("Controller: Creating MATLAB communication task")
-                        asyncio.create_task(send_script_to_matlab(current_script, current_params, ws))
+                        log.debug("Processing start command")
+                        if request.app['shutdown'].is_set():
+                            subscriber.offer({'error': 'Controller is shutting down'})
+                            continue
+                        subscriber.move_to(session.channel)
+                        # Without a script, run the one of config.json; its params also apply when none are given
+                        script = data.get('script') or settings.DEFAULT_SCRIPT
+                        params = data['params'] if 'params' in data else (
+                            settings.DEFAULT_PARAMS if script == settings.DEFAULT_SCRIPT else None)
+                        # speed 1 runs in real time, N is N times faster, 0 as fast as MATLAB computes;
+                        # repeat false runs the script once
+                        try:
+                            await session.start(script, params, data.get('cache', True) is not False,
+                                                float(data.get('speed', 1.0)), data.get('repeat', True) is not False)
+                        except (TypeError, ValueError) as e:
+                            subscriber.offer({'error': f"Cannot start script: {e}"})
                         
                     elif data.get('type') == 'stop':
-                        print("Controller: Processing stop command")
-                        should_stop = True
-                        if matlab_socket:
-                            try:
-                                stop_command = {"type": "stop"}
-                                print(f"Controller: Sending stop command to MATLAB: {stop_command}")
-                                matlab_socket.send(json.dumps(stop_command).encode())
-                                print("Controller: Stop command sent to MATLAB")
-                                
-                                # Wait for MATLAB to acknowledge the stop with timeout
-                                print("Controller: Waiting for MATLAB stop acknowledgment")
-                                start_time = time.time()
-                                timeout = 5.0  # 5 second timeout
-                                
-                                while time.time() - start_time < timeout:
-                                    try:
-                                        response = matlab_socket.recv(4096).decode()
-                                        if response:
-                                            print(f"Controller: Received MATLAB response: {response}")
-                                            try:
-                                                response_data = json.loads(response)
-                                                print(f"Controller: Parsed MATLAB response: {response_data}")
-                                                if isinstance(response_data, dict) and response_data.get('status') == 'stopped':
-                                                    print("Controller: MATLAB acknowledged stop command")
-                                                    break
-                                                else:
-                                                    print("Controller: Unexpected MATLAB response to stop command")
-                                            except json.JSONDecodeError:
-                                                print(f"Controller: Error decoding MATLAB response: {response}")
-                                    except BlockingIOError:
-                                        # No data available yet, sleep briefly
-                                        await asyncio.sleep(0.1)
-                                        continue
-                                    except Exception as e:
-                                        print(f"Controller: Error reading MATLAB response: {e}")
-                                        break
-                                
-                                if time.time() - start_time >= timeout:
-                                    print("Controller: Timeout waiting for MATLAB stop acknowledgment")
-                            except Exception as e:
-                                print(f"Controller: Error sending stop command: {e}")
-                            finally:
-                                print("Controller: Closing MATLAB socket")
-                                matlab_socket.close()
-                                matlab_socket = None
+                        log.debug("Processing stop command")
+                        if session.task:
+                            await session.stop()
                         else:
-                            print("Controller: No active MATLAB socket to stop")
-                        
-                        # Update state
-                        is_running = False
-                        should_stop = False
-
-                        # Add a small delay to ensure socket is fully closed
-                        await asyncio.sleep(0.5)
+                            log.warning("No active MATLAB run to stop")
                         
-                        # Send stopped status to frontend
-                        print("Controller: Sending stopped status to frontend")
-                        await ws.send_json({'status': 'stopped'})
+                        # The worker has acknowledged the stop and been reset; tell the frontend
+                        log.debug("Sending stopped status to frontend")
+                        session.publish({'status': 'stopped', 'session': session.id})
                     elif data.get('type') == 'update':
-                        print("Controller: Processing update command")
-                        if matlab_socket and is_running:
-                            # Create a separate task for the update
-                            asyncio.create_task(send_update_to_matlab(matlab_socket, data.get('params'), ws))
+                        log.debug("Processing update command")
+                        # Create a separate task for the update
+                        asyncio.create_task(session.update(data.get('params')))
+                    elif data.get('type') == 'replay':
+                        # Stream a recorded run; speed 1 is real time, N is N times faster, 0 as fast as possible
+                        log.debug("Processing replay command")
+                        subscriber.move_to(session.channel)
+                        try:
+                            await session.replay(str(data.get('recording')), float(data.get('speed', 1.0)))
+                        except (OSError, ValueError) as e:
+                            subscriber.offer({'error': f"Cannot replay recording: {e}"})
+                    elif data.get('type') == 'attach':
+                        # Watch another client's session without controlling it
+                        target = sessions.get(data.get('session'))
+                        if target is None:
+                            subscriber.offer({'error': f"Unknown session: {data.get('session')}"})
                         else:
-                            print("Controller: No active MATLAB session to update")
-                            await ws.send_json({'error': 'No active session to update'})
+                            log.info("Session %s client attaching to session %s", session.id, target.id)
+                            subscriber.move_to(target.channel)
+                            subscriber.offer(dict(target.describe(), status='attached'))
+                            # Backfill the recent history so the late joiner sees more than new samples
+                            if subscriber.viewport:
+                                send_view(subscriber, target)
+                            else:
+                                for name, series in target.history.channels.items():
+                                    t, values = series.latest(settings.ATTACH_BACKFILL)
+                                    subscriber.offer(SampleFrame({'t': t.tolist(), name: values.tolist()}))
+                    elif data.get('type') == 'viewport':
+                        # Downsample history and live samples to the t range and pixel width the client shows
+                        try:
+                            subscriber.set_viewport(Viewport.from_message(data))
+                        except (TypeError, ValueError) as e:
+                            subscriber.offer({'error': f"Invalid viewport: {e}"})
+                        else:
+                            watched = next((s for s in sessions.values() if s.channel is subscriber.channel), session)
+                            if subscriber.viewport:
+                                send_view(subscriber, watched)
+                            else:
+                                subscriber.offer({'status': 'viewport', 'session': watched.id, 'width': None})
+                    elif data.get('type') == 'encoding':
+                        # Negotiate the encoding of sample frames for this client
+                        try:
+                            subscriber.set_encoding(data.get('encoding', 'json'), data.get('dtype', 'float32'))
+                            subscriber.offer({'status': 'encoding', 'encoding': subscriber.encoding, 'dtype': subscriber.dtype})
+                        except ValueError as e:
+                            subscriber.offer({'error': str(e)})
+                    elif data.get('type') == 'detach':
+                        subscriber.move_to(session.channel)
+                        subscriber.offer({'status': 'detached', 'session': session.id})
                     else:
-                        print(f"Controller: Unknown message type: {data.get('type')}")
+                        log.warning("Unknown message type: %s", data.get('type'))
                 except json.JSONDecodeError as e:
-                    print(f"Controller: Error decoding WebSocket message: {e}")
-                    print(f"Controller: Raw message: {msg.data}")
+                    log.warning("Error decoding WebSocket message: %s", e)
+                    log.debug("Raw message: %s", msg.data)
                 except Exception as e:
-                    print(f"Controller: Error processing WebSocket message: {e}")
+                    log.error("Error processing WebSocket message: %s", e)
             elif msg.type == aiohttp.WSMsgType.ERROR:
-                print(f"Controller: WebSocket error: {msg.data}")
+                log.warning("WebSocket error: %s", msg.data)
             elif msg.type == aiohttp.WSMsgType.CLOSED:
-                print("Controller: WebSocket connection closed")
+                log.info("WebSocket connection closed")
             elif msg.type == aiohttp.WSMsgType.CLOSING:
-                print("Controller: WebSocket connection closing")
+                log.info("WebSocket connection closing")
             else:
-                print(f"Controller: Unhandled WebSocket message type: {msg.type}")
+                log.warning("Unhandled WebSocket message type: %s", msg.type)
                     
-    except websockets.exceptions.ConnectionClosed:
-        print("Controller: WebSocket connection closed")
-        is_running = False
-        should_stop = True
     except Exception as e:
-        print(f"Controller: WebSocket error: {e}")
+        log.warning("WebSocket error: %s", e)
     finally:
-        if matlab_socket:
-            print("Controller: Cleaning up MATLAB socket in WebSocket handler")
-            matlab_socket.close()
-            matlab_socket = None
+        request.app['clients'].pop(ws, None)
+        await subscriber.close()
+        await session.close()
+        if session.channel.subscribers:
+            session.publish({'status': 'stopped', 'session': session.id, 'reason': 'owner disconnected'})
+        del sessions[session.id]
         return ws
 
-async def init_app():
-    app = web.Application()
-    app.router.add_get('/ws', websocket_handler)  # WebSocket endpoint
-    app.router.add_static('/', pathlib.Path('/app/output'))  # Static files
-    print("Controller: WebSocket routes configured")
-    return app
+async def sessions_handler(request):
+    """List the sessions clients can attach to"""
+    return web.json_response([s.describe() for s in request.app['sessions'].values() if s.script])
 
-async def start_websocket_server():
-    app = await init_app()
-    runner = web.AppRunner(app)
-    await runner.setup()
-    site = web.TCPSite(runner, '0.0.0.0', 8765)
-    await site.start()
-    print("Controller: Web server started on http://0.0.0.0:8765")
-    print("Controller: Waiting for WebSocket connections...")
-    await asyncio.Future()  # run forever
-
-def run_websocket_server():
-    print("Controller: Starting WebSocket server...")
-    asyncio.run(start_websocket_server())
+def _downsampling(request):
+    """Pixel width (0 for every sample) and method of the ``width`` and ``method`` query parameters"""
+    method = request.query.get('method', 'minmax')
+    try:
+        width = int(request.query.get('width', 0))
+    except ValueError:
+        raise web.HTTPBadRequest(text='Invalid width')
+    if method not in METHODS:
+        raise web.HTTPBadRequest(text=f'Unknown downsampling method: {method}')
+    return width, method
 
-def parse_matlab_response(response_data):
+async def history_handler(request):
+    """Return stored samples of a session: /sessions/{id}/history?channel=a,b&start=t0&end=t1&width=px"""
     try:
-        print(f"Controller: Received from MATLAB: {response_data}")
-        result = json.loads(response_data)
-        print(f"Controller: Parsed MATLAB response: {result}")
-        return result
-    except json.JSONDecodeError:
-        print(f"Controller: Failed to parse MATLAB response: {response_data}")
-        return None
-
-def plot_data(data_file_path, params, script_name):
-    global current_figure
-    
-    # Close the previous figure if it exists
-    if current_figure is not None:
-        plt.close(current_figure)
-    
-    # Create a new figure
-    current_figure = plt.figure(figsize=(12, 8))
-    
+        session = request.app['sessions'][int(request.match_info['session_id'])]
+        start = float(request.query['start']) if 'start' in request.query else None
+        end = float(request.query['end']) if 'end' in request.query else None
+    except (KeyError, ValueError):
+        raise web.HTTPNotFound(text='Unknown session or invalid range')
+    width, method = _downsampling(request)
+    names = request.query['channel'].split(',') if 'channel' in request.query else list(session.history.channels)
+    result = {}
+    for name in names:
+        if name not in session.history.channels:
+            raise web.HTTPNotFound(text=f'Unknown channel: {name}')
+        t, values = session.history.slice(name, start, end)
+        if width:
+            t, values = downsample(t, values, width, method, start, end)
+        result[name] = {'t': t.tolist(), 'values': values.tolist()}
+    return web.json_response(result)
+
+async def recordings_handler(request):
+    """List recorded runs that can be replayed"""
+    return web.json_response(recording.list_recordings())
+
+async def datasets_handler(request):
+    """List reference datasets, with the channels of those already converted"""
+    return web.json_response(request.app['datasets'].describe())
+
+async def _open_dataset(request):
+    """Open a reference dataset, converting it in a worker thread the first time"""
+    store = request.app['datasets']
     try:
-        # Read data from file
-        with open(data_file_path, 'r') as f:
-            data = [float(line.strip()) for line in f if line.strip()]
-        
-        print(f"Plotting {len(data)} data points from {data_file_path}")
-        
-        if not data:
-            print("No data found in file!")
-            return
-        
-        # Create time array based on the parameters
-        start_time = params[2]
-        time_step = params[3]
-        end_time = params[4]
-        t = np.arange(start_time, end_time + time_step, time_step)
-        
-        # Ensure we have the same number of points for x and y
-        if len(t) > len(data):
-            t = t[:len(data)]
-        elif len(data) > len(t):
-            data = data[:len(t)]
-        
-        # Plot the results with better styling
-        plt.plot(t, data, linewidth=2, color='blue')
-        plt.title(f'Real-time {script_name[:-2]} (A={params[0]}, f={params[1]}Hz)', fontsize=14, pad=20)
-        plt.xlabel('Time (s)', fontsize=12)
-        plt.ylabel('Amplitude', fontsize=12)
-        plt.grid(True, linestyle='--', alpha=0.7)
-        
-        # Add some additional information
-        plt.figtext(0.5, 0.01, f'Total points: {len(data)} | Time range: {start_time}s to {end_time}s', 
-                   ha='center', fontsize=10, style='italic')
-        
-        # Adjust layout to prevent text overlap
-        plt.tight_layout()
-        
-        # Save the plot with high DPI for better quality
-        plt.savefig(f'/app/output/realtime_plot.png', dpi=300, bbox_inches='tight')
-        print(f"Plot saved to /app/output/realtime_plot.png")
-        
-        # Don't close the figure here, let the caller handle it
-    except Exception as e:
-        print(f"Error while plotting: {str(e)}")
-        if current_figure is not None:
-            plt.close(current_figure)
-            current_figure = None
-
-async def send_script_to_matlab(script_name, params, ws):
-    """Send a script to MATLAB and get the response"""
-    global matlab_socket, should_stop
+        return await asyncio.get_running_loop().run_in_executor(None, store.open, request.match_info['dataset'])
+    except KeyError:
+        raise web.HTTPNotFound(text='Unknown dataset')
+    except (OSError, ValueError) as e:
+        log.error("Cannot convert dataset %s: %s", request.match_info['dataset'], e)
+        raise web.HTTPInternalServerError(text=f'Cannot convert dataset: {e}')
+
+async def dataset_handler(request):
+    """Channels of a reference dataset with their sample counts and time ranges"""
+    meta, _ = await _open_dataset(request)
+    return web.json_response(meta)
+
+async def dataset_data_handler(request):
+    """Return samples of reference channels: /datasets/{dataset}/data?channel=a,b&start=t0&end=t1&width=px"""
+    meta, channels = await _open_dataset(request)
     try:
-        print("Controller: Connecting to MATLAB service")
-        # Connect to MATLAB
-        matlab_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        matlab_socket.connect(('matlab_service', 12345))
-        matlab_socket.setblocking(False)  # Make socket non-blocking
-        print("Controller: Connected to MATLAB service")
-        
-        # Prepare the command
-        command = {
-            'type': 'start',
-            'script': script_name,
-            'params': params
-        }
-        
-        # Send the command
-        print(f"Controller: Sending command to MATLAB: {command}")
-        matlab_socket.send(json.dumps(command).encode())
-        print("Controller: Command sent to MATLAB")
-        
-        # Process responses
-        while not should_stop:
-            try:
-                # Try to read response with timeout
-                response = matlab_socket.recv(4096).decode()
-                if not response:
-                    print("Controller: No response received from MATLAB")
-                    break
-                    
-                try:
-                    print(f"Controller: Received from MATLAB: {response}")
-                    # First try to parse as numeric value
-                    try:
-                        data = float(response)
-                        print(f"Controller: Parsed MATLAB response as numeric: {data}")
-                        # Forward to WebSocket client
-                        await ws.send_json(data)
-                        print("Controller: Data forwarded successfully")
-                        continue
-                    except ValueError:
-                        # If not numeric, try to parse as JSON
-                        try:
-                            data = json.loads(response)
-                            print(f"Controller: Parsed MATLAB response as JSON: {data}")
-                            
-                            # Check if it's a final result or incremental data
-                            if isinstance(data, dict) and 'error' in data:
-                                print(f"Controller: MATLAB error: {data['error']}")
-                                await ws.send_json({'error': data['error']})
-                                raise Exception(f"MATLAB error: {data['error']}")
-                            elif isinstance(data, dict) and 'status' in data:
-                                print(f"Controller: MATLAB status: {data['status']}")
-                                await ws.send_json(data)
-                                if data['status'] == 'stopped':
-                                    print("Controller: Received stopped status from MATLAB")
-                                    break
-                                elif data['status'] == 'completed':
-                                    print("Controller: Received completed status from MATLAB")
-                                    break
-                            elif isinstance(data, dict) and 'name' in data and 'value' in data:
-                                # Handle named variable data
-                                print(f"Controller: Received named variable: {data['name']} = {data['value']}")
-                                await ws.send_json(data)
-                            elif isinstance(data, dict):
-                                # Handle dictionary data with direct key-value pairs
-                                print(f"Controller: Received dictionary data: {data}")
-                                await ws.send_json(data)
-                                print("Controller: Dictionary data forwarded successfully")
-                            elif isinstance(data, list):
-                                print(f"Controller: Received {len(data)} data points from MATLAB")
-                                # Write data points to file
-                                with open('data_points.txt', 'a') as f:
-                                    for point in data:
-                                        f.write(f"{point}\n")
-                                
-                                # Forward to WebSocket client
-                                print("Controller: Forwarding data to WebSocket client")
-                                await ws.send_json(data)
-                                print("Controller: Data forwarded successfully")
-                        except json.JSONDecodeError:
-                            print(f"Controller: Could not parse MATLAB response: {response}")
-                            continue
-                except Exception as e:
-                    print(f"Controller: Error in MATLAB communication: {e}")
-                    break
-            except BlockingIOError:
-                # No data available, sleep briefly and continue
-                await asyncio.sleep(0.1)
-                continue
-            except Exception as e:
-                print(f"Controller: Error in MATLAB communication: {e}")
-                break
-                
-    except Exception as e:
-        print(f"Controller: Error in send_script_to_matlab: {str(e)}")
-        try:
-            await ws.send_json({'error': str(e)})
-        except Exception as ws_error:
-            print(f"Controller: Error sending error to WebSocket: {ws_error}")
-    finally:
-        if matlab_socket:
-            print("Controller: Cleaning up MATLAB socket in send_script_to_matlab")
-            matlab_socket.close()
-            matlab_socket = None
-        is_running = False
-        should_stop = False
-
-async def send_update_to_matlab(matlab_socket, params, ws):
-    """Send update command to MATLAB in a separate task"""
+        start = float(request.query['start']) if 'start' in request.query else None
+        end = float(request.query['end']) if 'end' in request.query else None
+    except ValueError:
+        raise web.HTTPBadRequest(text='Invalid range')
+    width, method = _downsampling(request)
+    names = request.query['channel'].split(',') if 'channel' in request.query else list(channels)
+    result = {}
+    for name in names:
+        if name not in channels:
+            raise web.HTTPNotFound(text=f'Unknown channel: {name}')
+        t, values = request.app['datasets'].slice(meta['dataset'], name, start, end)
+        if width:
+            t, values = downsample(t, values, width, method, start, end)
+        result[name] = {'t': t.tolist(), 'values': values.tolist()}
+    return web.json_response(result)
+
+async def submit_job_handler(request):
+    """Queue a parameter sweep; the body is a sweep specification (see jobs.py)"""
     try:
-        update_command = {
-            'type': 'update',
-            'params': params
-        }
-        print(f"Controller: Sending update command to MATLAB: {update_command}")
-        
-        # Send the command
-        matlab_socket.send(json.dumps(update_command).encode())
-        print("Controller: Update command sent to MATLAB")
-        
-        # Wait for acknowledgment with timeout
-        print("Controller: Waiting for MATLAB update acknowledgment")
-        start_time = time.time()
-        timeout = 5.0  # 5 second timeout
-        acknowledgment_received = False
-        
-        while time.time() - start_time < timeout and not acknowledgment_received:
-            try:
-                response = matlab_socket.recv(4096).decode()
-                if response:
-                    print(f"Controller: Received MATLAB response: {response}")
-                    try:
-                        response_data = json.loads(response)
-                        if isinstance(response_data, dict):
-                            if response_data.get('status') == 'updated':
-                                print("Controller: MATLAB acknowledged update command")
-                                acknowledgment_received = True
-                                await ws.send_json({'status': 'updated'})
-                                break
-                            elif response_data.get('error'):
-                                print(f"Controller: MATLAB error: {response_data.get('error')}")
-                                await ws.send_json({'error': response_data.get('error')})
-                                break
-                        else:
-                            # If we receive data points, continue waiting for acknowledgment
-                            print("Controller: Received data points while waiting for acknowledgment, continuing to wait")
-                            continue
-                    except json.JSONDecodeError:
-                        print(f"Controller: Error decoding MATLAB response: {response}")
-                        continue
-            except BlockingIOError:
-                # No data available yet, sleep briefly
-                await asyncio.sleep(0.1)
-                continue
-            except Exception as e:
-                print(f"Controller: Error reading MATLAB response: {e}")
-                await ws.send_json({'error': str(e)})
-                break
-        
-        if not acknowledgment_received:
-            print("Controller: Timeout waiting for MATLAB update acknowledgment")
-            await ws.send_json({'error': 'Timeout waiting for MATLAB response'})
-    except Exception as e:
-        print(f"Controller: Error in update task: {e}")
-        await ws.send_json({'error': str(e)})
+        spec = await request.json()
+        job = request.app['job_scheduler'].submit(spec)
+    except ValueError as e:
+        raise web.HTTPBadRequest(text=str(e))
+    return web.json_response(job.describe(), status=201)
 
-if __name__ == "__main__":
-    # Load initial parameters from config file
+async def jobs_handler(request):
+    """Progress and ETA of every job"""
+    return web.json_response(request.app['job_scheduler'].describe())
+
+def _get_job(request):
     try:
-        with open('/app/config.json', 'r') as f:
-            config = json.load(f)
-            params = config['params']
-            script_name = config['script_name']
-    except FileNotFoundError:
-        print("Config file not found, using defaults")
-        params = [5, 0.5, 0, 0.1, 2]  # [amplitude, frequency, start_time, time_step, end_time]
-        script_name = 'sinus.m'
-    
-    # Start WebSocket server in a separate thread
-    websocket_thread = threading.Thread(target=run_websocket_server)
-    websocket_thread.daemon = True
-    websocket_thread.start()
-    
-    # Keep the main thread alive
+        return request.app['job_scheduler'].jobs[int(request.match_info['job_id'])]
+    except (KeyError, ValueError):
+        raise web.HTTPNotFound(text='Unknown job')
+
+async def job_handler(request):
+    """Progress of one job and the state, parameters and recording of each of its runs"""
+    return web.json_response(_get_job(request).describe(runs=True))
+
+async def cancel_job_handler(request):
+    job = _get_job(request)
+    request.app['job_scheduler'].cancel(job)
+    return web.json_response(job.describe())
+
+async def live_handler(request):
+    """Liveness: the event loop is answering"""
+    return web.json_response({'status': 'alive'})
+
+async def ready_handler(request):
+    """Readiness: enough MATLAB workers answer their health check and the controller is not shutting down"""
+    app = request.app
+    pool = app['worker_pool']
+    ready = not app['shutdown'].is_set() and pool.available >= settings.READY_MIN_WORKERS
+    return web.json_response({
+        'status': 'ready' if ready else 'not ready',
+        'workers': len(pool.workers),
+        'available': pool.available,
+        'idle': pool.idle,
+        'sessions': sum(1 for s in app['sessions'].values() if s.is_running),
+        'draining': app['shutdown'].is_set(),
+    }, status=200 if ready else 503)
+
+async def metrics_handler(request):
+    """Counters, histograms and current state in the Prometheus text format"""
+    app = request.app
+    sessions = list(app['sessions'].values())
+    pool = app['worker_pool']
+    running = sum(1 for s in sessions if s.is_running)
+    metrics.SESSIONS.labels('running').set(running)
+    metrics.SESSIONS.labels('queued').set(pool.waiting)
+    metrics.SESSIONS.labels('idle').set(len(sessions) - running)
+    metrics.WORKERS.labels('idle').set(pool.idle)
+    metrics.WORKERS.labels('busy').set(len(pool.workers) - pool.idle)
+    subscribers = {sub for s in sessions for sub in s.channel.subscribers}
+    metrics.SUBSCRIBERS.set(len(subscribers))
+    metrics.QUEUE_DEPTH_MAX.set(max((sub.depth for sub in subscribers), default=0))
+    runs = {}
+    for job in app['job_scheduler'].jobs.values():
+        for state, count in job.counts().items():
+            runs[state] = runs.get(state, 0) + count
+    for state, count in runs.items():
+        metrics.JOB_RUNS.labels(state).set(count)
+    return web.Response(text=metrics.REGISTRY.render(), content_type='text/plain', charset='utf-8')
+
+async def drain_sessions(app):
+    """On shutdown: stop every run, let clients receive the last messages and close their WebSockets"""
+    app['shutdown'].set()
+    running = [s for s in app['sessions'].values() if s.task]
+    log.info("Shutting down: draining %d running sessions and %d clients", len(running), len(app['clients']))
+
+    async def drain(session):
+        await session.stop()
+        session.publish({'status': 'stopped', 'session': session.id, 'reason': 'shutdown'})
+
     try:
-        while True:
-            time.sleep(1)
-    except KeyboardInterrupt:
-        print("Shutting down...")
\ No newline at end of file
+        await asyncio.wait_for(asyncio.gather(*(drain(s) for s in running)), settings.SHUTDOWN_TIMEOUT)
+        await asyncio.wait_for(asyncio.gather(*(c.drain() for c in app['clients'].values())), settings.SHUTDOWN_TIMEOUT)
+    except asyncio.TimeoutError:
+        log.warning("Sessions not drained after %s s; closing them", settings.SHUTDOWN_TIMEOUT)
+        await asyncio.gather(*(s.close() for s in running))
+    for ws in list(app['clients']):
+        await ws.close(code=aiohttp.WSCloseCode.GOING_AWAY, message=b'Controller shutting down')
+
+async def log_started(app):
+    log.info("Web server starting on http://0.0.0.0:%s; default script %s with params %s",
+             settings.CONTROLLER_PORT, settings.DEFAULT_SCRIPT, settings.DEFAULT_PARAMS)
+
+async def start_loop_monitor(app):
+    app['loop_monitor'] = asyncio.create_task(metrics.monitor_event_loop())
+
+async def stop_loop_monitor(app):
+    app['loop_monitor'].cancel()
+    await asyncio.gather(app['loop_monitor'], return_exceptions=True)
+
+async def start_worker_pool(app):
+    app['worker_pool'].start()
+
+async def start_job_scheduler(app):
+    app['job_scheduler'].start()
+
+async def close_job_scheduler(app):
+    await app['job_scheduler'].close()
+
+async def close_worker_pool(app):
+    await app['worker_pool'].close()
+
+async def close_plot_renderer(app):
+    if app['plot_renderer']:
+        await asyncio.get_running_loop().run_in_executor(None, app['plot_renderer'].close)
+
+async def init_app():
+    app = web.Application()
+    app['worker_pool'] = WorkerPool()
+    app['sessions'] = {}  # Session id -> Session, for clients attaching to a run
+    app['plot_renderer'] = PlotRenderer() if settings.PLOT_ENABLED else None
+    app['result_cache'] = ResultCache() if settings.CACHE_SCRIPTS else None
+    app['job_scheduler'] = JobScheduler(app['worker_pool'])  # Batch parameter sweeps
+    app['clients'] = {}  # WebSocket -> Subscriber of every connected client
+    app['shutdown'] = asyncio.Event()  # Set while shutting down; no new runs
+    app['datasets'] = DatasetStore()  # Reference traces, memory-mapped
+    app.on_startup.append(log_started)
+    app.on_startup.append(start_loop_monitor)
+    app.on_startup.append(start_worker_pool)
+    app.on_startup.append(start_job_scheduler)
+    app.on_shutdown.append(drain_sessions)
+    app.on_cleanup.append(stop_loop_monitor)
+    app.on_cleanup.append(close_job_scheduler)
+    app.on_cleanup.append(close_worker_pool)
+    app.on_cleanup.append(close_plot_renderer)
+    log.info("MATLAB worker pool: %s", ', '.join(w.name for w in app['worker_pool'].workers))
+    app.router.add_get('/ws', websocket_handler)  # WebSocket endpoint
+    app.router.add_get('/sessions', sessions_handler)  # Running sessions
+    app.router.add_get('/sessions/{session_id}/history', history_handler)  # Stored samples of a session
+    app.router.add_get('/recordings', recordings_handler)  # Recorded runs
+    app.router.add_get('/datasets', datasets_handler)  # Reference datasets
+    app.router.add_get('/datasets/{dataset}', dataset_handler)  # Channels of a reference dataset
+    app.router.add_get('/datasets/{dataset}/data', dataset_data_handler)  # Time range of reference channels
+    app.router.add_post('/jobs', submit_job_handler)  # Submit a parameter sweep
+    app.router.add_get('/jobs', jobs_handler)  # Progress of every job
+    app.router.add_get('/jobs/{job_id}', job_handler)  # Runs of a job
+    app.router.add_delete('/jobs/{job_id}', cancel_job_handler)  # Cancel a job
+    app.router.add_get('/metrics', metrics_handler)  # Prometheus metrics
+    app.router.add_get('/health/live', live_handler)  # Liveness probe
+    app.router.add_get('/health/ready', ready_handler)  # Readiness probe: MATLAB workers available
+    app.router.add_static('/', pathlib.Path(settings.PLOT_OUTPUT_DIR))  # Static files
+    log.debug("WebSocket routes configured")
+    return app
+
+def run_websocket_server():
+    """Serve on one event loop until SIGINT or SIGTERM, then drain sessions and clean up"""
+    web.run_app(init_app(), port=settings.CONTROLLER_PORT, print=None,
+                shutdown_timeout=settings.SHUTDOWN_TIMEOUT)
+
+if __name__ == "__main__":
+    setup_logging()
+    run_websocket_server()
+    log.info("Controller stopped")
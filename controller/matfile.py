@@ -0,0 +1,82 @@
+"""Reader for the numeric matrices of MATLAB v5 MAT-files, without SciPy.
+
+The reference traces in scripts/production (hr.mat, toco.mat, R1.mat ...)
+are level 5 MAT-files of real double or integer matrices, most of them
+zlib-compressed. Cells, structs, character arrays and sparse or complex
+matrices are skipped. MAT-files saved with ``-v7.3`` are HDF5 and not
+supported.
+"""
+import struct
+import zlib
+
+import numpy as np  # type: ignore
+
+HEADER_SIZE = 128
+
+# Data element types
+MI_INT8, MI_UINT8, MI_INT16, MI_UINT16, MI_INT32, MI_UINT32 = 1, 2, 3, 4, 5, 6
+MI_SINGLE, MI_DOUBLE, MI_INT64, MI_UINT64 = 7, 9, 12, 13
+MI_MATRIX, MI_COMPRESSED = 14, 15
+_DTYPES = {
+    MI_INT8: 'i1', MI_UINT8: 'u1', MI_INT16: 'i2', MI_UINT16: 'u2', MI_INT32: 'i4', MI_UINT32: 'u4',
+    MI_SINGLE: 'f4', MI_DOUBLE: 'f8', MI_INT64: 'i8', MI_UINT64: 'u8',
+}
+
+# Array classes of numeric matrices (mxDOUBLE_CLASS to mxUINT64_CLASS)
+_NUMERIC_CLASSES = range(6, 16)
+_COMPLEX_FLAG = 0x800
+
+
+def _elements(buffer, order):
+    """Yield (type, payload) of the data elements in a buffer"""
+    position = 0
+    while position + 8 <= len(buffer):
+        kind, size = struct.unpack_from(order + 'II', buffer, position)
+        if kind >> 16:
+            # Small element: type and size share the first word, data fits in the second
+            size, kind = kind >> 16, kind & 0xFFFF
+            yield kind, buffer[position + 4:position + 4 + size]
+            position += 8
+            continue
+        yield kind, buffer[position + 8:position + 8 + size]
+        # Compressed elements are not padded to 8 bytes
+        position += 8 + size + (0 if kind == MI_COMPRESSED else -size % 8)
+
+
+def _matrix(payload, order):
+    """(name, array) of a numeric matrix element, or None if it is not one"""
+    parts = list(_elements(payload, order))
+    if len(parts) < 4:
+        return None
+    flags = struct.unpack_from(order + 'I', parts[0][1])[0]
+    if flags & 0xFF not in _NUMERIC_CLASSES or flags & _COMPLEX_FLAG:
+        return None
+    dims = np.frombuffer(parts[1][1], dtype=order + 'i4')
+    name = bytes(parts[2][1]).decode('ascii', 'replace')
+    kind, data = parts[3]
+    if kind not in _DTYPES:
+        return None
+    values = np.frombuffer(data, dtype=order + _DTYPES[kind])
+    return name, values.reshape(tuple(dims), order='F')
+
+
+def load(path):
+    """Numeric variables of a MAT-file as {name: array}, with MATLAB's shape"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < HEADER_SIZE or not data.startswith(b'MATLAB 5.0 MAT-file'):
+        raise ValueError(f"{path} is not a MATLAB v5 MAT-file")
+    endian = data[126:128]
+    if endian not in (b'IM', b'MI'):
+        raise ValueError(f"{path} has an unknown byte order")
+    order = '<' if endian == b'IM' else '>'
+    variables = {}
+    for kind, payload in _elements(memoryview(data)[HEADER_SIZE:], order):
+        if kind == MI_COMPRESSED:
+            kind, payload = next(_elements(zlib.decompress(payload), order), (None, None))
+        if kind != MI_MATRIX:
+            continue
+        matrix = _matrix(payload, order)
+        if matrix is not None:
+            variables[matrix[0]] = matrix[1]
+    return variables
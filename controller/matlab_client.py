@@ -0,0 +1,172 @@
+"""asyncio connection to the MATLAB TCP service started by scripts/startup.m"""
+import asyncio
+import itertools
+import logging
+
+import metrics
+import settings
+from framing import FrameDecoder, encode_frame
+
+log = logging.getLogger(__name__)
+
+READ_SIZE = 65536
+_CLOSED = object()  # Queued for data consumers once the connection is gone
+
+
+class MatlabClient:
+    """Stream-based client for one MATLAB service.
+
+    A single reader task owns the connection and demultiplexes every frame:
+    acknowledgments carrying the ``id`` of a command sent with ``request``
+    resolve that command's future, everything else (samples, results,
+    errors) is queued for ``receive``. Concurrent commands therefore never
+    steal each other's frames.
+
+    A run started with ``start`` is flow-controlled: its start command
+    grants MATLAB a window of send credits, one per message, and
+    ``receive`` grants them back in quarters of the window as messages are
+    consumed. An unthrottled script therefore stays at most a window
+    ahead of the controller instead of filling the queue.
+    """
+
+    def __init__(self, host=None, port=None):
+        self.host = host or settings.MATLAB_HOST
+        self.port = port or settings.MATLAB_PORT
+        self.decoder = FrameDecoder()
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._messages = None
+        self._pending = {}  # Command id -> future resolved by its acknowledgment
+        self._command_ids = itertools.count(1)
+        self._window = 0  # Send credits of the current run; 0 without flow control
+        self._consumed = 0  # Messages received since credits were last granted
+
+    @property
+    def connected(self):
+        return (self._writer is not None and not self._writer.is_closing()
+                and self._reader_task is not None and not self._reader_task.done())
+
+    async def connect(self, timeout=None):
+        """Open the TCP connection to MATLAB and start the reader task"""
+        timeout = settings.MATLAB_CONNECT_TIMEOUT if timeout is None else timeout
+        log.debug("Connecting to MATLAB service at %s:%s", self.host, self.port)
+        with metrics.timer(metrics.CONNECT_LATENCY):
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), timeout)
+        self.decoder.reset()
+        self._messages = asyncio.Queue()
+        self._reader_task = asyncio.create_task(self._read_loop())
+        log.info("Connected to MATLAB service at %s:%s", self.host, self.port)
+
+    async def send(self, message):
+        """Send one command frame and wait until it is handed to the socket"""
+        if not self.connected:
+            raise ConnectionError("Not connected to MATLAB")
+        self._writer.write(encode_frame(message))
+        await self._writer.drain()
+
+    async def request(self, command, timeout=None):
+        """Send a command and wait for the acknowledgment echoing its id.
+
+        Returns the acknowledgment message. Raises asyncio.TimeoutError if
+        MATLAB does not answer in time and ConnectionError if the connection
+        drops while waiting.
+        """
+        timeout = settings.MATLAB_ACK_TIMEOUT if timeout is None else timeout
+        command_id = next(self._command_ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[command_id] = future
+        try:
+            with metrics.timer(metrics.ACK_LATENCY.labels(command.get('type'))):
+                await self.send(dict(command, id=command_id))
+                return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(command_id, None)
+
+    async def start(self, script, params, speed=1.0, repeat=True):
+        """Start a script and its credit window; returns the acknowledgment.
+
+        ``speed`` 1 runs the script in real time, N runs it N times faster
+        and 0 unthrottled. ``repeat`` False runs it once (batch runs).
+        """
+        command = {'type': 'start', 'script': script, 'params': params, 'speed': speed}
+        if not repeat:
+            command['repeat'] = False
+        self._window, self._consumed = settings.MATLAB_SEND_CREDITS, 0
+        if self._window:
+            command['credits'] = self._window
+        return await self.request(command)
+
+    async def receive(self, timeout=None):
+        """Return the next non-acknowledgment message from MATLAB.
+
+        Raises asyncio.TimeoutError if nothing arrives within ``timeout``
+        seconds and ConnectionError once MATLAB has closed the connection.
+        """
+        if self._messages is None:
+            raise ConnectionError("Not connected to MATLAB")
+        message = await asyncio.wait_for(self._messages.get(), timeout)
+        if message is _CLOSED:
+            self._messages.put_nowait(_CLOSED)  # Keep later receives failing too
+            raise ConnectionError("MATLAB closed the connection")
+        if self._window:
+            self._consumed += 1
+            if self._consumed >= max(1, self._window // 4):
+                credits, self._consumed = self._consumed, 0
+                await self.send({'type': 'credit', 'credits': credits})
+        return message
+
+    def discard_received(self):
+        """Drop data messages received but not yet consumed, e.g. the tail of a finished run"""
+        while self._messages is not None and not self._messages.empty():
+            message = self._messages.get_nowait()
+            if message is _CLOSED:
+                self._messages.put_nowait(_CLOSED)
+                break
+
+    async def _read_loop(self):
+        """Read the connection and route each decoded frame"""
+        try:
+            while True:
+                chunk = await self._reader.read(READ_SIZE)
+                if not chunk:
+                    log.info("MATLAB closed the connection")
+                    break
+                errors = self.decoder.decode_errors
+                messages = self.decoder.feed(chunk)
+                metrics.FRAMES_IN.inc(len(messages))
+                if self.decoder.decode_errors != errors:
+                    metrics.DECODE_ERRORS.inc(self.decoder.decode_errors - errors)
+                for message in messages:
+                    self._dispatch(message)
+        except (ConnectionError, OSError) as e:
+            log.error("Error reading from MATLAB: %s", e)
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("MATLAB connection closed"))
+            self._messages.put_nowait(_CLOSED)
+
+    def _dispatch(self, message):
+        if isinstance(message, dict) and 'id' in message:
+            future = self._pending.get(message['id'])
+            if future is not None and not future.done():
+                future.set_result(message)
+                return
+        self._messages.put_nowait(message)
+
+    async def close(self):
+        """Close the connection; safe to call more than once"""
+        writer, self._writer, self._reader = self._writer, None, None
+        reader_task, self._reader_task = self._reader_task, None
+        if reader_task is not None:
+            reader_task.cancel()
+            await asyncio.gather(reader_task, return_exceptions=True)
+        if writer is None:
+            return
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
@@ -0,0 +1,225 @@
+"""Stand-in for the MATLAB service, for running the controller without a MATLAB license.
+
+Speaks the protocol of scripts/startup.m and scripts/utils/check_messages.m:
+newline-terminated JSON commands (start, update, stop, reset, ping)
+acknowledged with {"status": "started" | "updated" | "stopped" | "reset" |
+"pong"} or {"error": ...}, echoing the command's id, and newline-terminated
+JSON data messages while a script runs. The script name is accepted but
+not executed; the data has the shape and rate chosen on the command line,
+times the ``speed`` of the start command (0 unthrottled). A start with
+``"repeat": false`` (a batch run) ends after --run-length messages with
+{"status": "completed"}. Like send_message.m, data messages use up the
+``credits`` of the start command and wait for the controller's
+{"type": "credit"} grants when none are left.
+An update is applied before the next message, keeping the run's sample
+index, and confirmed with {"status": "applied", "params": [...], "cycle": n}
+like apply_update.m.
+
+    python matlab_standin.py --port 12345 --workers 2 --shape vitals --rate 100
+
+listens on ports 12345 and 12346, so the controller can be pointed at it
+with MATLAB_WORKERS=localhost:12345,localhost:12346.
+"""
+import argparse
+import asyncio
+import math
+import random
+import time
+
+from framing import FrameDecoder, encode_frame
+
+SHAPES = ('vector', 'vitals', 'scalar')
+
+
+class StandinRun:
+    """Data a running "script" sends: one message per tick at the configured rate"""
+
+    def __init__(self, params, shape, chunk, stamp, speed=1.0, credits=None):
+        self.shape = shape
+        self.chunk = chunk
+        self.stamp = stamp
+        self.speed = speed
+        self.credits = credits  # Messages that may still be sent; None without flow control
+        self.granted = asyncio.Event()
+        self.index = 0
+        self.cycle = 0  # Messages sent
+        self.pending = None  # Params of an update, applied before the next message
+        self.set_params(params)
+
+    def set_params(self, params):
+        # Like sinus.m, the first parameter is the amplitude
+        first = params[0] if isinstance(params, list) and params else None
+        self.amplitude = float(first) if isinstance(first, (int, float)) else 1.0
+
+    def grant(self, credits):
+        if self.credits is not None:
+            self.credits += credits
+            self.granted.set()
+
+    async def use_credit(self):
+        """Wait until a message may be sent, like await_credit.m"""
+        while self.credits is not None and self.credits <= 0:
+            self.granted.clear()
+            await self.granted.wait()
+        if self.credits is not None:
+            self.credits -= 1
+
+    def next_message(self):
+        self.cycle += 1
+        if self.shape == 'vector':
+            start, self.index = self.index, self.index + self.chunk
+            return [self.amplitude * math.sin(0.01 * i) for i in range(start, self.index)]
+        self.index += 1
+        if self.shape == 'scalar':
+            return self.amplitude * math.sin(0.01 * self.index)
+        message = {
+            'oxygen_level': 97 + random.gauss(0, 2),
+            'heart_rate': 70 + self.amplitude * random.gauss(0, 5),
+            'systolic_bp': 120 + random.gauss(0, 10),
+            'diastolic_bp': 80 + random.gauss(0, 5),
+        }
+        if self.stamp:
+            message['sent_at'] = time.time()  # Lets the benchmark measure end-to-end latency
+        return message
+
+
+class StandinServer:
+    """One MATLAB worker endpoint"""
+
+    def __init__(self, port, shape='vitals', rate=100.0, chunk=100, stamp=False, ack_delay=0.0, run_length=200):
+        self.port = port
+        self.shape = shape
+        self.rate = rate
+        self.chunk = chunk
+        self.stamp = stamp
+        self.ack_delay = ack_delay
+        self.run_length = run_length
+        self.sent = 0
+
+    async def serve(self, host='0.0.0.0'):
+        server = await asyncio.start_server(self._handle, host, self.port)
+        print(f"MATLAB stand-in: Server started on port {self.port}")
+        return server
+
+    async def _handle(self, reader, writer):
+        print(f"MATLAB stand-in: Client connected on port {self.port}")
+        decoder = FrameDecoder()
+        emitter = run = None
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                for command in decoder.feed(data):
+                    if not isinstance(command, dict) or 'type' not in command:
+                        continue
+                    if self.ack_delay:
+                        # MATLAB only polls for commands between chunks
+                        await asyncio.sleep(self.ack_delay)
+                    kind = command['type']
+                    if kind == 'start':
+                        if 'script' not in command:
+                            self._ack(writer, command, {'error': 'Start command missing script field'})
+                            continue
+                        self._ack(writer, command, {'status': 'started'})
+                        run = StandinRun(command.get('params'), self.shape, self.chunk, self.stamp,
+                                         float(command.get('speed', 1.0)), command.get('credits'))
+                        emitter = self._restart(emitter, writer, run, once=command.get('repeat') is False)
+                    elif kind == 'update':
+                        # Applied by the running script at its next cycle
+                        self._ack(writer, command, {'status': 'updated'})
+                        if run:
+                            run.pending = command.get('params')
+                    elif kind == 'credit':
+                        if run:
+                            run.grant(command.get('credits', 0))
+                    elif kind == 'stop':
+                        self._ack(writer, command, {'status': 'stopped', 'reason': 'command'})
+                        emitter = self._restart(emitter, writer, None)
+                    elif kind == 'reset':
+                        self._ack(writer, command, {'status': 'reset'})
+                        emitter = run = self._restart(emitter, writer, None)
+                    elif kind == 'ping':
+                        self._ack(writer, command, {'status': 'pong'})
+                    else:
+                        print(f"MATLAB stand-in: Unknown command type: {kind}")
+                    await writer.drain()
+        except ConnectionError as e:
+            print(f"MATLAB stand-in: Connection on port {self.port} failed: {e}")
+        finally:
+            if emitter:
+                emitter.cancel()
+            writer.close()
+            print(f"MATLAB stand-in: Client disconnected from port {self.port} ({self.sent} messages sent)")
+
+    def _ack(self, writer, command, ack):
+        if 'id' in command:
+            ack['id'] = command['id']
+        writer.write(encode_frame(ack))
+
+    def _restart(self, emitter, writer, run, once=False):
+        if emitter:
+            emitter.cancel()
+        if run is None:
+            return None
+        return asyncio.create_task(self._emit(run, writer, self.run_length if once else None))
+
+    async def _emit(self, run, writer, length=None):
+        loop = asyncio.get_running_loop()
+        interval = 1.0 / (self.rate * run.speed) if self.rate > 0 and run.speed > 0 else 0.0
+        next_send = loop.time()
+        try:
+            while length is None or length > 0:
+                if length is not None:
+                    length -= 1
+                await run.use_credit()
+                if run.pending is not None:
+                    params, run.pending = run.pending, None
+                    run.set_params(params)
+                    writer.write(encode_frame({'status': 'applied', 'params': params, 'cycle': run.cycle + 1}))
+                writer.write(encode_frame(run.next_message()))
+                self.sent += 1
+                await writer.drain()
+                if interval:
+                    # Paced against the schedule, so the rate does not drift with send time
+                    next_send += interval
+                    await asyncio.sleep(max(0.0, next_send - loop.time()))
+                else:
+                    await asyncio.sleep(0)
+            # Like startup.m after a single run: the script's (empty) result, then completed
+            writer.write(encode_frame([]))
+            writer.write(encode_frame({'status': 'completed'}))
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+
+async def run_standin(args):
+    servers = []
+    for port in range(args.port, args.port + args.workers):
+        standin = StandinServer(port, args.shape, args.rate, args.chunk, args.stamp, args.ack_delay, args.run_length)
+        servers.append(await standin.serve(args.host))
+    await asyncio.gather(*(s.serve_forever() for s in servers))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=12345, help='first port to listen on')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker endpoints, on consecutive ports')
+    parser.add_argument('--shape', choices=SHAPES, default='vitals',
+                        help='vector: list of --chunk values per message (like sinus.m); '
+                             'vitals: struct of vital signs (like parameterized_example.m); scalar: one number')
+    parser.add_argument('--rate', type=float, default=100.0, help='messages per second while running; 0 is unthrottled')
+    parser.add_argument('--chunk', type=int, default=100, help='values per message for the vector shape')
+    parser.add_argument('--stamp', action='store_true', help='add a sent_at wall-clock time to vitals messages')
+    parser.add_argument('--run-length', type=int, default=200, help='messages of a single (batch) run')
+    parser.add_argument('--ack-delay', type=float, default=0.0, help='seconds before a command is acknowledged')
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(run_standin(parse_args()))
+    except KeyboardInterrupt:
+        print("MATLAB stand-in: Shutting down...")
@@ -0,0 +1,209 @@
+"""Process metrics, served by GET /metrics in the Prometheus text format.
+
+Counters and histograms are plain Python objects updated in place on the
+hot path (an increment or a bisect), and are only formatted when scraped.
+"""
+import asyncio
+import bisect
+import time
+
+# Histogram buckets, upper bounds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEPTH_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._children = {}
+
+    def labels(self, *values):
+        """The metric for one combination of label values"""
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self._samples())
+        return lines
+
+
+class _Value:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Counter(_Metric):
+    """Monotonic count; use labels() for labelled counters"""
+
+    kind = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def _samples(self):
+        return [f'{self.name}{_labels(self.label_names, k)} {c.value}' for k, c in self._children.items()]
+
+
+class Gauge(_Metric):
+    """Current value, typically set just before a scrape"""
+
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def _samples(self):
+        return [f'{self.name}{_labels(self.label_names, k)} {c.value}' for k, c in self._children.items()]
+
+
+class _HistogramValue:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in fixed buckets"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def _samples(self):
+        lines = []
+        for key, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), child.counts):
+                cumulative += count
+                labels = _labels(self.label_names + ('le',), key + (bound,))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _labels(self.label_names, key)
+            lines.append(f'{self.name}_sum{labels} {child.sum}')
+            lines.append(f'{self.name}_count{labels} {child.count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+FRAMES_IN = REGISTRY.register(Counter(
+    'controller_matlab_frames_in_total', 'Messages decoded from MATLAB connections'))
+DECODE_ERRORS = REGISTRY.register(Counter(
+    'controller_matlab_decode_errors_total', 'MATLAB frames that could not be decoded'))
+FRAMES_OUT = REGISTRY.register(Counter(
+    'controller_frames_out_total', 'Messages sent to WebSocket clients', ('encoding',)))
+SAMPLES_OUT = REGISTRY.register(Counter(
+    'controller_samples_published_total', 'Samples published in columnar frames'))
+DROPPED = REGISTRY.register(Counter(
+    'controller_client_dropped_total', 'Data messages dropped by client queue overflow'))
+ACK_LATENCY = REGISTRY.register(Histogram(
+    'controller_matlab_ack_seconds', 'MATLAB command round trip, from sending a command to its acknowledgment',
+    ('command',)))
+CONNECT_LATENCY = REGISTRY.register(Histogram(
+    'controller_matlab_connect_seconds', 'Time to open a MATLAB connection'))
+QUEUE_DEPTH = REGISTRY.register(Histogram(
+    'controller_client_queue_depth', 'Per-client outgoing queue depth when a message is queued',
+    buckets=DEPTH_BUCKETS))
+QUEUE_DELAY = REGISTRY.register(Histogram(
+    'controller_client_queue_seconds', 'Time a message waits in a client queue before it is sent'))
+LOOP_LAG = REGISTRY.register(Histogram(
+    'controller_event_loop_lag_seconds', 'How late the event loop runs a timer'))
+SESSIONS = REGISTRY.register(Gauge(
+    'controller_sessions', 'Sessions by state', ('state',)))
+WORKERS = REGISTRY.register(Gauge(
+    'controller_matlab_workers', 'MATLAB workers by state', ('state',)))
+SUBSCRIBERS = REGISTRY.register(Gauge(
+    'controller_clients', 'Connected WebSocket clients'))
+JOB_RUNS = REGISTRY.register(Gauge(
+    'controller_job_runs', 'Runs of batch jobs by state', ('state',)))
+QUEUE_DEPTH_MAX = REGISTRY.register(Gauge(
+    'controller_client_queue_depth_max', 'Deepest outgoing queue of any client right now'))
+
+
+async def monitor_event_loop(interval=0.25):
+    """Measure event-loop lag by checking how late a periodic sleep wakes up"""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(0.0, loop.time() - expected))
+
+
+class timer:
+    """Context manager observing how long a block took, unless it raised"""
+
+    __slots__ = ('histogram', 'started')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.histogram.observe(time.perf_counter() - self.started)
+        return False
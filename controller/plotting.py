@@ -0,0 +1,229 @@
+"""Plot snapshots of running sessions, rendered in a separate worker process.
+
+The event loop only hands new samples to a multiprocessing queue. The worker
+keeps one Agg figure per run, folds samples into a fixed number of min/max
+buckets per channel and updates the line data in place, so a snapshot costs
+the same after hours of data as after seconds. PNG snapshots are written at
+most once per PLOT_INTERVAL.
+"""
+import logging
+import math
+import multiprocessing
+import os
+import queue
+import time
+
+import numpy as np  # type: ignore
+
+import settings
+
+log = logging.getLogger(__name__)
+
+PLOT_WIDTH_PX = 1200
+PLOT_HEIGHT_PX = 800
+
+
+class PlotRenderer:
+    """Event-loop side of the plot worker; every method returns immediately"""
+
+    def __init__(self, output_dir=None, interval=None):
+        self.output_dir = output_dir or settings.PLOT_OUTPUT_DIR
+        self.interval = settings.PLOT_INTERVAL if interval is None else interval
+        self.dropped = 0
+        self._queue = None
+        self._process = None
+
+    def _send(self, command):
+        if self._process is None:
+            # Started on first use; spawn keeps the child free of the event loop's threads
+            context = multiprocessing.get_context('spawn')
+            self._queue = context.Queue(maxsize=settings.PLOT_QUEUE_SIZE)
+            self._process = context.Process(
+                target=_render_worker, args=(self._queue, self.output_dir, self.interval),
+                name='plot-renderer', daemon=True)
+            self._process.start()
+        try:
+            self._queue.put_nowait(command)
+        except queue.Full:
+            self.dropped += 1
+
+    def start_run(self, run_id, title, x_offset=0.0, x_step=1.0, x_label='Sample'):
+        """Begin a new figure for a run; x = x_offset + t * x_step"""
+        self._send(('start', run_id, title, x_offset, x_step, x_label))
+
+    def feed(self, run_id, frame):
+        """Queue the numeric channels of a columnar frame for plotting"""
+        self._send(('data', run_id, frame['t'], {k: v for k, v in frame.items() if k != 't'}))
+
+    def end_run(self, run_id):
+        """Write a final snapshot of the run and release its figure"""
+        self._send(('end', run_id))
+
+    def close(self):
+        if self._process is None:
+            return
+        try:
+            self._queue.put(('quit',), timeout=1.0)
+        except queue.Full:
+            pass
+        self._process.join(timeout=2.0)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._process = None
+
+
+class MinMaxEnvelope:
+    """Fixed-size min/max summary of a growing series.
+
+    Samples fall into ``buckets`` equal-width buckets starting at the first
+    sample. When a sample lands past the last bucket, neighbouring buckets
+    are merged pairwise and the bucket width doubles, so memory and drawing
+    cost stay constant however long the run gets.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.origin = None
+        self.width = 1.0
+        self.lo = np.full(buckets, np.inf)
+        self.hi = np.full(buckets, -np.inf)
+
+    def add(self, x, values):
+        keep = ~np.isnan(values)
+        x, values = x[keep], values[keep]
+        if not len(x):
+            return
+        if self.origin is None:
+            self.origin = float(x[0])
+        index = np.floor((x - self.origin) / self.width).astype(np.int64)
+        while index.max() >= self.buckets:
+            self.lo = np.concatenate((np.minimum(self.lo[0::2], self.lo[1::2]), np.full(self.buckets // 2, np.inf)))
+            self.hi = np.concatenate((np.maximum(self.hi[0::2], self.hi[1::2]), np.full(self.buckets // 2, -np.inf)))
+            self.width *= 2
+            index //= 2
+        index = np.clip(index, 0, None)
+        np.minimum.at(self.lo, index, values)
+        np.maximum.at(self.hi, index, values)
+
+    def line(self):
+        """x/y of a line tracing the envelope: each bucket's min then max"""
+        filled = np.nonzero(self.lo <= self.hi)[0]
+        x = self.origin + (filled + 0.5) * self.width
+        return np.repeat(x, 2), np.column_stack((self.lo[filled], self.hi[filled])).ravel()
+
+
+class _RunFigure:
+    """Persistent Agg figure of one run, updated in place"""
+
+    def __init__(self, title, x_offset, x_step, x_label):
+        from matplotlib.backends.backend_agg import FigureCanvasAgg  # type: ignore
+        from matplotlib.figure import Figure  # type: ignore
+        self.x_offset = x_offset
+        self.x_step = x_step
+        self.figure = Figure(figsize=(PLOT_WIDTH_PX / 100, PLOT_HEIGHT_PX / 100), dpi=100)
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.axes = self.figure.add_subplot(1, 1, 1)
+        self.axes.set_title(title, fontsize=14)
+        self.axes.set_xlabel(x_label, fontsize=12)
+        self.axes.set_ylabel('Value', fontsize=12)
+        self.axes.grid(True, linestyle='--', alpha=0.7)
+        self.envelopes = {}
+        self.lines = {}
+        self.samples = 0
+        self.dirty = False
+
+    def add(self, t, columns):
+        x = self.x_offset + np.asarray(t, dtype=np.float64) * self.x_step
+        for name, values in columns.items():
+            try:
+                values = np.asarray(values, dtype=np.float64)
+            except (TypeError, ValueError):
+                continue
+            if values.ndim != 1 or len(values) != len(x):
+                continue
+            if name not in self.envelopes:
+                # Two points per bucket; one bucket per pixel column is enough
+                self.envelopes[name] = MinMaxEnvelope(PLOT_WIDTH_PX)
+                (self.lines[name],) = self.axes.plot([], [], linewidth=1.5, label=name)
+                self.axes.legend(loc='upper right')
+            self.envelopes[name].add(x, values)
+        self.samples += len(x)
+        self.dirty = True
+
+    def render_png(self):
+        import io
+        for name, envelope in self.envelopes.items():
+            if envelope.origin is not None:
+                self.lines[name].set_data(*envelope.line())
+        self.axes.relim()
+        self.axes.autoscale_view()
+        buffer = io.BytesIO()
+        self.canvas.print_png(buffer)
+        self.dirty = False
+        return buffer.getvalue()
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _render_worker(commands, output_dir, interval):
+    """Worker process: apply queued commands and write snapshots at a bounded rate"""
+    import matplotlib  # type: ignore
+    from logs import setup_logging
+    setup_logging()
+    matplotlib.use('Agg')
+    os.makedirs(os.path.join(output_dir, 'plots'), exist_ok=True)
+    runs = {}
+    last_render = 0.0
+
+    def snapshot(run_id, run):
+        png = run.render_png()
+        _write_atomic(os.path.join(output_dir, 'plots', f'session_{run_id}.png'), png)
+        _write_atomic(os.path.join(output_dir, 'realtime_plot.png'), png)
+
+    while True:
+        timeout = max(0.0, last_render + interval - time.monotonic())
+        try:
+            command = commands.get(timeout=timeout if any(r.dirty for r in runs.values()) else None)
+        except queue.Empty:
+            command = None
+        except (EOFError, OSError):
+            return
+
+        try:
+            if command is not None:
+                kind = command[0]
+                if kind == 'quit':
+                    return
+                elif kind == 'start':
+                    _, run_id, title, x_offset, x_step, x_label = command
+                    runs[run_id] = _RunFigure(title, x_offset, x_step, x_label)
+                elif kind == 'data':
+                    _, run_id, t, columns = command
+                    if run_id in runs:
+                        runs[run_id].add(t, columns)
+                elif kind == 'end':
+                    run = runs.pop(command[1], None)
+                    if run is not None and run.samples:
+                        snapshot(command[1], run)
+
+            if time.monotonic() - last_render >= interval:
+                for run_id, run in runs.items():
+                    if run.dirty:
+                        snapshot(run_id, run)
+                last_render = time.monotonic()
+        except Exception as e:
+            log.error("Error while plotting: %s", e)
+
+
+def x_axis(script, params):
+    """Offset, step and label turning sample indices into the script's time axis"""
+    if script in ('sinus.m', 'cosinus.m') and isinstance(params, list) and len(params) >= 4:
+        offset, step = params[2], params[3]
+        if all(isinstance(v, (int, float)) and math.isfinite(v) for v in (offset, step)):
+            return float(offset), float(step), 'Time (s)'
+    return 0.0, 1.0, 'Sample'
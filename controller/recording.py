@@ -0,0 +1,197 @@
+"""Recording of runs to memory-mapped columnar files, and replay of recordings.
+
+A recording is a directory under RECORDINGS_DIR holding ``meta.json`` (run
+id, script, params and their updates, speed, start/end time, channels) and one
+append-only file per numeric channel. Each channel file is a flat array of
+``RECORD_DTYPE`` records, so it can be opened with ``numpy.memmap`` without
+parsing.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import os
+import re
+import time
+
+import numpy as np  # type: ignore
+
+import settings
+from encoding import SampleFrame
+
+log = logging.getLogger(__name__)
+
+# Sample index, value and wall-clock time the frame holding the sample was published
+RECORD_DTYPE = np.dtype([('t', '<f8'), ('value', '<f8'), ('received', '<f8')])
+_SAFE_NAME = re.compile(r'^[A-Za-z0-9_.-]+$')
+_run_numbers = itertools.count(1)
+
+
+def recording_path(recording_id):
+    """Directory of a recording; rejects ids that would escape RECORDINGS_DIR"""
+    if not _SAFE_NAME.match(recording_id) or recording_id.startswith('.'):
+        raise ValueError(f"Invalid recording id: {recording_id}")
+    return os.path.join(settings.RECORDINGS_DIR, recording_id)
+
+
+class RunRecorder:
+    """Appends the sample frames of one run to its recording directory"""
+
+    def __init__(self, label, script, params, speed=1.0, **extra):
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S')}-{label}-{next(_run_numbers)}"
+        self.path = recording_path(self.id)
+        os.makedirs(self.path, exist_ok=True)
+        self.meta = {
+            'recording': self.id,
+            'script': script,
+            'params': params,
+            'speed': speed,  # Run speed, so replay can restore the real-time pace
+            'started': time.time(),
+            'finished': None,
+            'channels': {},  # Name -> samples recorded
+            'updates': [],  # Params applied during the run, with the cycle and sample index they took effect at
+        }
+        self.meta.update(extra)  # E.g. the job and run index of a batch run
+        self._files = {}
+        self._write_meta()
+        log.info("Recording run to %s", self.path)
+
+    def _write_meta(self):
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump(self.meta, f)
+
+    def append_frame(self, frame):
+        """Append the numeric channels of a columnar frame"""
+        received = time.time()
+        t = frame['t']
+        for name, values in frame.items():
+            if name == 't' or not _SAFE_NAME.match(name):
+                continue
+            try:
+                column = np.asarray(values, dtype=np.float64)
+            except (TypeError, ValueError):
+                continue
+            if column.ndim != 1:
+                continue
+            records = np.empty(len(column), dtype=RECORD_DTYPE)
+            records['t'] = t
+            records['value'] = column
+            records['received'] = received
+            f = self._files.get(name)
+            if f is None:
+                f = self._files[name] = open(os.path.join(self.path, f'{name}.bin'), 'ab')
+            f.write(records.tobytes())
+            self.meta['channels'][name] = self.meta['channels'].get(name, 0) + len(records)
+
+    def add_update(self, update):
+        """Note parameters applied while the run goes on; written with the metadata on close"""
+        self.meta['updates'].append(update)
+
+    def close(self):
+        """Flush channel files and finalize the metadata"""
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+        self.meta['finished'] = time.time()
+        self._write_meta()
+        log.info("Recording %s finished: %s", self.id, self.meta['channels'])
+
+
+def list_recordings():
+    """Metadata of every recording, newest first"""
+    recordings = []
+    if not os.path.isdir(settings.RECORDINGS_DIR):
+        return recordings
+    for name in sorted(os.listdir(settings.RECORDINGS_DIR), reverse=True):
+        try:
+            recordings.append(load_meta(name))
+        except (OSError, ValueError):
+            continue
+    return recordings
+
+
+def load_meta(recording_id):
+    with open(os.path.join(recording_path(recording_id), 'meta.json')) as f:
+        return json.load(f)
+
+
+def open_channels(recording_id):
+    """Memory-map every channel of a recording as a RECORD_DTYPE array.
+
+    Channel files are discovered on disk, so a recording whose run never
+    finished cleanly can still be replayed.
+    """
+    meta = load_meta(recording_id)
+    path = recording_path(recording_id)
+    channels = {}
+    for file_name in sorted(os.listdir(path)):
+        if not file_name.endswith('.bin'):
+            continue
+        file_path = os.path.join(path, file_name)
+        count = os.path.getsize(file_path) // RECORD_DTYPE.itemsize  # Ignore a partially written record
+        if count:
+            channels[file_name[:-4]] = np.memmap(file_path, dtype=RECORD_DTYPE, mode='r', shape=(count,))
+    return meta, channels
+
+
+def iter_frames(channels):
+    """Rebuild the published frames of a recording in order.
+
+    Yields (received, SampleFrame); channels published together share
+    their publication time and sample indices.
+    """
+    times = np.unique(np.concatenate([c['received'] for c in channels.values()])) if channels else []
+    cursors = dict.fromkeys(channels, 0)
+    for received in times:
+        group = {}
+        for name, records in channels.items():
+            start = cursors[name]
+            end = start + int(np.searchsorted(records['received'][start:], received, side='right'))
+            if end > start:
+                group[name] = records[start:end]
+                cursors[name] = end
+        t = next(iter(group.values()))['t']
+        if all(len(r) == len(t) and np.array_equal(r['t'], t) for r in group.values()):
+            frame = SampleFrame(t=t.tolist())
+            for name, records in group.items():
+                frame[name] = records['value'].tolist()
+            yield received, frame
+        else:
+            for name, records in group.items():
+                yield received, SampleFrame({'t': records['t'].tolist(), name: records['value'].tolist()})
+
+
+async def replay(recording_id, publish, speed=1.0):
+    """Publish the frames of a recording, paced by their recorded timing.
+
+    ``speed`` 1 replays in real time, N replays N times faster and 0 replays
+    as fast as possible, whatever speed the run was recorded at.
+    """
+    meta, channels = open_channels(recording_id)
+    await replay_frames(iter_frames(channels), publish, speed, meta.get('speed', 1.0))
+    return meta
+
+
+async def replay_frames(frames, publish, speed=1.0, recorded_speed=1.0):
+    """Publish (received, frame) pairs, paced by their timestamps.
+
+    Timestamps of a run at ``recorded_speed`` N are N times closer together
+    than in real time and are stretched back before applying ``speed``. An
+    unthrottled run (0) has no real-time pace, so it is always replayed as
+    fast as possible.
+    """
+    if not recorded_speed:
+        speed = 0
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    first = None
+    for received, frame in frames:
+        if first is None:
+            first = received
+        if speed > 0:
+            delay = started + (received - first) * recorded_speed / speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        else:
+            await asyncio.sleep(0)  # Let clients and other sessions run
+        publish(frame)
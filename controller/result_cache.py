@@ -0,0 +1,263 @@
+"""Content-addressed cache of the output of deterministic script runs.
+
+Only single runs that completed are kept, so a cached run is the script's
+whole output. A run is keyed by the script name, a hash of the script's
+MATLAB sources and its parameter vector, so editing any ``.m`` file next to the script changes
+the key and old results are simply never hit again. Entries live in a
+size-bounded in-memory LRU of columnar NumPy frames; with CACHE_DIR set, an
+index on disk additionally points keys at the run's recording, so results
+survive a controller restart.
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import numpy as np  # type: ignore
+
+import recording
+import settings
+from encoding import SampleFrame
+
+log = logging.getLogger(__name__)
+
+SOURCE_SUFFIXES = ('.m', '.mat')
+
+
+def find_script(script, scripts_dir=None):
+    """Path of a script in SCRIPTS_DIR or its production directory, or None"""
+    if os.path.basename(script) != script or not script.endswith('.m'):
+        return None
+    scripts_dir = scripts_dir or settings.SCRIPTS_DIR
+    for directory in (scripts_dir, os.path.join(scripts_dir, 'production')):
+        path = os.path.join(directory, script)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+class CachedRun:
+    """Output of one run: (timestamp, {channel: array}) frames"""
+
+    def __init__(self, key, script, params, source, speed=1.0):
+        self.key = key
+        self.script = script
+        self.params = params
+        self.source = source  # Hash of the MATLAB sources the run was produced with
+        self.speed = speed  # Run speed the timestamps were taken at
+        self.frames = []
+        self.samples = 0
+        self.nbytes = 0
+
+    def add(self, received, frame):
+        columns = {}
+        for name, values in frame.items():
+            try:
+                column = np.asarray(values, dtype=np.float64)
+            except (TypeError, ValueError):
+                return False  # Non-numeric output cannot be cached
+            columns[name] = column
+            self.nbytes += column.nbytes
+        self.frames.append((received, columns))
+        self.samples += len(frame['t'])
+        return True
+
+    def iter_frames(self):
+        for received, columns in self.frames:
+            yield received, SampleFrame({name: column.tolist() for name, column in columns.items()})
+
+
+class RunCapture:
+    """Collects the frames of a live run that may be stored in the cache.
+
+    A run too large for the memory tier is still counted, so it can be
+    cached through its recording in the disk tier.
+    """
+
+    def __init__(self, run, max_bytes):
+        self.run = run
+        self.max_bytes = max_bytes
+        self.in_memory = True
+        self.valid = True
+
+    def add(self, frame):
+        if not self.valid:
+            return
+        if not self.in_memory:
+            self.run.samples += len(frame['t'])
+        elif not self.run.add(time.time(), frame):
+            self.invalidate()
+        elif self.run.nbytes > self.max_bytes:
+            self.in_memory = False
+            self.run.frames.clear()
+            self.run.nbytes = 0
+
+    def invalidate(self):
+        """The run no longer matches its key, e.g. after a parameter update"""
+        self.valid = False
+        self.run.frames.clear()
+
+
+class ResultCache:
+    """LRU cache of run output, with an optional on-disk index of recordings"""
+
+    def __init__(self, scripts_dir=None, max_bytes=None, cache_dir=None, scripts=None):
+        self.scripts_dir = scripts_dir or settings.SCRIPTS_DIR
+        self.max_bytes = int(settings.CACHE_MEMORY_MB * 1024 * 1024) if max_bytes is None else max_bytes
+        self.cache_dir = settings.CACHE_DIR if cache_dir is None else cache_dir
+        self.scripts = settings.CACHE_SCRIPTS if scripts is None else scripts
+        self.entries = OrderedDict()  # Key -> CachedRun, least recently used first
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._file_hashes = {}  # Path -> ((mtime_ns, size), sha256)
+        self._sources = {}  # Script -> latest source hash
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _file_hash(self, path):
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        cached = self._file_hashes.get(path)
+        if cached and cached[0] == version:
+            return cached[1]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        self._file_hashes[path] = (version, digest.hexdigest())
+        return digest.hexdigest()
+
+    def source_hash(self, script):
+        """Hash of the script and the MATLAB sources it may call, or None if the script is not found.
+
+        Every .m/.mat file in the script's directory is included, since
+        models such as FMPmodel.m run helper scripts and load data from there.
+        """
+        path = find_script(script, self.scripts_dir)
+        if path is None:
+            return None
+        directory = os.path.dirname(path)
+        digest = hashlib.sha256()
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(SOURCE_SUFFIXES):
+                digest.update(name.encode())
+                digest.update(self._file_hash(os.path.join(directory, name)).encode())
+        return digest.hexdigest()
+
+    def key(self, script, params):
+        """Cache key of a run, or None if the script's runs are not cacheable"""
+        if script not in self.scripts:
+            return None
+        try:
+            source = self.source_hash(script)
+        except OSError as e:
+            log.warning("Cannot hash sources of %s: %s", script, e)
+            return None
+        if source is None:
+            return None
+        if self._sources.setdefault(script, source) != source:
+            self._sources[script] = source
+            self._purge(script, source)
+        canonical = json.dumps([script, source, params], sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def get(self, key):
+        """Return the cached run for a key, or None"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        elif self.cache_dir:
+            entry = self._load(key)
+            if entry is not None:
+                self._insert(entry)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def capture(self, key, script, params, speed=1.0):
+        return RunCapture(CachedRun(key, script, params, self._sources.get(script), speed), self.max_bytes)
+
+    def store(self, capture, recording_id=None):
+        """Keep a completed run, in memory and/or through its recording in the disk index"""
+        run = capture.run
+        if not (capture.valid and run.samples):
+            return
+        stored = capture.in_memory and self._insert(run)
+        if self.cache_dir and recording_id:
+            stored = self._write_index(run, recording_id) or stored
+        if stored:
+            log.info("Cached %s samples of %s with params %s", run.samples, run.script, run.params)
+
+    def _insert(self, entry):
+        """Add an entry, evicting the least recently used ones; False if it does not fit at all"""
+        if entry.nbytes > self.max_bytes:
+            return False
+        old = self.entries.pop(entry.key, None)
+        if old is not None:
+            self.nbytes -= old.nbytes
+        self.entries[entry.key] = entry
+        self.nbytes += entry.nbytes
+        while self.nbytes > self.max_bytes and self.entries:
+            _, evicted = self.entries.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+        return True
+
+    def _purge(self, script, source):
+        """Drop results of a script produced from sources that have since changed"""
+        for key, entry in list(self.entries.items()):
+            if entry.script == script and entry.source != source:
+                del self.entries[key]
+                self.nbytes -= entry.nbytes
+        if self.cache_dir:
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    with open(path) as f:
+                        index = json.load(f)
+                    if index.get('script') == script and index.get('source') != source:
+                        os.remove(path)
+                except (OSError, ValueError):
+                    continue
+        log.info("Sources of %s changed, cached results dropped", script)
+
+    def _index_path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.json')
+
+    def _write_index(self, run, recording_id):
+        """Point the run's key at its recording; False if the index could not be written"""
+        path = self._index_path(run.key)
+        index = {'recording': recording_id, 'script': run.script, 'params': run.params,
+                 'source': run.source, 'speed': run.speed, 'samples': run.samples, 'complete': True}
+        try:
+            with open(f'{path}.tmp', 'w') as f:
+                json.dump(index, f)
+            os.replace(f'{path}.tmp', path)
+        except OSError as e:
+            log.warning("Could not write cache index %s: %s", path, e)
+            return False
+        return True
+
+    def _load(self, key):
+        """Rebuild a cached run from the recording the disk index points at"""
+        try:
+            with open(self._index_path(key)) as f:
+                index = json.load(f)
+            if not index.get('complete'):
+                return None  # Only a completed run is the script's whole output
+            _, channels = recording.open_channels(index['recording'])
+        except (OSError, ValueError, KeyError):
+            return None
+        entry = CachedRun(key, index['script'], index['params'], index.get('source'), index.get('speed', 1.0))
+        for received, frame in recording.iter_frames(channels):
+            entry.add(received, frame)
+        return entry if entry.samples else None
+
+    def describe(self):
+        return {'entries': len(self.entries), 'bytes': self.nbytes, 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,576 @@
+"""Simulation sessions and the pool of MATLAB workers they run on"""
+import asyncio
+import heapq
+import itertools
+import logging
+from collections import deque
+
+import metrics
+import recording
+import settings
+from batching import SampleBatcher, add_message
+from derived import DerivedStage
+from engines import LocalEngine, create_local_engine, runs_locally
+from hub import Channel
+from matlab_client import MatlabClient
+from plotting import x_axis
+from timeseries import TimeSeriesStore
+
+log = logging.getLogger(__name__)
+
+_session_ids = itertools.count(1)
+
+# Worker pool priorities, lowest served first
+INTERACTIVE = 0
+BATCH = 1
+
+
+class MatlabWorker:
+    """One MATLAB service endpoint; runs at most one session at a time.
+
+    The worker keeps one long-lived connection to its service, reused by
+    every session it runs.
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.session = None
+        self.priority = None
+        self.preempted = False  # The batch run holding the worker has been asked to give it up
+        self.assigned = 0.0  # Loop time the current session got the worker
+        self.client = None
+        self.healthy = None  # Result of the last health check
+        self._lock = asyncio.Lock()  # Serializes connecting and health checks
+
+    @property
+    def name(self):
+        return f"{self.host}:{self.port}"
+
+    @property
+    def connected(self):
+        return self.client is not None and self.client.connected
+
+    async def connect(self):
+        """Open the connection unless it is already up"""
+        async with self._lock:
+            await self._connect()
+
+    async def _connect(self):
+        if self.connected:
+            return
+        await self.disconnect()
+        client = MatlabClient(self.host, self.port)
+        await client.connect()
+        self.client = client
+
+    async def disconnect(self):
+        client, self.client = self.client, None
+        if client is not None:
+            await client.close()
+
+    async def check(self):
+        """Health check: reconnect if needed and ping the service"""
+        async with self._lock:
+            try:
+                await self._connect()
+                await self.client.request({'type': 'ping'}, settings.MATLAB_HEALTH_TIMEOUT)
+                healthy = True
+            except (OSError, asyncio.TimeoutError) as e:
+                if self.healthy is not False:
+                    log.warning("MATLAB worker %s failed health check: %r", self.name, e)
+                await self.disconnect()
+                healthy = False
+        if healthy and self.healthy is False:
+            log.info("MATLAB worker %s is available again", self.name)
+        self.healthy = healthy
+        return healthy
+
+    async def reset(self):
+        """End the session on the service and drop anything it still sent, ready for the next session"""
+        if not self.connected:
+            return
+        try:
+            await self.client.request({'type': 'reset'})
+            self.client.discard_received()
+        except (OSError, asyncio.TimeoutError) as e:
+            log.warning("MATLAB worker %s failed to reset: %r", self.name, e)
+            await self.disconnect()
+
+
+class WorkerPool:
+    """Assigns sessions to idle MATLAB workers, queueing them when all are busy.
+
+    Interactive sessions are served before batch job runs, and first come,
+    first served among themselves. An interactive session that finds every
+    worker busy preempts a batch run, which is requeued by its job.
+    Connections are opened when the pool starts and health-checked while
+    workers are idle, so a session starts on a connection that is already up.
+    """
+
+    def __init__(self, endpoints=None):
+        endpoints = settings.MATLAB_WORKERS if endpoints is None else endpoints
+        self.workers = [MatlabWorker(host, port) for host, port in endpoints]
+        self._idle = deque(self.workers)
+        self._waiters = []  # Heap of (priority, arrival, future)
+        self._arrivals = itertools.count()
+        self.waiting = 0  # Interactive sessions waiting for a worker
+        self._health_task = None
+
+    @property
+    def idle(self):
+        return len(self._idle)
+
+    @property
+    def available(self):
+        """Workers that passed their last health check"""
+        return sum(1 for w in self.workers if w.healthy)
+
+    def start(self):
+        """Connect to every worker and keep checking the idle ones"""
+        self._health_task = asyncio.create_task(self._health_loop())
+
+    async def close(self):
+        if self._health_task:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+        await asyncio.gather(*(worker.disconnect() for worker in self.workers))
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.gather(*(w.check() for w in self.workers if w.session is None))
+            # Until a worker is up (e.g. MATLAB still starting), check every second so readiness follows quickly
+            interval = settings.MATLAB_HEALTH_INTERVAL
+            await asyncio.sleep(interval if self.available else min(interval, 1.0))
+
+    async def acquire(self, session, priority=INTERACTIVE):
+        """Wait for an idle worker, make sure it is connected and assign it to the session"""
+        if self._idle:
+            worker = self._idle.popleft()
+        else:
+            worker = await self._wait(priority)
+        worker.session = session
+        worker.priority = priority
+        worker.preempted = False
+        worker.assigned = asyncio.get_running_loop().time()
+        try:
+            await worker.connect()
+        except (OSError, asyncio.TimeoutError) as e:
+            worker.session = None
+            self._hand_over(worker)
+            raise ConnectionError(f"MATLAB worker {worker.name} unavailable: {e}") from e
+        log.info("%s assigned to MATLAB worker %s", session, worker.name)
+        return worker
+
+    async def _wait(self, priority):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._arrivals), future))
+        if priority == INTERACTIVE:
+            self.waiting += 1
+            self._preempt()
+        try:
+            return await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._hand_over(future.result())
+            raise
+        finally:
+            if priority == INTERACTIVE:
+                self.waiting -= 1
+
+    def _preempt(self):
+        """Stop a batch run for every interactive session left waiting"""
+        preempting = sum(1 for w in self.workers if w.session is not None and w.preempted)
+        if preempting >= self.waiting:
+            return
+        batch = [w for w in self.workers if w.session is not None and w.priority == BATCH and not w.preempted]
+        if batch:
+            # The run that started last has the least work to lose
+            worker = max(batch, key=lambda w: w.assigned)
+            worker.preempted = True
+            log.info("Preempting %s on MATLAB worker %s for an interactive session", worker.session, worker.name)
+            worker.session.preempt()
+
+    def _hand_over(self, worker):
+        """Give a free worker to the first waiter still waiting, or make it idle"""
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(worker)
+                return
+        self._idle.append(worker)
+
+    async def release(self, worker):
+        """Reset the worker's service and return the worker to the pool"""
+        log.info("MATLAB worker %s released by %s", worker.name, worker.session)
+        try:
+            await worker.reset()
+        finally:
+            worker.session = None
+            worker.preempted = False
+            self._hand_over(worker)
+
+
+class Session:
+    """One simulation run requested by a WebSocket client.
+
+    Holds the run state that used to live in module globals, so every
+    client can drive its own script on its own MATLAB worker. Output is
+    published on the session's channel, which any number of clients can
+    watch.
+    """
+
+    def __init__(self, pool, renderer=None, cache=None):
+        self.id = next(_session_ids)
+        self.pool = pool
+        self.renderer = renderer
+        self.cache = cache
+        self.channel = Channel()
+        self.history = TimeSeriesStore()
+        self.batcher = SampleBatcher(self._publish_frame)
+        self.derived = DerivedStage() if settings.DERIVED_ENABLED else None
+        self.script = None
+        self.params = None
+        self.speed = 1.0  # 1 runs in real time, N N times faster, 0 unthrottled
+        self.repeat = True  # False runs a MATLAB script once, until it reports completed
+        self.worker = None
+        self.client = None
+        self.task = None
+        self.recorder = None
+        self.capture = None  # Output of the run, collected for the result cache
+        self.completed = False
+        self.streaming = False  # Output comes from a recording or the result cache, not a script
+        self.is_running = False
+        self.should_stop = False  # Drop samples still in flight after a stop request
+
+    def __str__(self):
+        return f"Session {self.id}"
+
+    def publish(self, message):
+        """Send a message to every client watching this session.
+
+        Samples batched so far go out first, so clients see them in order.
+        """
+        self.batcher.flush()
+        self.channel.publish(message)
+
+    def _publish_frame(self, frame):
+        """Add derived channels to a batched frame, store it in the run's history and recording and send it to clients"""
+        if self.derived and not self.streaming:
+            # Recorded and cached output already carries its derived channels
+            self.derived.process(frame)
+        self.history.append_frame(frame)
+        metrics.SAMPLES_OUT.inc(len(frame['t']))
+        if self.capture:
+            self.capture.add(frame)
+        if self.renderer:
+            self.renderer.feed(self.id, frame)
+        if self.recorder:
+            try:
+                self.recorder.append_frame(frame)
+            except OSError as e:
+                log.warning("Recording of session %s stopped: %s", self.id, e)
+                self._close_recorder()
+        self.channel.publish(frame)
+
+    def _begin_output(self):
+        """Reset batching, derived channels and history and open a plot for a new run"""
+        self.batcher.reset()
+        if self.derived:
+            self.derived.reset()
+        self.history.clear()
+        if self.renderer:
+            self.renderer.start_run(self.id, f"Session {self.id}: {self.script}", *x_axis(self.script, self.params))
+
+    def _end_output(self):
+        self.batcher.flush()
+        if self.renderer:
+            self.renderer.end_run(self.id)
+
+    def _open_recorder(self):
+        if not settings.RECORDING_ENABLED:
+            return
+        try:
+            self.recorder = recording.RunRecorder(f's{self.id}', self.script, self.params, self.speed)
+        except OSError as e:
+            log.warning("Could not start recording for session %s: %s", self.id, e)
+
+    def _close_recorder(self):
+        recorder, self.recorder = self.recorder, None
+        if recorder:
+            try:
+                recorder.close()
+            except OSError as e:
+                log.error("Error closing recording %s: %s", recorder.id, e)
+
+    def describe(self):
+        """Summary of the session for listings and attach acknowledgments"""
+        return {
+            'session': self.id,
+            'script': self.script,
+            'params': self.params,
+            'speed': self.speed,
+            'repeat': self.repeat,
+            'running': self.is_running,
+            'worker': self.worker.name if self.worker else None,
+            'engine': ('local' if isinstance(self.client, LocalEngine) else 'matlab') if self.client else None,
+            'recording': self.recorder.id if self.recorder else None,
+            'subscribers': len(self.channel.subscribers),
+            'channels': {name: series.total for name, series in self.history.channels.items()},
+        }
+
+    async def start(self, script, params, use_cache=True, speed=1.0, repeat=True):
+        """Stop any run of this session and start a new one.
+
+        ``speed`` 1 runs the script in real time, N runs it N times faster
+        and 0 as fast as MATLAB computes it. ``repeat`` False runs a MATLAB
+        script once instead of cycling until stopped. Such a single run of a
+        deterministic script is cached once it completes, and later streamed
+        from the result cache instead of running MATLAB again, at the
+        requested speed. Unthrottled runs are not cached, since their output
+        has no real-time pace to stream it at.
+        """
+        if speed < 0:
+            raise ValueError("speed must not be negative")
+        if self.task:
+            log.info("Stopping existing run of session %s", self.id)
+            await self.stop()
+        self.script = script
+        self.params = params
+        self.speed = speed
+        self.repeat = repeat
+        self.is_running = True
+        self.should_stop = False
+        self.completed = False
+        self._begin_output()
+        # Only a single run has an end, so only a single run can be cached
+        key = self.cache.key(script, params) if self.cache and not (repeat or runs_locally(script)) else None
+        cached = self.cache.get(key) if key and use_cache else None
+        if cached:
+            log.info("Session %s streaming cached output of %s with params %s", self.id, script, params)
+            self.streaming = True
+            self.task = asyncio.create_task(self._stream_cached(cached))
+            return
+        self.capture = self.cache.capture(key, script, params, speed) if key and speed > 0 else None
+        log.info("Session %s starting script %s with params %s", self.id, script, params)
+        self.task = asyncio.create_task(self._run())
+
+    async def replay(self, recording_id, speed=1.0):
+        """Stop any run of this session and stream a recording instead of running MATLAB"""
+        meta = recording.load_meta(recording_id)
+        if self.task:
+            await self.stop()
+        self.script = meta['script']
+        self.params = meta['params']
+        self.speed = speed
+        self.is_running = True
+        self.should_stop = False
+        self.streaming = True
+        self._begin_output()
+        log.info("Session %s replaying %s at speed %s", self.id, recording_id, speed)
+        self.task = asyncio.create_task(self._replay(recording_id, speed))
+
+    async def _replay(self, recording_id, speed):
+        try:
+            self.publish({'status': 'started', 'session': self.id, 'replay': recording_id})
+            await recording.replay(recording_id, self._publish_frame, speed)
+            self.publish({'status': 'completed', 'session': self.id, 'replay': recording_id})
+        except asyncio.CancelledError:
+            log.info("Replay of session %s cancelled", self.id)
+            raise
+        except Exception as e:
+            log.error("Error replaying %s: %s", recording_id, e)
+            self.publish({'error': str(e), 'session': self.id})
+        finally:
+            self._end_output()
+            self.task = None
+            self.streaming = False
+            self.is_running = False
+
+    async def _stream_cached(self, cached):
+        try:
+            self.publish({'status': 'started', 'session': self.id, 'cached': True})
+            await recording.replay_frames(cached.iter_frames(), self._publish_frame, self.speed, cached.speed)
+            self.publish({'status': 'completed', 'session': self.id, 'cached': True})
+        except asyncio.CancelledError:
+            log.info("Cached run of session %s cancelled", self.id)
+            raise
+        except Exception as e:
+            log.error("Error streaming cached output of %s: %s", self.script, e)
+            self.publish({'error': str(e), 'session': self.id})
+        finally:
+            self._end_output()
+            self.task = None
+            self.streaming = False
+            self.is_running = False
+
+    async def update(self, params):
+        """Send new parameters to the running script.
+
+        MATLAB acknowledges the update when it arrives (``updated``); the
+        script applies it at its next cycle boundary, keeping its state and
+        time base, and confirms it with an ``applied`` status (see _forward).
+        """
+        if self.task and self.streaming:
+            self.publish({'error': 'Cannot update a cached or replayed run', 'session': self.id})
+            return
+        if self.capture:
+            # The output no longer belongs to the parameters the run was started with
+            self.capture.invalidate()
+        if self.task and self.client is None:
+            # Still queued for a worker; start with the new parameters instead
+            self.params = params
+            self.publish({'status': 'updated', 'session': self.id, 'params': params})
+            return
+        if not (self.client and self.is_running):
+            log.warning("No active MATLAB session %s to update", self.id)
+            self.publish({'error': 'No active session to update', 'session': self.id})
+            return
+        try:
+            update_command = {
+                'type': 'update',
+                'params': params
+            }
+            log.debug("Sending update command to MATLAB: %s", update_command)
+            ack = await self.client.request(update_command)
+            if ack.get('error'):
+                log.warning("MATLAB error: %s", ack['error'])
+                self.publish({'error': ack['error'], 'session': self.id})
+            else:
+                log.debug("MATLAB acknowledged update command")
+                self.publish({'status': 'updated', 'session': self.id, 'params': params})
+        except asyncio.TimeoutError:
+            log.warning("Timeout waiting for MATLAB update acknowledgment")
+            self.publish({'error': 'Timeout waiting for MATLAB response', 'session': self.id})
+        except Exception as e:
+            log.error("Error in update task: %s", e)
+            self.publish({'error': str(e), 'session': self.id})
+
+    async def stop(self):
+        """Ask MATLAB to stop the run, wait for its acknowledgment and end the run task"""
+        task = self.task
+        if task is None or task.done():
+            return
+        self.should_stop = True
+        try:
+            if self.client:
+                log.debug("Sending stop command to MATLAB")
+                ack = await self.client.request({"type": "stop"})
+                log.debug("MATLAB acknowledged stop command: %s", ack)
+        except asyncio.TimeoutError:
+            log.warning("Timeout waiting for MATLAB stop acknowledgment")
+        except Exception as e:
+            log.error("Error sending stop command: %s", e)
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def close(self):
+        """Tear the session down when its owning WebSocket goes away"""
+        if self.task and not self.task.done():
+            log.info("Cancelling MATLAB run of session %s", self.id)
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    async def _run(self):
+        """Acquire a worker (or a local engine), start the script and forward its data"""
+        client = None
+        try:
+            client = create_local_engine(self.script)
+            if client is None:
+                if self.pool.idle == 0:
+                    log.info("All MATLAB workers busy, session %s queued", self.id)
+                    self.publish({'status': 'queued', 'session': self.id, 'position': self.pool.waiting + 1})
+                self.worker = await self.pool.acquire(self)
+                client = self.worker.client
+            else:
+                await client.connect()
+
+            # Send started status to frontend
+            self.publish({'status': 'started', 'session': self.id})
+
+            self.client = client
+
+            log.debug("Sending start command to MATLAB: %s %s at speed %s", self.script, self.params, self.speed)
+            ack = await client.start(self.script, self.params, self.speed, self.repeat)
+            if 'error' in ack:
+                raise Exception(f"MATLAB error: {ack['error']}")
+            log.debug("MATLAB acknowledged start command")
+            self._open_recorder()
+
+            # Process data; acknowledgments are routed to their commands by the client,
+            # which also grants MATLAB a send credit for every message received
+            while True:
+                data = await client.receive()
+                if self.should_stop:
+                    continue
+                if self._forward(data):
+                    break
+
+        except asyncio.CancelledError:
+            log.info("MATLAB communication of session %s cancelled", self.id)
+            raise
+        except asyncio.TimeoutError:
+            log.warning("Timeout waiting for MATLAB start acknowledgment")
+            self.publish({'error': 'Timeout waiting for MATLAB response', 'session': self.id})
+        except ConnectionError as e:
+            log.warning("MATLAB connection lost: %s", e)
+            self.publish({'error': str(e), 'session': self.id})
+        except Exception as e:
+            log.error("Error in session %s: %s", self.id, str(e))
+            self.publish({'error': str(e), 'session': self.id})
+        finally:
+            self._end_output()
+            if self.capture and self.completed:
+                self.cache.store(self.capture, self.recorder.id if self.recorder else None)
+            self.capture = None
+            self._close_recorder()
+            if self.worker:
+                # The connection stays open for the worker's next session
+                await self.pool.release(self.worker)
+            elif client:
+                await client.close()
+            self.client = None
+            self.worker = None
+            self.task = None
+            self.is_running = False
+            self.should_stop = False
+
+    def _forward(self, data):
+        """Publish one decoded MATLAB message to the session's clients.
+
+        Statuses and errors are tagged with the session, like the ones the
+        controller publishes itself. Returns True when the message ends the
+        run (stopped, completed or error).
+        """
+        if isinstance(data, dict) and 'error' in data:
+            log.warning("MATLAB error: %s", data['error'])
+            self.publish({'error': data['error'], 'session': self.id})
+            return True
+        elif isinstance(data, dict) and 'status' in data:
+            log.debug("MATLAB status: %s", data['status'])
+            if data['status'] == 'applied':
+                self._applied(data)
+                return False
+            self.publish(dict(data, session=self.id))
+            if data['status'] == 'stopped':
+                log.debug("Received stopped status from MATLAB")
+                return True
+            elif data['status'] == 'completed':
+                log.debug("Received completed status from MATLAB")
+                self.completed = True
+                return True
+        else:
+            add_message(self.batcher, data)
+        return False
+
+    def _applied(self, data):
+        """Confirm an update the script applied, with the cycle and sample index it took effect at"""
+        self.params = data.get('params')
+        # Not ``t``: that key marks sample frames
+        update = {'params': self.params, 'cycle': data.get('cycle'), 'sample': self.batcher.sample_index}
+        log.info("Session %s applied params %s from cycle %s (sample %s)",
+                 self.id, self.params, update['cycle'], update['sample'])
+        if self.recorder:
+            self.recorder.add_update(update)
+        self.publish(dict(update, status='applied', session=self.id))
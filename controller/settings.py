@@ -0,0 +1,134 @@
+"""Controller settings, overridable through environment variables"""
+import json
+import os
+
+# MATLAB service (scripts/startup.m) endpoint
+MATLAB_HOST = os.environ.get('MATLAB_HOST', 'matlab_service')
+MATLAB_PORT = int(os.environ.get('MATLAB_PORT', '12345'))
+
+# Timeouts in seconds
+MATLAB_CONNECT_TIMEOUT = float(os.environ.get('MATLAB_CONNECT_TIMEOUT', '5.0'))
+MATLAB_ACK_TIMEOUT = float(os.environ.get('MATLAB_ACK_TIMEOUT', '5.0'))
+
+
+def _parse_endpoints(value):
+    """Parse "host:port,host:port" into a list of (host, port) tuples"""
+    endpoints = []
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        host, _, port = item.rpartition(':')
+        endpoints.append((host, int(port)) if host else (item, MATLAB_PORT))
+    return endpoints
+
+
+def _load_config(path):
+    """Contents of config.json, or {} without one"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+# Port of the controller's HTTP/WebSocket server
+CONTROLLER_PORT = int(os.environ.get('CONTROLLER_PORT', '8765'))
+
+# Script and params of a start command that names neither, from config.json
+CONFIG_FILE = os.environ.get('CONFIG_FILE', '/app/config.json')
+_config = _load_config(CONFIG_FILE)
+DEFAULT_SCRIPT = _config.get('script_name', 'sinus.m')
+DEFAULT_PARAMS = _config.get('params', [5, 0.5, 0, 0.1, 2])  # [amplitude, frequency, start_time, time_step, end_time]
+
+# Lifecycle: /health/ready answers 200 once this many MATLAB workers passed their health check
+# (0 is ready without MATLAB, e.g. for local engines only), and on SIGTERM running sessions
+# are stopped and their clients sent the last messages for at most SHUTDOWN_TIMEOUT seconds
+READY_MIN_WORKERS = int(os.environ.get('READY_MIN_WORKERS', '1'))
+SHUTDOWN_TIMEOUT = float(os.environ.get('SHUTDOWN_TIMEOUT', '10.0'))
+
+# Pool of MATLAB services sessions are scheduled on; defaults to the single service above
+MATLAB_WORKERS = _parse_endpoints(os.environ.get('MATLAB_WORKERS', f'{MATLAB_HOST}:{MATLAB_PORT}'))
+
+# Flow control of MATLAB runs: data messages a script may send that the controller has not
+# consumed yet (the credit window of the start command); 0 turns flow control off
+MATLAB_SEND_CREDITS = int(os.environ.get('MATLAB_SEND_CREDITS', '256'))
+
+# Connections to the workers are kept open; idle ones are pinged (and reconnected) this often
+MATLAB_HEALTH_INTERVAL = float(os.environ.get('MATLAB_HEALTH_INTERVAL', '5.0'))
+MATLAB_HEALTH_TIMEOUT = float(os.environ.get('MATLAB_HEALTH_TIMEOUT', '2.0'))
+
+# Per-client outgoing queue: maximum queued data messages and overflow policy
+# ("drop-oldest" or "latest"); clients may override both on /ws?queue=..&overflow=..
+SUBSCRIBER_QUEUE_SIZE = int(os.environ.get('SUBSCRIBER_QUEUE_SIZE', '1000'))
+SUBSCRIBER_OVERFLOW = os.environ.get('SUBSCRIBER_OVERFLOW', 'drop-oldest')
+
+# Rate at which batched samples are sent to clients as columnar frames; 0 sends every message at once
+EMIT_RATE_HZ = float(os.environ.get('EMIT_RATE_HZ', '30'))
+
+# Samples kept per channel in a session's history, and sent to a client attaching to a running session
+HISTORY_CAPACITY = int(os.environ.get('HISTORY_CAPACITY', '100000'))
+ATTACH_BACKFILL = int(os.environ.get('ATTACH_BACKFILL', '1000'))
+
+# Every MATLAB run is recorded here for later review and replay
+RECORDING_ENABLED = os.environ.get('RECORDING_ENABLED', '1') not in ('0', 'false', 'no')
+RECORDINGS_DIR = os.environ.get('RECORDINGS_DIR', '/app/recordings')
+
+# Plot snapshots (output/realtime_plot.png and output/plots/session_<id>.png), rendered in a worker process
+PLOT_ENABLED = os.environ.get('PLOT_ENABLED', '1') not in ('0', 'false', 'no')
+PLOT_OUTPUT_DIR = os.environ.get('PLOT_OUTPUT_DIR', '/app/output')
+PLOT_INTERVAL = float(os.environ.get('PLOT_INTERVAL', '1.0'))  # Minimum seconds between snapshots
+PLOT_QUEUE_SIZE = int(os.environ.get('PLOT_QUEUE_SIZE', '1000'))
+
+# Scripts run by the built-in NumPy engines instead of a MATLAB worker; empty runs everything on MATLAB
+LOCAL_SCRIPTS = {s.strip() for s in os.environ.get(
+    'LOCAL_SCRIPTS', 'sinus.m,cosinus.m,parameterized_example.m').split(',') if s.strip()}
+
+# Cache of the output of deterministic scripts, keyed by script, MATLAB source hash and params.
+# Only completed single runs ("repeat": false) of scripts listed in CACHE_SCRIPTS that run on
+# MATLAB are cached; empty disables the cache.
+# CACHE_DIR, if set, keeps an index of cached runs on disk (their data stays in the recordings).
+SCRIPTS_DIR = os.environ.get('SCRIPTS_DIR', '/app/scripts')
+CACHE_SCRIPTS = {s.strip() for s in os.environ.get('CACHE_SCRIPTS', 'FMPmodel.m').split(',') if s.strip()}
+CACHE_MEMORY_MB = float(os.environ.get('CACHE_MEMORY_MB', '64'))
+CACHE_DIR = os.environ.get('CACHE_DIR', '')
+
+# Logging: level (DEBUG shows every message), format ("text" or "json") and
+# maximum repeats of one message per second before further ones are suppressed
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+LOG_RATE_LIMIT = int(os.environ.get('LOG_RATE_LIMIT', '10'))
+
+# Batch parameter sweeps (POST /jobs), run on the MATLAB workers whenever no interactive session needs them:
+# retries of a failed run, seconds before a retry, default seconds a run may take (0 is unlimited)
+# and the largest number of runs one sweep may expand to
+JOB_MAX_RETRIES = int(os.environ.get('JOB_MAX_RETRIES', '2'))
+JOB_RETRY_DELAY = float(os.environ.get('JOB_RETRY_DELAY', '5.0'))
+JOB_RUN_TIMEOUT = float(os.environ.get('JOB_RUN_TIMEOUT', '0'))
+JOB_MAX_RUNS = int(os.environ.get('JOB_MAX_RUNS', '10000'))
+# Speed of batch runs unless a sweep gives its own: 1 is real time, N is N times faster, 0 is unthrottled
+JOB_SPEED = float(os.environ.get('JOB_SPEED', '0'))
+
+# Derived channels (derived.py) added to every live frame: comma-separated source channels per kind,
+# the rate their samples are taken at (t counts samples; CTG traces are 4 Hz) and, in seconds,
+# the baseline and trend windows. Decelerations are DERIVED_DECEL_DEPTH below the heart-rate
+# baseline and contractions DERIVED_CONTRACTION_THRESHOLD above the toco baseline, each for at
+# least its duration.
+DERIVED_ENABLED = os.environ.get('DERIVED_ENABLED', '1') not in ('0', 'false', 'no')
+DERIVED_HR_CHANNELS = [s.strip() for s in os.environ.get(
+    'DERIVED_HR_CHANNELS', 'heart_rate,fhr').split(',') if s.strip()]
+DERIVED_TOCO_CHANNELS = [s.strip() for s in os.environ.get('DERIVED_TOCO_CHANNELS', 'toco').split(',') if s.strip()]
+DERIVED_TREND_CHANNELS = [s.strip() for s in os.environ.get(
+    'DERIVED_TREND_CHANNELS', 'oxygen_level,spo2').split(',') if s.strip()]
+DERIVED_SAMPLE_RATE = float(os.environ.get('DERIVED_SAMPLE_RATE', '4.0'))
+DERIVED_BASELINE_WINDOW = float(os.environ.get('DERIVED_BASELINE_WINDOW', '600'))
+DERIVED_TREND_WINDOW = float(os.environ.get('DERIVED_TREND_WINDOW', '60'))
+DERIVED_DECEL_DEPTH = float(os.environ.get('DERIVED_DECEL_DEPTH', '15'))
+DERIVED_DECEL_DURATION = float(os.environ.get('DERIVED_DECEL_DURATION', '15'))
+DERIVED_CONTRACTION_THRESHOLD = float(os.environ.get('DERIVED_CONTRACTION_THRESHOLD', '10'))
+DERIVED_CONTRACTION_DURATION = float(os.environ.get('DERIVED_CONTRACTION_DURATION', '30'))
+
+# Reference datasets (datasets.py, /datasets): .json and .mat files in DATASETS_SOURCE_DIR are
+# converted once to memory-mapped columnar files in DATASETS_DIR
+DATASETS_SOURCE_DIR = os.environ.get('DATASETS_SOURCE_DIR', os.path.join(SCRIPTS_DIR, 'production'))
+DATASETS_DIR = os.environ.get('DATASETS_DIR', '/app/datasets')
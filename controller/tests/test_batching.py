@@ -0,0 +1,73 @@
+import asyncio
+
+from batching import VALUE_CHANNEL, SampleBatcher, add_message
+
+
+def test_unbatched_samples_are_published_at_once():
+    frames = []
+    batcher = SampleBatcher(frames.append, rate=0)
+    batcher.add({'heart_rate': 70, 'oxygen_level': 97})
+    batcher.add({'heart_rate': 71, 'oxygen_level': 96})
+    assert frames == [
+        {'t': [0], 'heart_rate': [70], 'oxygen_level': [97]},
+        {'t': [1], 'heart_rate': [71], 'oxygen_level': [96]},
+    ]
+
+
+def test_samples_of_a_tick_form_one_columnar_frame():
+    frames = []
+
+    async def run():
+        batcher = SampleBatcher(frames.append, rate=100)
+        batcher.add({'heart_rate': 70})
+        batcher.add({'heart_rate': 71})
+        batcher.extend('heart_rate', [72, 73])
+        assert frames == []
+        await asyncio.sleep(0.05)
+
+    asyncio.run(run())
+    assert frames == [{'t': [0, 1, 2, 3], 'heart_rate': [70, 71, 72, 73]}]
+
+
+def test_different_channels_flush_the_frame():
+    frames = []
+
+    async def run():
+        batcher = SampleBatcher(frames.append, rate=10)
+        batcher.add({'heart_rate': 70})
+        batcher.add({'oxygen_level': 97})
+        batcher.flush()
+
+    asyncio.run(run())
+    assert frames == [{'t': [0], 'heart_rate': [70]}, {'t': [1], 'oxygen_level': [97]}]
+
+
+def test_reset_restarts_the_sample_index():
+    frames = []
+
+    async def run():
+        batcher = SampleBatcher(frames.append, rate=10)
+        batcher.extend('value', [1, 2, 3])
+        batcher.reset()
+        assert batcher.sample_index == 0
+        batcher.add({'value': 4})
+        batcher.flush()
+
+    asyncio.run(run())
+    assert frames == [{'t': [0], 'value': [4]}]
+
+
+def test_add_message_shapes():
+    frames = []
+    batcher = SampleBatcher(frames.append, rate=0)
+    add_message(batcher, {'name': 'spo2', 'value': 98})
+    add_message(batcher, {'heart_rate': 70})
+    add_message(batcher, [0.5, 0.25])
+    add_message(batcher, 1.5)
+    add_message(batcher, [])  # A script's empty result
+    assert frames == [
+        {'t': [0], 'spo2': [98]},
+        {'t': [1], 'heart_rate': [70]},
+        {'t': [2, 3], VALUE_CHANNEL: [0.5, 0.25]},
+        {'t': [4], VALUE_CHANNEL: [1.5]},
+    ]
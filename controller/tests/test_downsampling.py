@@ -0,0 +1,56 @@
+import numpy as np
+
+from downsampling import LiveDecimator, Viewport, downsample, lttb, minmax
+
+
+def test_minmax_keeps_the_extremes_of_every_bucket():
+    t = np.arange(100, dtype=float)
+    values = np.zeros(100)
+    values[[13, 57]] = 5.0
+    values[[42, 88]] = -3.0
+    t_out, v_out = minmax(t, values, 10)
+    assert len(t_out) <= 2 * 10 + 2
+    assert {13, 42, 57, 88} <= set(t_out.tolist())
+    assert t_out[0] == 0 and t_out[-1] == 99
+    assert np.all(np.diff(t_out) > 0)
+
+
+def test_minmax_leaves_short_series_alone():
+    t = np.arange(10.0)
+    t_out, _ = minmax(t, t, 5)
+    assert t_out is t
+
+
+def test_lttb_keeps_threshold_points_and_the_ends():
+    t = np.arange(1000, dtype=float)
+    values = np.sin(t / 50)
+    values[500] = 10.0
+    t_out, v_out = lttb(t, values, 50)
+    assert len(t_out) == 50
+    assert t_out[0] == 0 and t_out[-1] == 999
+    assert 500 in t_out.tolist()
+    assert np.all(np.diff(t_out) > 0)
+
+
+def test_downsample_picks_the_method():
+    t = np.arange(1000, dtype=float)
+    assert len(downsample(t, t, 20, 'lttb')[0]) == 20
+    assert len(downsample(t, t, 20)[0]) <= 42
+
+
+def test_live_decimator_bounds_samples_per_column():
+    decimator = LiveDecimator(10)
+    sent = []
+    for start in range(0, 100, 7):
+        t = list(range(start, min(start + 7, 100)))
+        for frame in decimator.process({'t': t, 'value': [float(i % 10) for i in t]}):
+            sent.extend(frame['t'])
+    for frame in decimator.flush():
+        sent.extend(frame['t'])
+    assert len(sent) <= 2 * 10
+    assert sent == sorted(sent)
+
+
+def test_viewport_resolution():
+    viewport = Viewport(100, span=1000)
+    assert viewport.resolution == 10
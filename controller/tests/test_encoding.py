@@ -0,0 +1,45 @@
+import json
+import math
+import struct
+
+import pytest
+
+from encoding import SampleFrame, decode_binary, encode_binary
+
+
+@pytest.mark.parametrize('dtype', ['float32', 'float64'])
+def test_binary_round_trip(dtype):
+    frame = SampleFrame(t=[0, 1, 2], heart_rate=[70.5, 71.25, 72.0], oxygen_level=[97, 96, 98])
+    decoded = decode_binary(encode_binary(frame, dtype))
+    assert list(decoded) == ['t', 'heart_rate', 'oxygen_level']
+    assert decoded == frame
+
+
+def test_float64_keeps_full_precision():
+    frame = SampleFrame(t=[0], value=[0.1])
+    assert decode_binary(encode_binary(frame, 'float64'))['value'] == [0.1]
+    assert decode_binary(encode_binary(frame, 'float32'))['value'] != [0.1]
+
+
+def test_arrays_start_on_an_8_byte_boundary():
+    payload = encode_binary(SampleFrame(t=[0, 1], value=[1.0, 2.0]), 'float64')
+    (header_length,) = struct.unpack_from('<I', payload)
+    assert (4 + header_length) % 8 == 0
+    header = json.loads(payload[4:4 + header_length])
+    assert header == {'channels': ['t', 'value'], 'length': 2, 'dtype': 'float64'}
+
+
+def test_null_is_sent_as_nan():
+    decoded = decode_binary(encode_binary(SampleFrame(t=[0, 1], value=[None, 2.0])))
+    assert math.isnan(decoded['value'][0]) and decoded['value'][1] == 2.0
+
+
+def test_non_numeric_frame_has_no_binary_encoding():
+    frame = SampleFrame(t=[0], label=['a'])
+    assert encode_binary(frame) is None
+    assert frame.encode_binary('float32') is None
+
+
+def test_frame_caches_its_encoding():
+    frame = SampleFrame(t=[0], value=[1.0])
+    assert frame.encode_binary('float32') is frame.encode_binary('float32')
@@ -0,0 +1,137 @@
+import asyncio
+
+import numpy as np  # type: ignore
+import pytest
+
+import settings
+from engines import CosinusEngine, ParameterizedExampleEngine, SinusEngine, create_local_engine
+
+
+def run_engine(engine_class, test):
+    async def main():
+        engine = engine_class(engine_class.__name__)
+        await engine.connect()
+        try:
+            await test(engine)
+        finally:
+            await engine.close()
+
+    asyncio.run(main())
+
+
+async def receive_all(engine, timeout=1.0):
+    """Messages up to and including completed"""
+    messages = []
+    while not messages or messages[-1] != {'status': 'completed'}:
+        messages.append(await engine.receive(timeout))
+    return messages
+
+
+def test_single_run_sends_its_result_then_completed():
+    async def test(engine):
+        assert await engine.start('cosinus.m', [2, 0, 0, 0.5, 1], speed=0, repeat=False) == {'status': 'started'}
+        assert await receive_all(engine) == [[2.0, 2.0, 2.0], {'status': 'completed'}]
+
+    run_engine(CosinusEngine, test)
+
+
+def test_one_point_result_is_sent_as_a_number():
+    async def test(engine):
+        await engine.start('cosinus.m', [3, 0, 0, 1, 0], speed=0, repeat=False)
+        assert await receive_all(engine) == [3.0, {'status': 'completed'}]
+
+    run_engine(CosinusEngine, test)
+
+
+def test_repeating_run_starts_again_until_stopped():
+    async def test(engine):
+        await engine.start('cosinus.m', [1, 0, 0, 1, 1], speed=0)
+        assert [await engine.receive(1.0) for _ in range(3)] == [[1.0, 1.0]] * 3
+        assert await engine.request({'type': 'stop'}) == {'status': 'stopped', 'reason': 'command'}
+        while not engine._messages.empty():
+            engine._messages.get_nowait()
+        with pytest.raises(asyncio.TimeoutError):
+            await engine.receive(0.05)
+
+    run_engine(CosinusEngine, test)
+
+
+def test_script_without_data_ends_with_an_empty_result():
+    async def test(engine):
+        engine.rng = np.random.default_rng(0)
+        await engine.start('parameterized_example.m', [75, 98, 3, 120, 80], speed=0, repeat=False)
+        messages = await receive_all(engine)
+        assert len(messages) == 5 and messages[-2:] == [[], {'status': 'completed'}]
+        assert all(40 <= m['heart_rate'] <= 200 and 0 <= m['oxygen_level'] <= 100 for m in messages[:3])
+
+    run_engine(ParameterizedExampleEngine, test)
+
+
+def test_update_is_applied_at_the_next_chunk():
+    async def test(engine):
+        await engine.start('sinus.m', [1, 0.25, 0, 1, 1000], speed=0)
+        first = await engine.receive(1.0)
+        assert max(abs(v) for v in first) <= 1
+        assert await engine.request({'type': 'update', 'params': [5, 0.25, 0, 1, 1000]}) == {'status': 'updated'}
+        message = await engine.receive(1.0)
+        while not (isinstance(message, dict) and message.get('status') == 'applied'):
+            message = await engine.receive(1.0)
+        assert message['params'] == [5.0, 0.25, 0.0, 1.0, 1000.0]
+        assert message['cycle'] > 1
+        after = await engine.receive(1.0)
+        assert max(abs(v) for v in after) > 1
+        assert engine.params == message['params']
+
+    run_engine(SinusEngine, test)
+
+
+def test_invalid_update_is_rejected():
+    async def test(engine):
+        await engine.start('sinus.m', [1, 1, 0, 0.1, 1], speed=0)
+        await engine.receive(1.0)
+        assert 'error' in await engine.request({'type': 'update', 'params': [1, 2]})
+        assert engine.params == [1.0, 1.0, 0.0, 0.1, 1.0]
+
+    run_engine(SinusEngine, test)
+
+
+def test_invalid_start_params_report_an_error():
+    async def test(engine):
+        await engine.start('sinus.m', ['x'], speed=0)
+        assert 'error' in await engine.receive(1.0)
+
+    run_engine(SinusEngine, test)
+
+
+def test_data_waits_for_send_credits(monkeypatch):
+    monkeypatch.setattr(settings, 'MATLAB_SEND_CREDITS', 2)
+
+    async def test(engine):
+        await engine.start('cosinus.m', [1, 0, 0, 1, 1], speed=0)
+        await asyncio.sleep(0.02)
+        assert engine._messages.qsize() == 2
+        await engine.receive(1.0)
+        await asyncio.sleep(0.02)
+        assert engine._messages.qsize() == 2
+
+    run_engine(CosinusEngine, test)
+
+
+def test_only_configured_scripts_run_locally(monkeypatch):
+    monkeypatch.setattr(settings, 'LOCAL_SCRIPTS', {'sinus.m', 'FMPmodel.m'})
+    assert isinstance(create_local_engine('sinus.m'), SinusEngine)
+    assert create_local_engine('cosinus.m') is None
+    assert create_local_engine('FMPmodel.m') is None
+
+
+@pytest.mark.parametrize('speed, seconds', [(1, 0.1), (10, 0.01), (0, 0)])
+def test_pace_follows_the_run_speed(speed, seconds):
+    async def main():
+        engine = SinusEngine('sinus.m')
+        engine.speed = speed
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await engine.pace(0.1)
+        return loop.time() - started
+
+    assert asyncio.run(main()) == pytest.approx(seconds, abs=0.03)
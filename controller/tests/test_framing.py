@@ -0,0 +1,81 @@
+from framing import FrameDecoder, encode_frame
+
+
+def test_encode_frame_is_one_terminated_line():
+    frame = encode_frame({'status': 'started', 'id': 1})
+    assert frame == b'{"status":"started","id":1}\n'
+
+
+def test_partial_frame_waits_for_the_rest():
+    decoder = FrameDecoder()
+    frame = encode_frame({'heart_rate': 72.5})
+    assert decoder.feed(frame[:5]) == []
+    assert decoder.pending == 5
+    assert decoder.feed(frame[5:-1]) == []
+    assert decoder.feed(frame[-1:]) == [{'heart_rate': 72.5}]
+    assert decoder.pending == 0
+
+
+def test_coalesced_frames_decode_in_order():
+    decoder = FrameDecoder()
+    messages = [[1, 2, 3], {'status': 'applied', 'cycle': 2}, 4.5]
+    data = b''.join(encode_frame(m) for m in messages)
+    assert decoder.feed(data) == messages
+    assert decoder.frames_decoded == 3
+
+
+def test_coalesced_frames_with_trailing_partial():
+    decoder = FrameDecoder()
+    data = encode_frame([1]) + encode_frame([2]) + encode_frame([3])[:2]
+    assert decoder.feed(data) == [[1], [2]]
+    assert decoder.feed(b']\n') == [[3]]
+
+
+def test_frames_split_at_every_byte():
+    decoder = FrameDecoder()
+    messages = [{'t': i, 'value': i * 0.5} for i in range(5)]
+    received = []
+    for byte in b''.join(encode_frame(m) for m in messages):
+        received.extend(decoder.feed(bytes([byte])))
+    assert received == messages
+
+
+def test_invalid_frame_is_skipped():
+    decoder = FrameDecoder()
+    assert decoder.feed(b'{not json\n' + encode_frame([1])) == [[1]]
+    assert decoder.decode_errors == 1
+
+
+def test_oversized_frame_is_discarded():
+    decoder = FrameDecoder(max_frame_size=16)
+    assert decoder.feed(b'[' + b'1,' * 20) == []
+    assert decoder.decode_errors == 1
+    assert decoder.pending == 0
+    assert decoder.feed(encode_frame([7])) == [[7]]
+
+
+def test_reset_drops_partial_frame():
+    decoder = FrameDecoder()
+    decoder.feed(b'{"a":')
+    decoder.reset()
+    assert decoder.feed(encode_frame({'b': 1})) == [{'b': 1}]
+
+
+def test_multibyte_character_split_across_reads():
+    decoder = FrameDecoder()
+    frame = encode_frame({'unit': '°C'}).replace(b'\\u00b0', '°'.encode())
+    split = frame.index(b'\xb0')
+    assert decoder.feed(frame[:split]) == []
+    assert decoder.feed(frame[split:]) == [{'unit': '°C'}]
+
+
+def test_blank_lines_and_carriage_returns_are_ignored():
+    decoder = FrameDecoder()
+    assert decoder.feed(b'\n  \n[1]\r\n{"a": 2} \n') == [[1], {'a': 2}]
+    assert decoder.decode_errors == 0
+
+
+def test_trailing_data_in_a_frame_is_an_error():
+    decoder = FrameDecoder()
+    assert decoder.feed(b'[1] [2]\n[3]\n') == [[3]]
+    assert decoder.decode_errors == 1
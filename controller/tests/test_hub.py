@@ -0,0 +1,153 @@
+import asyncio
+
+import pytest
+
+from encoding import SampleFrame, decode_binary
+from hub import Channel, Subscriber
+
+
+class FakeWebSocket:
+    """Records what a subscriber sends; holds every send while ``open`` is clear"""
+
+    def __init__(self):
+        self.sent = []
+        self.open = asyncio.Event()
+        self.open.set()
+
+    async def send_json(self, message):
+        await self.open.wait()
+        self.sent.append(message)
+
+    async def send_bytes(self, payload):
+        await self.open.wait()
+        self.sent.append(decode_binary(payload))
+
+
+def frame(t):
+    return SampleFrame(t=[t], value=[float(t)])
+
+
+def sent_summary(ws):
+    return [m['t'][0] if 't' in m else m.get('status', m.get('error')) for m in ws.sent]
+
+
+def run_with_subscriber(test, **options):
+    async def main():
+        ws = FakeWebSocket()
+        subscriber = Subscriber(ws, **options)
+        try:
+            await test(ws, subscriber)
+        finally:
+            await subscriber.close()
+
+    asyncio.run(main())
+
+
+def test_messages_are_sent_in_order():
+    async def test(ws, subscriber):
+        subscriber.offer(frame(0))
+        subscriber.offer({'status': 'started'})
+        subscriber.offer(frame(1))
+        await subscriber.drain()
+        assert sent_summary(ws) == [0, 'started', 1]
+
+    run_with_subscriber(test)
+
+
+def test_drop_oldest_keeps_the_newest_data_and_every_control_message():
+    async def test(ws, subscriber):
+        ws.open.clear()  # A slow client: nothing leaves the queue
+        subscriber.offer({'status': 'started'})
+        for t in range(3):
+            subscriber.offer(frame(t))
+        subscriber.offer({'status': 'updated'})
+        for t in range(3, 6):
+            subscriber.offer(frame(t))
+        assert subscriber.dropped == 3
+        assert subscriber.depth == 5
+        ws.open.set()
+        await subscriber.drain()
+        assert sent_summary(ws) == ['started', 'updated', 3, 4, 5]
+
+    run_with_subscriber(test, max_queue=3, overflow='drop-oldest')
+
+
+def test_drop_oldest_skips_control_messages_ahead_of_the_data():
+    async def test(ws, subscriber):
+        ws.open.clear()
+        subscriber.offer({'status': 'started'})
+        subscriber.offer(frame(0))
+        subscriber.offer({'error': 'warning'})
+        subscriber.offer(frame(1))
+        subscriber.offer(frame(2))
+        ws.open.set()
+        await subscriber.drain()
+        assert sent_summary(ws) == ['started', 'warning', 1, 2]
+        assert subscriber.dropped == 1
+
+    run_with_subscriber(test, max_queue=2, overflow='drop-oldest')
+
+
+def test_latest_sends_only_the_newest_data():
+    async def test(ws, subscriber):
+        ws.open.clear()
+        for t in range(3):
+            subscriber.offer(frame(t))
+        subscriber.offer({'status': 'updated'})
+        subscriber.offer(frame(3))
+        subscriber.offer(frame(4))
+        assert subscriber.dropped == 3
+        ws.open.set()
+        await subscriber.drain()
+        assert sent_summary(ws) == ['updated', 3, 4]
+
+    run_with_subscriber(test, max_queue=3, overflow='latest')
+
+
+def test_clear_keeps_control_messages():
+    async def test(ws, subscriber):
+        ws.open.clear()
+        subscriber.offer(frame(0))
+        subscriber.offer({'status': 'stopped'})
+        subscriber.offer(frame(1))
+        subscriber.clear()
+        ws.open.set()
+        await subscriber.drain()
+        assert sent_summary(ws) == ['stopped']
+
+    run_with_subscriber(test)
+
+
+def test_binary_encoding_falls_back_to_json():
+    async def test(ws, subscriber):
+        subscriber.offer(SampleFrame(t=[0, 1], value=[0.5, 1.5]))
+        subscriber.offer(SampleFrame(t=[2], label=['text']))
+        await subscriber.drain()
+        assert ws.sent == [{'t': [0.0, 1.0], 'value': [0.5, 1.5]}, {'t': [2], 'label': ['text']}]
+
+    run_with_subscriber(test, encoding='binary', dtype='float64')
+
+
+def test_channel_fans_out_to_every_subscriber():
+    async def main():
+        channel = Channel()
+        clients = [FakeWebSocket() for _ in range(3)]
+        subscribers = [Subscriber(ws) for ws in clients]
+        for subscriber in subscribers:
+            subscriber.move_to(channel)
+        subscribers[2].move_to(None)
+        channel.publish(frame(7))
+        for subscriber in subscribers:
+            await subscriber.drain()
+            await subscriber.close()
+        assert [sent_summary(ws) for ws in clients] == [[7], [7], []]
+
+    asyncio.run(main())
+
+
+def test_unknown_overflow_policy():
+    async def main():
+        with pytest.raises(ValueError):
+            Subscriber(FakeWebSocket(), overflow='block')
+
+    asyncio.run(main())
@@ -0,0 +1,154 @@
+import asyncio
+import time
+
+import pytest
+
+import settings
+from jobs import DONE, FAILED, PENDING, Job, JobScheduler, expand_sweep
+from matlab_standin import StandinServer
+from sessions import WorkerPool
+
+NAMES = ['amplitude', 'frequency', 'start_time', 'time_step', 'end_time']
+
+
+def test_base_params_make_one_run():
+    runs, seed = expand_sweep({'params': [1, 2, 3]}, None)
+    assert runs == [[1, 2, 3]]
+    assert isinstance(seed, int)
+
+
+def test_grid_by_name_and_position():
+    spec = {'params': [5, 0.5, 0, 0.1, 2], 'grid': {'amplitude': [1, 2], '1': [0.25, 0.5, 1]}}
+    runs, _ = expand_sweep(spec, NAMES)
+    assert len(runs) == 6
+    assert {(r[0], r[1]) for r in runs} == {(a, f) for a in (1, 2) for f in (0.25, 0.5, 1)}
+    assert all(r[2:] == [0, 0.1, 2] for r in runs)
+
+
+def test_random_draws_are_reproducible_from_the_seed():
+    spec = {'params': [5, 0.5, 0, 0.1, 2], 'grid': {'amplitude': [1, 2]},
+            'random': {'frequency': [0.1, 0.9]}, 'samples': 3, 'seed': 42}
+    runs, seed = expand_sweep(spec, NAMES)
+    assert seed == 42 and len(runs) == 6
+    assert all(0.1 <= r[1] <= 0.9 for r in runs)
+    assert expand_sweep(spec, NAMES)[0] == runs
+    again, _ = expand_sweep(dict(spec, seed=seed), NAMES)
+    assert again == runs
+
+
+def test_reported_seed_reproduces_the_sweep():
+    spec = {'params': [0, 0], 'random': {'0': [0, 1]}, 'samples': 4}
+    runs, seed = expand_sweep(spec)
+    assert expand_sweep(dict(spec, seed=seed))[0] == runs
+
+
+@pytest.mark.parametrize('spec, message', [
+    ({'params': 'x'}, 'params must be a list'),
+    ({'params': [1, True]}, 'params must be a list'),
+    ({'params': [1], 'grid': {'0': []}}, 'non-empty list'),
+    ({'params': [1], 'grid': {'unknown': [1]}}, 'Unknown parameter'),
+    ({'params': [1], 'grid': {'3': [1]}}, 'out of range'),
+    ({'params': [1], 'random': {'0': [1]}}, r'\[low, high\]'),
+    ({'params': [1], 'grid': {'0': [1]}, 'random': {'0': [0, 1]}}, 'more than once'),
+    ({'params': [1], 'random': {'0': [0, 1]}, 'samples': 0}, 'at least 1'),
+])
+def test_invalid_sweeps(spec, message):
+    with pytest.raises(ValueError, match=message):
+        expand_sweep(spec)
+
+
+def test_wrong_parameter_count():
+    with pytest.raises(ValueError, match='takes 5 parameters'):
+        expand_sweep({'script': 'sinus.m', 'params': [1, 2]}, NAMES)
+
+
+def test_sweep_size_is_limited(monkeypatch):
+    monkeypatch.setattr(settings, 'JOB_MAX_RUNS', 10)
+    with pytest.raises(ValueError, match='JOB_MAX_RUNS'):
+        expand_sweep({'params': [1, 2], 'grid': {'0': list(range(4)), '1': list(range(3))}})
+
+
+def test_eta_extrapolates_the_finished_runs():
+    job = Job('model.m', [[0]] * 4, seed=1)
+    job.started = time.time() - 10
+    job.runs[0].state = job.runs[1].state = DONE
+    progress = job.describe()
+    assert progress['progress'] == 0.5
+    assert progress['eta'] == pytest.approx(10, abs=0.5)
+    job.runs[2].state = job.runs[3].state = FAILED
+    job.finished = job.started + 12
+    assert job.describe()['eta'] is None and job.describe()['elapsed'] == pytest.approx(12)
+
+
+def test_eta_is_unknown_before_a_run_finishes():
+    job = Job('model.m', [[0]] * 2, seed=1)
+    job.started = time.time() - 10
+    assert job.describe()['eta'] is None
+
+
+def run_with_scheduler(test, tmp_path, monkeypatch, **options):
+    monkeypatch.setattr(settings, 'RECORDINGS_DIR', str(tmp_path))
+    monkeypatch.setattr(settings, 'JOB_RETRY_DELAY', 0.0)
+
+    async def main():
+        server = await StandinServer(0, **options).serve('127.0.0.1')
+        pool = WorkerPool([('127.0.0.1', server.sockets[0].getsockname()[1])])
+        scheduler = JobScheduler(pool)
+        scheduler.start()
+        try:
+            await test(pool, scheduler)
+        finally:
+            await scheduler.close()
+            await pool.close()
+            server.close()
+            await server.wait_closed()
+
+    asyncio.run(main())
+
+
+async def finished(job, timeout=5.0):
+    async def wait():
+        while not job.finished:
+            await asyncio.sleep(0.01)
+    await asyncio.wait_for(wait(), timeout)
+
+
+def test_runs_are_recorded_until_completed(tmp_path, monkeypatch):
+    async def test(pool, scheduler):
+        job = scheduler.submit({'script': 'model.m', 'params': [0], 'grid': {'0': [1, 2]}})
+        await finished(job)
+        assert [run.state for run in job.runs] == [DONE, DONE]
+        assert all(run.attempts == 1 and run.samples > 0 for run in job.runs)
+        assert all((tmp_path / run.recording / 'meta.json').exists() for run in job.runs)
+
+    run_with_scheduler(test, tmp_path, monkeypatch, run_length=5)
+
+
+def test_failed_runs_are_retried_then_given_up(tmp_path, monkeypatch):
+    async def test(pool, scheduler):
+        # At 10 messages per second the run cannot complete within its timeout
+        job = scheduler.submit({'script': 'model.m', 'params': [0], 'retries': 1, 'timeout': 0.05, 'speed': 1})
+        await finished(job)
+        run = job.runs[0]
+        assert run.state == FAILED and run.attempts == 2 and run.error == 'Timed out'
+        # Only the last attempt's partial output is kept
+        assert [path.name for path in tmp_path.iterdir()] == [run.recording]
+        assert pool.idle == 1
+
+    run_with_scheduler(test, tmp_path, monkeypatch, rate=10)
+
+
+def test_preempted_run_is_requeued_without_counting_an_attempt(tmp_path, monkeypatch):
+    async def test(pool, scheduler):
+        job = scheduler.submit({'script': 'model.m', 'params': [0], 'speed': 1})
+        run = job.runs[0]
+        while run.samples == 0:
+            await asyncio.sleep(0.01)
+        worker = await asyncio.wait_for(pool.acquire('interactive session'), 1.0)
+        assert run.state == PENDING and run.attempts == 0 and run.recording is None
+        await pool.release(worker)
+        while run.attempts == 0:
+            await asyncio.sleep(0.01)
+        assert run.state != FAILED
+
+    run_with_scheduler(test, tmp_path, monkeypatch, rate=50)
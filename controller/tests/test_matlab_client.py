@@ -0,0 +1,151 @@
+import asyncio
+
+import pytest
+
+from framing import FrameDecoder, encode_frame
+from matlab_client import MatlabClient
+
+
+class FakeMatlab:
+    """TCP server standing in for MATLAB; the test decides what it answers"""
+
+    def __init__(self):
+        self.commands = asyncio.Queue()
+        self.writer = None
+        self.connected = asyncio.Event()
+
+    async def _handle(self, reader, writer):
+        self.writer = writer
+        self.connected.set()
+        decoder = FrameDecoder()
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            for command in decoder.feed(data):
+                self.commands.put_nowait(command)
+
+    async def serve(self):
+        self.server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def command(self, timeout=2.0):
+        return await asyncio.wait_for(self.commands.get(), timeout)
+
+    async def send(self, *messages):
+        for message in messages:
+            self.writer.write(encode_frame(message))
+        await self.writer.drain()
+
+
+def run_with_client(test):
+    async def main():
+        matlab = FakeMatlab()
+        client = MatlabClient('127.0.0.1', await matlab.serve())
+        await client.connect()
+        await matlab.connected.wait()
+        try:
+            await test(matlab, client)
+        finally:
+            await client.close()
+            matlab.server.close()
+            await matlab.server.wait_closed()
+
+    asyncio.run(main())
+
+
+def test_acknowledgments_resolve_their_own_request():
+    async def test(matlab, client):
+        stop = asyncio.create_task(client.request({'type': 'stop'}))
+        ping = asyncio.create_task(client.request({'type': 'ping'}))
+        commands = {c['type']: c for c in [await matlab.command(), await matlab.command()]}
+        # Acknowledge out of order, with a data message in between
+        await matlab.send({'status': 'pong', 'id': commands['ping']['id']},
+                          {'t': 0.0, 'value': 1.0},
+                          {'status': 'stopped', 'id': commands['stop']['id']})
+        assert (await ping)['status'] == 'pong'
+        assert (await stop)['status'] == 'stopped'
+        assert await client.receive(1.0) == {'t': 0.0, 'value': 1.0}
+
+    run_with_client(test)
+
+
+def test_messages_with_unknown_ids_are_received_as_data():
+    async def test(matlab, client):
+        await matlab.send({'error': 'late', 'id': 99})
+        assert await client.receive(1.0) == {'error': 'late', 'id': 99}
+
+    run_with_client(test)
+
+
+def test_request_times_out_without_acknowledgment():
+    async def test(matlab, client):
+        with pytest.raises(asyncio.TimeoutError):
+            await client.request({'type': 'ping'}, timeout=0.05)
+        command = await matlab.command()
+        # A late acknowledgment no longer has a waiting request
+        await matlab.send({'status': 'pong', 'id': command['id']})
+        assert await client.receive(1.0) == {'status': 'pong', 'id': command['id']}
+
+    run_with_client(test)
+
+
+def test_closed_connection_fails_requests_and_receives():
+    async def test(matlab, client):
+        request = asyncio.create_task(client.request({'type': 'stop'}))
+        await matlab.command()
+        matlab.writer.close()
+        with pytest.raises(ConnectionError):
+            await request
+        for _ in range(2):
+            with pytest.raises(ConnectionError):
+                await client.receive(1.0)
+        assert not client.connected
+
+    run_with_client(test)
+
+
+def start_and_acknowledge(matlab, client):
+    async def start():
+        run = asyncio.create_task(client.start('cosinus.m', {}, speed=0))
+        command = await matlab.command()
+        await matlab.send({'status': 'started', 'id': command['id']})
+        await run
+        return command
+    return start()
+
+
+def test_consumed_messages_are_granted_back_as_credits(monkeypatch):
+    monkeypatch.setattr('settings.MATLAB_SEND_CREDITS', 8)
+
+    async def test(matlab, client):
+        command = await start_and_acknowledge(matlab, client)
+        assert command['credits'] == 8
+        await matlab.send(*[{'t': float(t), 'value': 0.0} for t in range(5)])
+        # A quarter of the window is granted back at a time
+        await client.receive(1.0)
+        assert matlab.commands.empty()
+        await client.receive(1.0)
+        assert await matlab.command() == {'type': 'credit', 'credits': 2}
+        for _ in range(3):
+            await client.receive(1.0)
+        assert await matlab.command() == {'type': 'credit', 'credits': 2}
+        await asyncio.sleep(0.05)
+        assert matlab.commands.empty()
+
+    run_with_client(test)
+
+
+def test_runs_without_credits_are_not_flow_controlled(monkeypatch):
+    monkeypatch.setattr('settings.MATLAB_SEND_CREDITS', 0)
+
+    async def test(matlab, client):
+        command = await start_and_acknowledge(matlab, client)
+        assert 'credits' not in command
+        await matlab.send(*[{'t': float(t), 'value': 0.0} for t in range(4)])
+        for _ in range(4):
+            await client.receive(1.0)
+        await asyncio.sleep(0.05)
+        assert matlab.commands.empty()
+
+    run_with_client(test)
@@ -0,0 +1,149 @@
+import asyncio
+
+from framing import FrameDecoder, encode_frame
+from matlab_standin import StandinServer
+
+
+class Connection:
+    """Test side of a connection to the stand-in, speaking the controller's end of the protocol"""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.decoder = FrameDecoder()
+        self.received = []
+
+    async def send(self, command):
+        self.writer.write(encode_frame(command))
+        await self.writer.drain()
+
+    async def receive(self, timeout=2.0):
+        while not self.received:
+            data = await asyncio.wait_for(self.reader.read(65536), timeout)
+            assert data, "Stand-in closed the connection"
+            self.received.extend(self.decoder.feed(data))
+        return self.received.pop(0)
+
+    async def receive_until(self, predicate):
+        """Messages up to and including the first one matching predicate"""
+        messages = []
+        while True:
+            message = await self.receive()
+            messages.append(message)
+            if predicate(message):
+                return messages
+
+    async def idle(self, seconds=0.1):
+        """Messages arriving within the next seconds"""
+        messages = []
+        try:
+            while True:
+                messages.append(await self.receive(seconds))
+        except asyncio.TimeoutError:
+            return messages
+
+
+def run_with_standin(test, **options):
+    async def main():
+        server = await StandinServer(0, **options).serve('127.0.0.1')
+        port = server.sockets[0].getsockname()[1]
+        connection = Connection(*await asyncio.open_connection('127.0.0.1', port))
+        try:
+            await test(connection)
+        finally:
+            connection.writer.close()
+            server.close()
+            await server.wait_closed()
+
+    asyncio.run(main())
+
+
+def is_status(status):
+    return lambda message: isinstance(message, dict) and message.get('status') == status
+
+
+def test_acknowledgments_echo_the_command_id():
+    async def test(connection):
+        await connection.send({'type': 'stop', 'id': 7})
+        assert await connection.receive() == {'status': 'stopped', 'reason': 'command', 'id': 7}
+        await connection.send({'type': 'start', 'id': 8})
+        assert await connection.receive() == {'error': 'Start command missing script field', 'id': 8}
+
+    run_with_standin(test)
+
+
+def test_ping_is_answered_while_idle():
+    async def test(connection):
+        await connection.send({'type': 'ping', 'id': 3})
+        assert await connection.receive() == {'status': 'pong', 'id': 3}
+
+    run_with_standin(test)
+
+
+def test_reset_ends_the_run():
+    async def test(connection):
+        await connection.send({'type': 'start', 'id': 1, 'script': 'x.m', 'params': [1]})
+        await connection.receive()
+        await connection.send({'type': 'reset', 'id': 2})
+        messages = await connection.receive_until(is_status('reset'))
+        assert messages[-1] == {'status': 'reset', 'id': 2}
+        assert await connection.idle() == []
+
+    run_with_standin(test, shape='scalar', rate=50)
+
+
+def test_start_streams_data_until_stopped():
+    async def test(connection):
+        await connection.send({'type': 'start', 'id': 1, 'script': 'sinus.m', 'params': [2, 1, 0, 0.1, 1]})
+        assert await connection.receive() == {'status': 'started', 'id': 1}
+        data = [await connection.receive() for _ in range(3)]
+        assert all(isinstance(m, list) and len(m) == 4 for m in data)
+        assert max(abs(v) for m in data for v in m) <= 2
+        await connection.send({'type': 'stop', 'id': 2})
+        messages = await connection.receive_until(is_status('stopped'))
+        assert messages[-1] == {'status': 'stopped', 'reason': 'command', 'id': 2}
+        assert await connection.idle() == []
+
+    run_with_standin(test, shape='vector', chunk=4, rate=200)
+
+
+def test_update_is_applied_before_the_next_message():
+    async def test(connection):
+        await connection.send({'type': 'start', 'id': 1, 'script': 'x.m', 'params': [1], 'credits': 2})
+        await connection.receive()
+        assert len(await connection.idle()) == 2  # The credit window is used up
+        await connection.send({'type': 'update', 'id': 2, 'params': [1000]})
+        assert await connection.receive() == {'status': 'updated', 'id': 2}
+        await connection.send({'type': 'credit', 'credits': 1})
+        applied = await connection.receive()
+        assert applied == {'status': 'applied', 'params': [1000], 'cycle': 3}
+        value = await connection.receive()
+        assert 1 < abs(value) <= 1000  # sin(0.03) times the new amplitude
+
+    run_with_standin(test, shape='scalar', rate=0)
+
+
+def test_credits_bound_the_messages_in_flight():
+    async def test(connection):
+        await connection.send({'type': 'start', 'id': 1, 'script': 'x.m', 'params': [1], 'speed': 0, 'credits': 5})
+        await connection.receive()
+        assert len(await connection.idle()) == 5
+        await connection.send({'type': 'credit', 'credits': 3})
+        assert len(await connection.idle()) == 3
+        # Commands are still answered while the script waits for a credit
+        await connection.send({'type': 'ping', 'id': 2})
+        assert await connection.receive() == {'status': 'pong', 'id': 2}
+
+    run_with_standin(test, shape='vitals')
+
+
+def test_single_run_completes():
+    async def test(connection):
+        await connection.send({'type': 'start', 'id': 1, 'script': 'x.m', 'params': [1], 'repeat': False})
+        await connection.receive()
+        messages = await connection.receive_until(is_status('completed'))
+        assert len(messages) == 5 + 2  # The data, the script's empty result and completed
+        assert messages[-2] == []
+        assert await connection.idle() == []
+
+    run_with_standin(test, shape='scalar', rate=0, run_length=5)
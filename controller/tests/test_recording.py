@@ -0,0 +1,41 @@
+import asyncio
+
+from recording import replay_frames
+
+
+def replay_times(frames, speed, recorded_speed):
+    """Seconds after the start at which each frame is published"""
+    async def main():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        times = []
+        await replay_frames(frames, lambda frame: times.append(loop.time() - started),
+                            speed, recorded_speed)
+        return times
+
+    return asyncio.run(main())
+
+
+FRAMES = [(100.0 + received, {'t': [received]}) for received in (0.0, 0.1, 0.2)]
+
+
+def test_replay_stretches_a_fast_run_back_to_real_time():
+    # Recorded at 10x: 0.2 s of recording covers 2 s of simulated time, replayed at 20x
+    times = replay_times(FRAMES, speed=20, recorded_speed=10)
+    assert abs(times[-1] - 0.1) < 0.05
+
+
+def test_replay_at_the_recorded_speed_keeps_the_recorded_pace():
+    times = replay_times(FRAMES, speed=10, recorded_speed=10)
+    assert abs(times[-1] - 0.2) < 0.05
+
+
+def test_unthrottled_recordings_replay_as_fast_as_possible():
+    times = replay_times(FRAMES, speed=1, recorded_speed=0)
+    assert times[-1] < 0.05
+
+
+def test_replay_publishes_every_frame_in_order():
+    published = []
+    asyncio.run(replay_frames(FRAMES, published.append, speed=0))
+    assert published == [frame for _, frame in FRAMES]
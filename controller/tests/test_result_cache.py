@@ -0,0 +1,127 @@
+import os
+
+import pytest
+
+import recording
+import settings
+from result_cache import ResultCache
+
+
+@pytest.fixture
+def scripts(tmp_path):
+    directory = tmp_path / 'scripts'
+    (directory / 'production').mkdir(parents=True)
+    (directory / 'production' / 'model.m').write_text('function model(a, server, should_stop)\n')
+    (directory / 'production' / 'helper.m').write_text('x = 1;\n')
+    (directory / 'other.m').write_text('function other(server, should_stop)\n')
+    return directory
+
+
+def make_cache(scripts, **options):
+    return ResultCache(str(scripts), scripts={'model.m'}, **options)
+
+
+def capture_run(cache, key, frames, params=(1,), speed=1.0):
+    capture = cache.capture(key, 'model.m', list(params), speed)
+    for frame in frames:
+        capture.add(frame)
+    return capture
+
+
+FRAMES = [{'t': [0.0, 0.1], 'hr': [120.0, 121.0]}, {'t': [0.2], 'hr': [122.0]}]
+
+
+def test_key_depends_on_params_and_sources(scripts):
+    cache = make_cache(scripts)
+    key = cache.key('model.m', [1])
+    assert key == cache.key('model.m', [1])
+    assert key != cache.key('model.m', [2])
+    (scripts / 'production' / 'helper.m').write_text('x = 2;\n')
+    assert cache.key('model.m', [1]) != key
+
+
+def test_only_configured_scripts_that_exist_are_cached(scripts):
+    cache = make_cache(scripts)
+    assert cache.key('other.m', []) is None
+    assert make_cache(scripts).key('missing.m', []) is None
+    assert ResultCache(str(scripts), scripts={'missing.m'}).key('missing.m', []) is None
+
+
+def test_stored_run_is_returned_by_key(scripts):
+    cache = make_cache(scripts)
+    key = cache.key('model.m', [1])
+    assert cache.get(key) is None
+    cache.store(capture_run(cache, key, FRAMES))
+    entry = cache.get(key)
+    assert entry.samples == 3
+    assert [frame for _, frame in entry.iter_frames()] == FRAMES
+    assert cache.describe()['hits'] == 1 and cache.describe()['misses'] == 1
+
+
+def test_invalidated_and_non_numeric_runs_are_not_stored(scripts):
+    cache = make_cache(scripts)
+    key = cache.key('model.m', [1])
+    capture = capture_run(cache, key, FRAMES)
+    capture.invalidate()
+    cache.store(capture)
+    cache.store(capture_run(cache, key, [{'t': [0.0], 'label': ['text']}]))
+    assert cache.get(key) is None
+
+
+def test_least_recently_used_runs_are_evicted(scripts):
+    cache = make_cache(scripts, max_bytes=100)  # Room for two runs of 48 bytes
+    keys = [cache.key('model.m', [i]) for i in range(3)]
+    for i, key in enumerate(keys[:2]):
+        cache.store(capture_run(cache, key, FRAMES, [i]))
+    cache.get(keys[0])
+    cache.store(capture_run(cache, keys[2], FRAMES, [2]))
+    assert set(cache.entries) == {keys[0], keys[2]}
+
+
+def test_changed_sources_drop_old_results(scripts):
+    cache = make_cache(scripts)
+    key = cache.key('model.m', [1])
+    cache.store(capture_run(cache, key, FRAMES))
+    (scripts / 'production' / 'model.m').write_text('function model(a, b, server, should_stop)\n')
+    cache.key('model.m', [1])
+    assert not cache.entries
+
+
+def record(frames, **meta):
+    recorder = recording.RunRecorder('cached', 'model.m', [1], **meta)
+    for frame in frames:
+        recorder.append_frame(frame)
+    recorder.close()
+    return recorder.id
+
+
+def test_disk_index_outlives_the_cache(scripts, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'RECORDINGS_DIR', str(tmp_path / 'recordings'))
+    cache_dir = str(tmp_path / 'cache')
+    cache = make_cache(scripts, cache_dir=cache_dir, max_bytes=0)  # Nothing fits in memory
+    key = cache.key('model.m', [1])
+    capture = capture_run(cache, key, FRAMES, speed=10.0)
+    assert not capture.in_memory
+    cache.store(capture, record(FRAMES, speed=10.0))
+    assert not cache.entries
+
+    restarted = make_cache(scripts, cache_dir=cache_dir)
+    entry = restarted.get(key)
+    assert entry.samples == 3 and entry.speed == 10.0
+    assert [frame for _, frame in entry.iter_frames()] == [
+        {'t': [0.0, 0.1], 'hr': [120.0, 121.0]}, {'t': [0.2], 'hr': [122.0]}]
+    assert key in restarted.entries
+
+
+def test_incomplete_and_dangling_index_entries_are_ignored(scripts, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'RECORDINGS_DIR', str(tmp_path / 'recordings'))
+    cache_dir = tmp_path / 'cache'
+    cache = make_cache(scripts, cache_dir=str(cache_dir))
+    key = cache.key('model.m', [1])
+    (cache_dir / f'{key}.json').write_text(f'{{"recording": "{record(FRAMES)}", "script": "model.m", '
+                                           f'"params": [1], "complete": false}}')
+    assert cache.get(key) is None
+    (cache_dir / f'{key}.json').write_text('{"recording": "missing", "script": "model.m", '
+                                           '"params": [1], "complete": true}')
+    assert cache.get(key) is None
+    assert os.listdir(cache_dir) == [f'{key}.json']
@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+
+from matlab_standin import StandinServer
+from sessions import BATCH, INTERACTIVE, WorkerPool
+
+
+class FakeSession:
+    def __init__(self, name):
+        self.name = name
+        self.preempted = asyncio.Event()
+
+    def __str__(self):
+        return self.name
+
+    def preempt(self):
+        self.preempted.set()
+
+
+def run_with_pool(test, workers=1):
+    async def main():
+        servers = [await StandinServer(0).serve('127.0.0.1') for _ in range(workers)]
+        pool = WorkerPool([('127.0.0.1', s.sockets[0].getsockname()[1]) for s in servers])
+        try:
+            await test(pool)
+        finally:
+            await pool.close()
+            for server in servers:
+                server.close()
+                await server.wait_closed()
+
+    asyncio.run(main())
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_released_worker_goes_to_interactive_sessions_first():
+    async def test(pool):
+        first = await pool.acquire(FakeSession('first'))
+        assert first.connected and pool.idle == 0
+        order = []
+
+        async def wait(name, priority):
+            worker = await pool.acquire(FakeSession(name), priority)
+            order.append(name)
+            await pool.release(worker)
+
+        waiting = [asyncio.create_task(wait('batch', BATCH))]
+        await settle()
+        waiting += [asyncio.create_task(wait(name, INTERACTIVE)) for name in ('one', 'two')]
+        await settle()
+        assert pool.waiting == 2
+        await pool.release(first)
+        await asyncio.gather(*waiting)
+        assert order == ['one', 'two', 'batch']
+        assert pool.idle == 1 and pool.waiting == 0
+
+    run_with_pool(test)
+
+
+def test_interactive_session_preempts_the_latest_batch_run():
+    async def test(pool):
+        older, newer = FakeSession('older'), FakeSession('newer')
+        await pool.acquire(older, BATCH)
+        await asyncio.sleep(0.01)
+        newer_worker = await pool.acquire(newer, BATCH)
+        interactive = asyncio.create_task(pool.acquire(FakeSession('interactive')))
+        await asyncio.wait_for(newer.preempted.wait(), 1.0)
+        assert not older.preempted.is_set()
+        await pool.release(newer_worker)
+        worker = await asyncio.wait_for(interactive, 1.0)
+        assert worker is newer_worker and str(worker.session) == 'interactive'
+        assert worker.priority == INTERACTIVE and not worker.preempted
+
+    run_with_pool(test, workers=2)
+
+
+def test_one_batch_run_is_preempted_per_waiting_session():
+    async def test(pool):
+        batch = [FakeSession('batch-a'), FakeSession('batch-b')]
+        for session in batch:
+            await pool.acquire(session, BATCH)
+        interactive = asyncio.create_task(pool.acquire(FakeSession('interactive')))
+        await settle()
+        assert sum(s.preempted.is_set() for s in batch) == 1
+        interactive.cancel()
+        await asyncio.gather(interactive, return_exceptions=True)
+        assert pool.waiting == 0
+
+    run_with_pool(test, workers=2)
+
+
+def test_cancelled_waiter_passes_the_worker_on():
+    async def test(pool):
+        first = await pool.acquire(FakeSession('first'))
+        cancelled = asyncio.create_task(pool.acquire(FakeSession('cancelled')))
+        later = asyncio.create_task(pool.acquire(FakeSession('later')))
+        await settle()
+        cancelled.cancel()
+        await pool.release(first)
+        worker = await asyncio.wait_for(later, 1.0)
+        assert str(worker.session) == 'later'
+
+    run_with_pool(test)
+
+
+def test_unreachable_worker_is_handed_on():
+    async def test(pool):
+        pool.workers[0].port = 1  # Nothing listens there
+        with pytest.raises(ConnectionError):
+            await pool.acquire(FakeSession('session'))
+        assert pool.idle == 1 and pool.workers[0].session is None
+
+    run_with_pool(test)
@@ -0,0 +1,67 @@
+import numpy as np
+
+from timeseries import RingBuffer, TimeSeriesStore
+
+
+def filled(capacity, count, batch=3):
+    buffer = RingBuffer(capacity)
+    for start in range(0, count, batch):
+        t = np.arange(start, min(start + batch, count))
+        buffer.append(t, t * 10.0, received=1.0)
+    return buffer
+
+
+def test_before_wraparound():
+    buffer = filled(10, 4)
+    t, values = buffer.arrays()
+    assert t.tolist() == [0, 1, 2, 3]
+    assert values.tolist() == [0, 10, 20, 30]
+    assert buffer.size == 4 and buffer.total == 4
+
+
+def test_wraparound_keeps_the_newest_in_order():
+    buffer = filled(5, 13)
+    t, values = buffer.arrays()
+    assert t.tolist() == [8, 9, 10, 11, 12]
+    assert values.tolist() == [80, 90, 100, 110, 120]
+    assert buffer.size == 5 and buffer.total == 13
+
+
+def test_batch_larger_than_capacity():
+    buffer = RingBuffer(4)
+    buffer.append(range(10), range(10))
+    assert buffer.arrays()[0].tolist() == [6, 7, 8, 9]
+
+
+def test_slice_across_the_wrap():
+    buffer = filled(6, 10)  # Holds 4..9, stored as [6..9 | 4, 5] after wrapping
+    assert buffer.slice(5, 8)[0].tolist() == [5, 6, 7, 8]
+    assert buffer.slice(None, 5.5)[0].tolist() == [4, 5]
+    assert buffer.slice(7)[0].tolist() == [7, 8, 9]
+    assert buffer.slice(20)[0].tolist() == []
+    assert buffer.slice(0, 3)[0].tolist() == []
+
+
+def test_latest_across_the_wrap():
+    buffer = filled(6, 10)
+    t, values = buffer.latest(3)
+    assert t.tolist() == [7, 8, 9] and values.tolist() == [70, 80, 90]
+    assert buffer.latest(1)[0].tolist() == [9]
+    assert buffer.latest(100)[0].tolist() == [4, 5, 6, 7, 8, 9]
+
+
+def test_reads_are_copies():
+    buffer = filled(4, 6)
+    t, _ = buffer.latest(2)
+    buffer.append([6, 7], [0, 0])
+    assert t.tolist() == [4, 5]
+
+
+def test_store_keeps_numeric_channels():
+    store = TimeSeriesStore(capacity=3)
+    store.append_frame({'t': [0, 1], 'heart_rate': [70, 71], 'label': ['a', 'b'], 'vector': [[1, 2], [3, 4]]})
+    store.append_frame({'t': [2, 3], 'heart_rate': [72, None]})
+    assert list(store.channels) == ['heart_rate']
+    t, values = store.slice('heart_rate')
+    assert t.tolist() == [1, 2, 3]
+    assert values[:2].tolist() == [71, 72] and np.isnan(values[2])
@@ -0,0 +1,137 @@
+"""In-memory time-series history of a run, kept in preallocated NumPy ring buffers"""
+import time
+
+import numpy as np  # type: ignore
+
+import settings
+
+
+class RingBuffer:
+    """Fixed-capacity buffer of (t, value, arrival time) samples for one channel.
+
+    Storage is allocated once; appending writes into it and, when full,
+    overwrites the oldest samples. Reads return copies in time order.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.t = np.empty(capacity, dtype=np.float64)
+        self.values = np.empty(capacity, dtype=np.float64)
+        self.received = np.empty(capacity, dtype=np.float64)  # Wall-clock arrival, seconds since epoch
+        self.size = 0
+        self.total = 0  # Samples ever appended, including evicted ones
+        self._head = 0  # Next write position
+
+    def append(self, t, values, received=None):
+        """Append a batch of samples; ``t`` and ``values`` are equal-length sequences"""
+        values = np.asarray(values, dtype=np.float64)
+        t = np.asarray(t, dtype=np.float64)
+        count = len(values)
+        if count == 0:
+            return
+        if count > self.capacity:
+            # Only the newest samples fit
+            t, values, count = t[-self.capacity:], values[-self.capacity:], self.capacity
+        received = time.time() if received is None else received
+
+        first = min(count, self.capacity - self._head)
+        end = self._head + first
+        self.t[self._head:end] = t[:first]
+        self.values[self._head:end] = values[:first]
+        self.received[self._head:end] = received
+        rest = count - first
+        if rest:
+            self.t[:rest] = t[first:]
+            self.values[:rest] = values[first:]
+            self.received[:rest] = received
+
+        self._head = (self._head + count) % self.capacity
+        self.size = min(self.capacity, self.size + count)
+        self.total += count
+
+    def _segments(self):
+        """Storage ranges holding the samples oldest first: one, or two once the buffer wrapped"""
+        if self.size < self.capacity:
+            return [(0, self.size)]
+        return [(self._head, self.capacity), (0, self._head)]
+
+    def _search(self, value, side):
+        """Position of ``value`` among the held samples in time order, like np.searchsorted"""
+        offset = 0
+        for begin, end in self._segments():
+            position = int(np.searchsorted(self.t[begin:end], value, side=side))
+            if position < end - begin:
+                return offset + position
+            offset += end - begin
+        return offset
+
+    def _range(self, lo, hi):
+        """Copy (t, values) of the samples from position lo to hi in time order, touching only those rows"""
+        parts = []
+        offset = 0
+        for begin, end in self._segments():
+            a, b = max(lo - offset, 0), min(hi - offset, end - begin)
+            if a < b:
+                parts.append((begin + a, begin + b))
+            offset += end - begin
+        if not parts:
+            return np.empty(0), np.empty(0)
+        if len(parts) == 1:
+            a, b = parts[0]
+            return self.t[a:b].copy(), self.values[a:b].copy()
+        return (np.concatenate([self.t[a:b] for a, b in parts]),
+                np.concatenate([self.values[a:b] for a, b in parts]))
+
+    def arrays(self):
+        """Return (t, values) of everything held, oldest first"""
+        return self._range(0, self.size)
+
+    def slice(self, start=None, end=None):
+        """Return (t, values) for start <= t <= end; either bound may be None"""
+        lo = 0 if start is None else self._search(start, 'left')
+        hi = self.size if end is None else self._search(end, 'right')
+        return self._range(lo, hi)
+
+    def latest(self, count):
+        """Return (t, values) of the newest ``count`` samples"""
+        return self._range(max(self.size - count, 0), self.size)
+
+    def clear(self):
+        self.size = 0
+        self.total = 0
+        self._head = 0
+
+
+class TimeSeriesStore:
+    """Ring buffers for every numeric channel a run produces (heart_rate, oxygen_level, ...)"""
+
+    def __init__(self, capacity=None):
+        self.capacity = capacity or settings.HISTORY_CAPACITY
+        self.channels = {}
+
+    def append_frame(self, frame):
+        """Store the numeric channels of a columnar {"t": [...], channel: [...]} frame"""
+        t = frame['t']
+        received = time.time()
+        for name, values in frame.items():
+            if name == 't':
+                continue
+            try:
+                column = np.asarray(values, dtype=np.float64)  # MATLAB NaN arrives as None -> nan
+            except (TypeError, ValueError):
+                continue  # Non-scalar samples (e.g. vectors per cycle) are not kept
+            if column.ndim != 1:
+                continue
+            buffer = self.channels.get(name)
+            if buffer is None:
+                buffer = self.channels[name] = RingBuffer(self.capacity)
+            buffer.append(t, column, received)
+
+    def slice(self, name, start=None, end=None):
+        return self.channels[name].slice(start, end)
+
+    def latest(self, name, count):
+        return self.channels[name].latest(count)
+
+    def clear(self):
+        self.channels.clear()
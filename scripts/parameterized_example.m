@@ -25,7 +25,8 @@ function result = parameterized_example(heart_rate, oxygen_level, num_cycles, sy
     %       should_stop - boolean to indicate if calculation should stop
     %
     %   Output:
-    %       result - final parameters if updated, empty otherwise
+    %       result - empty; updated parameters are applied in place from the
+    %                next cycle on (see apply_update.m)
     
     % Log received parameters
     disp(['MATLAB: Starting simulation with heart_rate=' num2str(heart_rate) ...
@@ -35,16 +36,23 @@ function result = parameterized_example(heart_rate, oxygen_level, num_cycles, sy
     % Calculate time per cycle (in seconds)
     cycle_time = 60 / heart_rate;
     
-    % Main simulation loop for each heartbeat cycle
-    for cycle = 1:num_cycles
-        % Check for messages and process commands
-        [should_stop, new_params] = check_messages(server);
+    result = [];
+    
+    % Main simulation loop for each heartbeat cycle; an update may change num_cycles
+    cycle = 1;
+    while cycle <= num_cycles
+        % Check for messages and process commands, waiting for a send credit
+        [should_stop, new_params] = await_credit(server);
         
-        % If we received new parameters, send acknowledgment and return them
+        % Apply new parameters (acknowledged by check_messages) from this cycle on
         if ~isempty(new_params)
-            send_message(server, struct('status', 'updated'), 'update acknowledgment');
-            result = new_params;
-            return;
+            params = apply_update(server, new_params, cycle);
+            [heart_rate, oxygen_level, num_cycles, systolic_bp, diastolic_bp] = params{:};
+            cycle_time = 60 / heart_rate;
+            if ~should_stop
+                % Wait for this cycle's send credit again; a lower num_cycles may end the run
+                continue;
+            end
         end
         
         % Check if we should stop
@@ -79,8 +87,9 @@ function result = parameterized_example(heart_rate, oxygen_level, num_cycles, sy
                            'diastolic_bp', current_diastolic);
         send_message(server, vital_signs, 'vital signs data');
         
-        % Wait for next cycle (simulating real-time)
-        pause(cycle_time);
+        % Wait for next cycle (real time, or faster at the run's speed)
+        pace(cycle_time);
+        cycle = cycle + 1;
     end
     
     disp('MATLAB: Simulation complete');
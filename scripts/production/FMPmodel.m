@@ -117,12 +117,11 @@ function result = FMPmodel(vMother, vUterus, vFoetus, vUmbilical, vBrain, vCAVmo
 
     % Main simulation loop for each heartbeat cycle
     while icycle<=ncyclemax
-        % Check for messages and process commands
-        [should_stop, new_params] = check_messages(server);
+        % Check for messages and process commands, waiting for a send credit
+        [should_stop, new_params] = await_credit(server);
         
-        % If we received new parameters, send acknowledgment and return them
+        % If we received new parameters (acknowledged by check_messages), return them
         if ~isempty(new_params)
-            send_message(server, struct('status', 'updated'), 'update acknowledgment');
             result = new_params;
             return;
         end
@@ -392,8 +391,8 @@ function result = FMPmodel(vMother, vUterus, vFoetus, vUmbilical, vBrain, vCAVmo
                            'fTvs', fTvs);
         send_message(server, FMP_data, 'FMP model data');
         
-        % Wait for next cycle (simulating real-time)
-        pause(cycle_time);
+        % Wait for next cycle (real time, or faster at the run's speed)
+        pace(cycle_time);
     end
     
     disp('MATLAB: Simulation complete');
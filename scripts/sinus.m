@@ -40,35 +40,34 @@ function result = sinus(a, f, ts, tsp, te, server, should_stop)
     % Calculate in chunks of 100 points
     chunk_size = 100;
     result = [];
+    chunk = 1;  % Chunks sent since the start; updates take effect at a chunk
     
     % Continuous loop until server disconnects or should_stop is true
     while true
-        % Check for messages and process commands
-        [should_stop, new_params] = check_messages(server);
-        
-        % If we received new parameters, send acknowledgment and return them
-        if ~isempty(new_params)
-            send_message(server, struct('status', 'updated'), 'update acknowledgment');
-            result = new_params;
-            return;
-        end
-        
-        % Check if we should stop
-        if should_stop || ~server.Connected
-            disp('MATLAB: Received stop signal or server disconnected, stopping calculation');
-            break;
-        end
-        
         % Reset result for this cycle
         result = [];
         
-        for i = 1:chunk_size:num_points
+        i = 1;
+        while i <= num_points
+            % Check for messages and process commands, waiting for a send credit
+            [should_stop, new_params] = await_credit(server);
+            
             % Check if we should stop
             if should_stop || ~server.Connected
                 disp('MATLAB: Received stop signal or server disconnected, stopping calculation');
                 break;
             end
             
+            % Apply new parameters (acknowledged by check_messages) from this chunk on,
+            % continuing at the same point of the wave
+            if ~isempty(new_params)
+                params = apply_update(server, new_params, chunk);
+                [a, f, ts, tsp, te] = params{:};
+                num_points = floor((te - ts) / tsp) + 1;
+                T = linspace(ts, te, num_points);
+                continue;
+            end
+            
             % Calculate end index for this chunk
             end_idx = min(i + chunk_size - 1, num_points);
             
@@ -81,9 +80,11 @@ function result = sinus(a, f, ts, tsp, te, server, should_stop)
             
             % Send this chunk to the server
             send_message(server, chunk_y, 'data chunk');
+            i = end_idx + 1;
+            chunk = chunk + 1;
             
             % Add a small pause between chunks to allow for message processing
-            pause(0.05);
+            pace(0.05);
         end
         
         if should_stop || ~server.Connected
@@ -94,7 +95,7 @@ function result = sinus(a, f, ts, tsp, te, server, should_stop)
         disp('MATLAB: Cycle complete, starting next cycle');
         
         % Add a longer delay between cycles
-        pause(0.2);
+        pace(0.2);
     end
     
     disp('MATLAB: Continuous calculation stopped');
@@ -43,16 +43,39 @@ try
     % Create TCP/IP server
     server = tcpserver('0.0.0.0', 12345);
     disp('MATLAB: Server created successfully');
+    % Messages in both directions are newline-terminated JSON frames
+    configureTerminator(server, "LF");
     cleanupObj = onCleanup(@() delete(server));
     
     % Keep MATLAB running and listening for connections
     disp('MATLAB: Server started on port 12345');
     disp('MATLAB: Waiting for client connection...');
     
+    % Set by check_messages when a stop or reset command arrives, also while a script runs
+    global stop_requested
+    stop_requested = false;
+    
+    % Run mode and flow control of the current run, from its start command: pace.m waits
+    % simulated time divided by run_speed (0 does not wait), and send_message uses up
+    % send_credits, which the controller grants through check_messages
+    global run_speed send_credits
+    run_speed = 1;
+    send_credits = Inf;
+    
+    % Parameters of an update the running script has not applied yet (see apply_update.m);
+    % a script that returns instead is run again with them
+    global pending_params
+    pending_params = [];
+    
+    % Parameters the running script applied in place; the next run of a repeating script uses them
+    global applied_params
+    applied_params = [];
+    
     % Initialize variables for continuous operation
     current_script = '';
     current_params = [];
     is_running = false;
+    repeat_script = true;  % False runs the script once and reports completed (batch runs)
     should_stop = false;
     is_updating = false;  % Flag to track update state
     update_pending = false;  % Flag to track pending updates
@@ -66,7 +89,10 @@ try
     while true
         % Check if client is connected
         if ~server.Connected
+            % A new connection is a new controller; do not resume the old run
             disp('MATLAB: Client disconnected, waiting for new connection...');
+            is_running = false;
+            current_script = '';
             while ~server.Connected
                 pause(0.1);
             end
@@ -76,20 +102,36 @@ try
         
         % Check for messages using utility function
         [should_stop, new_params, script_info] = check_messages(server);
+        if stop_requested
+            % Stop or reset while idle
+            stop_requested = false;
+            is_running = false;
+            current_script = '';
+        end
         
         % Handle new parameters if received
         if ~isempty(new_params)
             current_params = new_params;
+            pending_params = [];
             disp(['MATLAB: Updated parameters to: ' jsonencode(current_params)]);
             should_stop = true;  % Stop current execution to restart with new params
+            if is_running
+                % Between two runs of the script: confirm that the next one starts with them
+                apply_update(server, new_params, 1);
+            end
         end
         
         % Handle start command if received
         if ~isempty(script_info)
             current_script = script_info.script;
             current_params = script_info.params;
+            repeat_script = script_info.repeat;
+            applied_params = [];
+            run_speed = script_info.speed;
+            send_credits = script_info.credits;
             is_running = true;
             should_stop = false;
+            stop_requested = false;
             disp(['MATLAB: Starting continuous execution of ' current_script]);
         end
         
@@ -112,31 +154,50 @@ try
                 % Execute the script
                 result = feval(current_script(1:end-2), all_args{:});
                 
+                if stop_requested
+                    % The script returned because of a stop or reset command; its
+                    % acknowledgment was the last message of the run
+                    disp('MATLAB: Script stopped by command');
+                    stop_requested = false;
+                    is_running = false;
+                    current_script = '';
+                    continue;
+                end
+                
+                if ~isempty(pending_params)
+                    % The script returned an update instead of applying it; run it again
+                    % from its first cycle with the new parameters, without a pause
+                    current_params = apply_update(server, pending_params, 1);
+                    continue;
+                end
+                
+                if ~isempty(applied_params)
+                    % Keep the parameters the script applied for its next run
+                    current_params = applied_params;
+                    applied_params = [];
+                end
+                
                 % Send result using utility function
                 send_message(server, result, 'result');
                 
-                % Check if we got new parameters from the script
-                if (isequal(size(result), [1 5]) || isequal(size(result), [5 1])) && isnumeric(result)
-                    disp(['MATLAB: Received new parameters from script: ' jsonencode(result)]);
-                    % Convert to row vector if needed
-                    if size(result, 1) > size(result, 2)
-                        result = result';
-                    end
-                    current_params = result;
-                    disp(['MATLAB: Updated current_params to: ' jsonencode(current_params)]);
+                if ~repeat_script
+                    % Single run: report it and wait for the next command
+                    send_message(server, struct('status', 'completed'), 'completed');
+                    is_running = false;
+                    current_script = '';
+                    continue;
                 end
                 
                 if should_stop
                     disp('MATLAB: Script stopped by command');
                     is_running = false;
                     should_stop = false;  % Reset should_stop for next execution
-                    % Add a small delay to ensure acknowledgment is sent
-                    pause(0.1);
                     continue;  % Continue to next iteration to restart with new parameters
                 else
                     disp(['MATLAB: Cycle complete, starting next cycle']);
                     % Add a longer pause between cycles to allow for message processing
-                    pause(0.5);
+                    % (shorter in faster-than-real-time runs)
+                    pace(0.5);
                 end
             catch e
                 disp(['MATLAB: Error executing script: ' e.message]);
@@ -144,8 +205,8 @@ try
                 is_running = false;
             end
         else
-            % If not running, add a small pause to prevent CPU spinning
-            pause(0.1);
+            % If not running, poll briefly so commands are answered within milliseconds
+            pause(0.01);
         end
     end 
 catch e
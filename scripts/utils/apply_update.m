@@ -0,0 +1,33 @@
+function params = apply_update(server, new_params, cycle)
+    % APPLY_UPDATE Take over updated parameters at a cycle boundary and confirm them
+    %   params = apply_update(server, new_params, cycle) is called by a
+    %   script that received new_params from check_messages or await_credit
+    %   and applies them in place, keeping its state and time base instead
+    %   of returning them to startup.m to be run again. It tells the
+    %   controller which parameters are in effect from which cycle, with
+    %   {"status": "applied", "params": [...], "cycle": n}, and returns
+    %   them as a row cell array for the script to unpack:
+    %
+    %       params = apply_update(server, new_params, cycle);
+    %       [heart_rate, oxygen_level, num_cycles] = params{:};
+    %
+    %   Input:
+    %       server - TCP/IP server connection
+    %       new_params - parameters of the update command
+    %       cycle - index of the first cycle run with the new parameters
+    %
+    %   Output:
+    %       params - the new parameters as a 1xN cell array
+
+    global pending_params applied_params
+    pending_params = [];
+
+    if iscell(new_params)
+        params = reshape(new_params, 1, []);
+    else
+        params = num2cell(reshape(new_params, 1, []));
+    end
+    applied_params = params;
+    disp(['MATLAB: Applying parameters ' jsonencode(params) ' from cycle ' num2str(cycle)]);
+    send_message(server, struct('status', 'applied', 'params', {params}, 'cycle', cycle), 'applied');
+end
@@ -0,0 +1,29 @@
+function [should_stop, new_params] = await_credit(server)
+    % AWAIT_CREDIT Check for messages, waiting until the controller allows another data message
+    %   [should_stop, new_params] = await_credit(server) is check_messages for
+    %   the top of a script's loop. The start command grants the run a
+    %   window of send credits, every message sent with send_message uses
+    %   one, and the controller grants more as it consumes them. While none
+    %   are left this keeps processing commands until a credit grant, a
+    %   stop or an update arrives, so an unthrottled run never gets more
+    %   than the window ahead of the controller.
+    %
+    %   Input:
+    %       server - TCP/IP server connection
+    %
+    %   Output:
+    %       should_stop - boolean indicating if processing should stop
+    %       new_params - struct containing new parameters if an update command
+    %                   was received, empty otherwise
+
+    global send_credits
+
+    while true
+        [should_stop, new_params] = check_messages(server);
+        if should_stop || ~isempty(new_params) || isempty(send_credits) || send_credits > 0
+            return;
+        end
+        % Out of credits: poll for the controller's grant
+        pause(0.005);
+    end
+end
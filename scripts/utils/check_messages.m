@@ -2,6 +2,17 @@ function [should_stop, new_params, script_info] = check_messages(server)
     % CHECK_MESSAGES Check for incoming messages and process commands
     %   [should_stop, new_params, script_info] = check_messages(server) checks for incoming
     %   messages on the server connection and processes any commands.
+    %   Commands are newline-terminated JSON frames; every complete frame
+    %   waiting on the connection is processed, so commands that arrive
+    %   together are not lost. Start, update, stop, reset and ping are
+    %   acknowledged here, echoing the command's id so the controller can
+    %   match the reply. Stop and reset also set the global stop_requested
+    %   flag, so startup.m ends the run instead of running the script again.
+    %   Credit commands are not acknowledged; they add to the run's send
+    %   credits (see await_credit.m). An update is acknowledged when it
+    %   arrives and also kept in the global pending_params until the script
+    %   applies it at its next cycle boundary (see apply_update.m), or
+    %   startup.m runs the script again with it.
     %
     %   Input:
     %       server - TCP/IP server connection
@@ -10,18 +21,24 @@ function [should_stop, new_params, script_info] = check_messages(server)
     %       should_stop - boolean indicating if processing should stop
     %       new_params - struct containing new parameters if an update command
     %                   was received, empty otherwise
-    %       script_info - struct containing script and params for start command,
-    %                    empty otherwise
+    %       script_info - struct containing script, params, repeat (false
+    %                    to run the script once), speed (1 real time, N
+    %                    times faster, 0 unthrottled) and credits (the send
+    %                    credit window, Inf without flow control) for start
+    %                    command, empty otherwise
     
     should_stop = false;
     new_params = [];
     script_info = [];
     
-    % Check if there are any pending commands
-    if server.NumBytesAvailable > 0
+    % Process every pending command frame
+    while server.Connected && server.NumBytesAvailable > 0
         try
-            % Read and process the command
-            data = read(server, server.NumBytesAvailable, "char");
+            % Read one frame and process the command
+            data = readline(server);
+            if isempty(data) || strlength(strtrim(data)) == 0
+                continue;
+            end
             command = jsondecode(data);
             
             if isfield(command, 'type')
@@ -30,27 +47,53 @@ function [should_stop, new_params, script_info] = check_messages(server)
                         disp('MATLAB: Update command received');
                         disp(['MATLAB: Processing update with params: ' jsonencode(command.params)]);
                         new_params = command.params;
+                        request_update(new_params);
+                        send_ack(server, command, struct('status', 'updated'));
                         
                     case 'stop'
                         disp('MATLAB: Stop command received');
                         should_stop = true;
+                        % Tell startup.m not to run the script again
+                        request_stop();
                         % Send acknowledgment with stop reason
-                        if server.Connected
-                            write(server, jsonencode(struct('status', 'stopped', 'reason', 'command')), "char");
-                            disp('MATLAB: Sent stop acknowledgment (command)');
-                        end
+                        send_ack(server, command, struct('status', 'stopped', 'reason', 'command'));
+                        
+                    case 'reset'
+                        % End of a session on a reused connection: stop and forget the script
+                        disp('MATLAB: Reset command received');
+                        should_stop = true;
+                        request_stop();
+                        send_ack(server, command, struct('status', 'reset'));
+                        
+                    case 'credit'
+                        % The controller consumed messages of the run; send as many more
+                        grant_credits(command.credits);
+                        
+                    case 'ping'
+                        % Health check of the connection
+                        send_ack(server, command, struct('status', 'pong'));
                         
                     case 'start'
                         disp('MATLAB: Start command received');
                         if isfield(command, 'script')
-                            script_info = struct('script', command.script, 'params', command.params);
-                            % Send acknowledgment
-                            if server.Connected
-                                write(server, jsonencode(struct('status', 'started')), "char");
-                                disp('MATLAB: Sent start acknowledgment');
+                            script_info = struct('script', command.script, 'params', command.params, 'repeat', true, ...
+                                                 'speed', 1, 'credits', Inf);
+                            % Batch runs ask for a single run of the script
+                            if isfield(command, 'repeat')
+                                script_info.repeat = logical(command.repeat);
+                            end
+                            % Run mode and flow control; older controllers send neither
+                            if isfield(command, 'speed')
+                                script_info.speed = command.speed;
+                            end
+                            if isfield(command, 'credits')
+                                script_info.credits = command.credits;
                             end
+                            % Send acknowledgment
+                            send_ack(server, command, struct('status', 'started'));
                         else
                             disp('MATLAB: Start command missing script field');
+                            send_ack(server, command, struct('error', 'Start command missing script field'));
                         end
                         
                     otherwise
@@ -67,4 +110,32 @@ function [should_stop, new_params, script_info] = check_messages(server)
         should_stop = true;
         disp('MATLAB: Server disconnected in check_messages');
     end
-end
\ No newline at end of file
+end
+
+function send_ack(server, command, ack)
+    % SEND_ACK Acknowledge a command, echoing its id when it has one
+    if isfield(command, 'id')
+        ack.id = command.id;
+    end
+    send_message(server, ack, [command.type ' acknowledgment']);
+end
+
+function request_update(params)
+    % REQUEST_UPDATE Keep the parameters until the script or startup.m applies them
+    global pending_params
+    pending_params = params;
+end
+
+function request_stop()
+    % REQUEST_STOP Flag the stop for startup.m, which owns the run state
+    global stop_requested
+    stop_requested = true;
+end
+
+function grant_credits(credits)
+    % GRANT_CREDITS Add to the send credits of the run, which send_message uses up
+    global send_credits
+    if ~isempty(send_credits)
+        send_credits = send_credits + credits;
+    end
+end
@@ -0,0 +1,21 @@
+function pace(seconds)
+    % PACE Wait out simulated time at the speed of the run
+    %   pace(seconds) replaces pause(seconds) in a script's loop. The start
+    %   command's speed sets how long that takes: 1 waits in real time, N
+    %   waits seconds / N, and 0 (unthrottled) does not wait at all, so the
+    %   run goes as fast as MATLAB computes and the controller's send
+    %   credits allow (see await_credit.m).
+    %
+    %   Input:
+    %       seconds - simulated time of one cycle, in seconds
+
+    global run_speed
+    speed = 1;
+    if ~isempty(run_speed)
+        speed = run_speed;
+    end
+
+    if speed > 0
+        pause(seconds / speed);
+    end
+end
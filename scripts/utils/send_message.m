@@ -2,6 +2,10 @@ function success = send_message(server, message, message_type)
     % SEND_MESSAGE Send a message to the server
     %   success = send_message(server, message, message_type) sends a message
     %   to the server and returns whether the operation was successful.
+    %   Each message is JSON encoded and framed by the "LF" terminator, so
+    %   the controller can split coalesced writes back into messages.
+    %   Every message but a command acknowledgment uses one of the run's
+    %   send credits; scripts wait for credits with await_credit.m.
     %
     %   Input:
     %       server - TCP/IP server connection
@@ -18,14 +22,19 @@ function success = send_message(server, message, message_type)
         return;
     end
     
+    % Acknowledgments carry the command's id and are outside flow control
+    if ~(isstruct(message) && isfield(message, 'id'))
+        use_credit();
+    end
+    
     try
         % Convert message to JSON if it's not already a string
         if ~ischar(message)
             message = jsonencode(message);
         end
         
-        % Send the message
-        write(server, message, "char");
+        % Send the message as one newline-terminated frame (see startup.m)
+        writeline(server, message);
         
         % Log the message if type is provided
         if nargin > 2
@@ -36,4 +45,12 @@ function success = send_message(server, message, message_type)
     catch e
         disp(['MATLAB: Error sending message: ' e.message]);
     end
-end 
\ No newline at end of file
+end 
+
+function use_credit()
+    % USE_CREDIT Count a message against the run's send credits
+    global send_credits
+    if ~isempty(send_credits)
+        send_credits = send_credits - 1;
+    end
+end